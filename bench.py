@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# Performans ölçümleri — eğitilmiş model_out/model.bundle üzerinde çalışır (önce `python proje.py`).
+#   python bench.py neighbor [N]   : nearest_neighbor_anchor (ters ICD indeksi) vs tam tarama
+#   python bench.py guardrails [N] : guardrails (alt-küme indeksi) vs tam tarama
+#   python bench.py lsh [N] [min_aday] : NEIGHBOR_MODE="lsh" vs tam — gecikme, recall@K ve tahmin sapması (LSH_RECALL taraması)
+#   python bench.py batch [N]      : tek tek predict_one + xgb_predict_ens vs *_many toplu yol
+#   python bench.py many [N]       : satır satır predict_one vs predict_many(df) — lkp3 kombinasyonları + N görülmemiş vaka
+#   python bench.py microbatch [N] [window_ms] : server._predict eşzamanlılık 1/4/16/64, mikro-toplama açık vs kapalı
+#   python bench.py workers [N] [max_workers]  : gunicorn -c gunicorn.conf.py, worker sayısına göre istek/s ve toplam PSS (preload açık/kapalı)
+import os, sys, json, time, random, asyncio, threading, subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import motor
+
+
+def unseen_queries(m: motor.LosModel, n: int, seed: int = 42):
+    """Formdaki tipik durum: lookup'ta OLMAYAN (YaşGrup, Bölüm, ICD seti) — gözlenen bir sete 1 ICD eklenir/çıkarılır."""
+    rnd = random.Random(seed)
+    demos = list(m.ctx3_by_demo)
+    ygs = sorted({yg for yg, _b in demos})
+    bolums = sorted({b for _yg, b in demos})
+    icds = sorted({c for key in m.lkp1_map for c in motor.as_set(key)})
+    out = []
+    while len(out) < n:
+        yg, b = rnd.choice(demos) if rnd.random() < 0.8 else (rnd.choice(ygs), rnd.choice(bolums))
+        keys = m.ctx3_by_demo.get((yg, b)) or list(m.lkp1_map)
+        S = motor.as_set(rnd.choice(keys))
+        if len(S) > 1 and rnd.random() < 0.3:
+            S.discard(rnd.choice(sorted(S)))
+        else:
+            S.add(rnd.choice(icds))
+        key = motor.as_key(S)
+        if m.find_anchor(yg, b, key)[0] is None:
+            out.append((yg, b, key))
+    return out
+
+def _timeit(fn, queries):
+    t0 = time.perf_counter()
+    res = [fn(*q) for q in queries]
+    return time.perf_counter() - t0, res
+
+def bench_neighbor(m: motor.LosModel, n: int = 2000):
+    print(f"Kapsamlar: 3D demo={len(m.scope3)} (aday={sum(len(s) for s in m.scope3.values())}), "
+          f"2D bölüm={len(m.scope2)} (aday={sum(len(s) for s in m.scope2.values())}), 1D aday={len(m.scope1)}")
+    q = unseen_queries(m, n)
+    t_scan, r_scan = _timeit(m.nearest_neighbor_anchor_scan, q)
+    t_idx, r_idx = _timeit(m.nearest_neighbor_anchor, q)
+    same = sum(a == b for a, b in zip(r_scan, r_idx))
+    print(f"neighbor  n={len(q)}  tarama={t_scan*1e3/len(q):.3f} ms/istek  indeks={t_idx*1e3/len(q):.3f} ms/istek  "
+          f"hızlanma={t_scan/t_idx:.1f}x  aynı sonuç={same}/{len(q)}")
+
+def bench_guardrails(m: motor.LosModel, n: int = 2000):
+    q = [(yg, b, key, 0.0) for yg, b, key in unseen_queries(m, n)]
+    sizes = [len(motor.as_set(key)) for _yg, _b, key, _p in q]
+    t_scan, r_scan = _timeit(m.guardrails_scan, q)
+    t_idx, r_idx = _timeit(m.guardrails, q)
+    same = sum(a == b for a, b in zip(r_scan, r_idx))
+    print(f"guardrails  n={len(q)}  |T| ort={sum(sizes)/len(sizes):.2f} max={max(sizes)}  "
+          f"tarama={t_scan*1e3/len(q):.3f} ms/istek  indeks={t_idx*1e3/len(q):.4f} ms/istek  "
+          f"hızlanma={t_scan/t_idx:.0f}x  aynı floor={same}/{len(q)}")
+
+def _neighbor_scope(m: motor.LosModel, yg: str, b: str):
+    for s in (m.scope3.get((yg, b)), m.scope2.get(b), m.scope1):
+        if s is not None and len(s):
+            return s
+    return None
+
+def bench_lsh(m: motor.LosModel, n: int = 2000, min_candidates: int = motor.LSH_MIN_CANDIDATES):
+    motor.LSH_MIN_CANDIDATES = min_candidates
+    q = unseen_queries(m, n, seed=7)
+    K = m.TOPK_NEIGHBORS
+
+    def topk_keys():
+        out = []
+        for yg, b, key in q:
+            s = _neighbor_scope(m, yg, b)
+            ids, unknown = m.vocab.encode(key)
+            out.append({r[3] for r in s.scored(ids, len(ids) + len(unknown), K)[:K]} if s is not None else set())
+        return out
+
+    enc = [(ids, len(ids) + len(unknown)) for ids, unknown in (m.vocab.encode(key) for _yg, _b, key in q)]
+
+    def scope1_topk():
+        t0 = time.perf_counter()
+        res = [{r[3] for r in m.scope1.scored(ids, t, K)[:K]} for ids, t in enc]
+        return (time.perf_counter() - t0) * 1e3 / len(enc), res
+
+    m.NEIGHBOR_MODE = "exact"
+    m._build_lsh_index()
+    t1_exact, top1_exact = scope1_topk()
+    t_nn, r_nn = _timeit(m.nearest_neighbor_anchor, q)
+    t_pred, r_pred = _timeit(m.predict_one, q)
+    exact_top = topk_keys()
+    print(f"exact  n={len(q)}  1D kapsam ({len(m.scope1)} aday)={t1_exact:.3f} ms/istek  "
+          f"komşu={t_nn*1e3/len(q):.3f} ms/istek  predict_one={t_pred*1e3/len(q):.3f} ms/istek")
+
+    m.NEIGHBOR_MODE = "lsh"
+    for recall in (0.8, 0.9, 0.95, 0.99):
+        m.LSH_RECALL = recall
+        t0 = time.perf_counter()
+        m._build_lsh_index()
+        t_build = time.perf_counter() - t0
+        n_lsh = sum(s.lsh is not None for s in [m.scope1, *m.scope2.values(), *m.scope3.values()])
+        t1_lsh, top1_lsh = scope1_topk()
+        rec1 = [len(a & e) / len(e) for a, e in zip(top1_lsh, top1_exact) if e]
+        t_nn_a, r_nn_a = _timeit(m.nearest_neighbor_anchor, q)
+        t_pred_a, r_pred_a = _timeit(m.predict_one, q)
+        got = topk_keys()
+        rec = [len(a & e) / len(e) for a, e in zip(got, exact_top) if e]
+        diff = [abs(a[0] - e[0]) for a, e in zip(r_pred_a, r_pred)]
+        moved = sum(d > 0 for d in diff)
+        rounded = sum(m.round_half_up(a[0]) != m.round_half_up(e[0]) for a, e in zip(r_pred_a, r_pred))
+        print(f"lsh  LSH_RECALL={recall:.2f}  bant={motor.lsh_bands(recall, m.LSH_MIN_J)}  kapsam={n_lsh}  "
+              f"kurulum={t_build:.2f}s  1D kapsam={t1_lsh:.3f} ms/istek recall@{K}={sum(rec1)/max(1, len(rec1)):.3f}  komşu={t_nn_a*1e3/len(q):.3f} ms/istek  predict_one={t_pred_a*1e3/len(q):.3f} ms/istek  "
+              f"recall@{K}={sum(rec)/max(1, len(rec)):.3f}  aynı anchor={sum(a == e for a, e in zip(r_nn_a, r_nn))}/{len(q)}  "
+              f"sapma: değişen={moved}  ort={sum(diff)/len(diff):.4f}  max={max(diff):.3f} gün  yuvarlanmış LOS değişen={rounded}")
+    m.NEIGHBOR_MODE = "exact"
+    m._build_lsh_index()
+
+def bench_batch(m: motor.LosModel, n: int = 1000):
+    q = unseen_queries(m, n // 2) + [k for k in list(m.lkp3_map)[:n - n // 2]]
+    for size in (1, 10, 100, len(q)):
+        part = q[:size]
+        t0 = time.perf_counter()
+        one = [(m.predict_one(yg, b, key)[0], m.xgb_predict_ens(yg, b, key, None)[2]) for yg, b, key in part]
+        t1 = time.perf_counter()
+        rules = m.predict_one_many(part)
+        _, _, p_ens = m.xgb_predict_ens_many([(yg, b, key, None) for yg, b, key in part])
+        t2 = time.perf_counter()
+        same = sum(a == (r[0], e) for a, r, e in zip(one, rules, p_ens.tolist()))
+        print(f"batch  boyut={size:5d}  tek tek={(t1-t0)*1e3:9.2f} ms  toplu={(t2-t1)*1e3:8.2f} ms  "
+              f"hızlanma={(t1-t0)/(t2-t1):.1f}x  aynı sonuç={same}/{size}")
+
+def bench_many(m: motor.LosModel, n: int = 3000):
+    import pandas as pd
+    q = list(m.lkp3_map) + unseen_queries(m, n, seed=11)
+    df = pd.DataFrame(q, columns=["YaşGrup", "Bölüm", "ICD_Set_Key"])
+    for g in (False, True):
+        m.GUARDRAILS_ON = g
+        t_one, one = _timeit(m.predict_one, q)
+        t0 = time.perf_counter()
+        many = m.predict_many(df)
+        t_many = time.perf_counter() - t0
+        same = sum(p == r.PRED_RULE and meta == {c: getattr(r, c) for c in motor.META_COLUMNS}
+                   for (p, meta), r in zip(one, many.itertuples(index=False)))
+        print(f"many  guardrails={g}  satır={len(q)} (görülmemiş={n})  predict_one={t_one:.2f}s  predict_many={t_many:.2f}s  "
+              f"hızlanma={t_one/t_many:.1f}x  aynı sonuç={same}/{len(q)}")
+
+def bench_microbatch(m: motor.LosModel, n: int = 2000, window_ms: int = 2):
+    import server, yurutucu  # servis katmanı (FastAPI) yalnız bu ölçümde gerekir
+    server._pred_cache.maxsize = 0  # her istek canlı yoldan geçsin
+    m.pred_table = {}
+    q = unseen_queries(m, n, seed=3)
+
+    async def run(conc):
+        sem = asyncio.Semaphore(conc)
+        async def one(yg, b, key):
+            async with sem:
+                return await server._predict(m, yg, b, key, key.split("||"))
+        t0 = time.perf_counter()
+        res = await asyncio.gather(*[one(*x) for x in q])
+        return time.perf_counter() - t0, res
+
+    ref = None
+    for max_batch in (1, 64):
+        for conc in (1, 4, 16, 64):
+            server._batcher = yurutucu.MicroBatcher(server._executor, server._predict_live_batch, window_ms, max_batch)
+            el, res = asyncio.run(run(conc))
+            ref = ref or res
+            st = server._batcher.stats()
+            print(f"microbatch  max_batch={max_batch:2d} window={window_ms}ms  eşzamanlı={conc:2d}  {len(q)/el:6.0f} tahmin/s  "
+                  f"ort. toplama={st['mean_batch']:.1f}  aynı sonuç={sum(a == b for a, b in zip(res, ref))}/{len(q)}")
+
+def _tree_pss_mb(pid: int) -> float:
+    """Süreç + çocuklarının toplam PSS'i (paylaşılan sayfalar paylaşanlara bölünür) — Linux /proc."""
+    pids, total = [pid], 0
+    while pids:
+        p = pids.pop()
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return total / 1024
+
+def _post_json(conn: http.client.HTTPConnection, path: str, payload) -> int:
+    conn.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    resp.read()
+    return resp.status
+
+def bench_workers(m: motor.LosModel, n: int = 600, max_workers: int = 4, conc: int = 32):
+    cases = [{"yasgrup": yg, "bolum": b, "icd": key.split("||")} for yg, b, key in unseen_queries(m, n, seed=11)]
+    port = 8700
+
+    def load(port):
+        """stdlib istemci: conc iş parçacığı, her biri kalıcı bir HTTP/1.1 bağlantısıyla."""
+        t0 = time.perf_counter()
+        while True:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            try:
+                if _post_json(conn, "/api/predict", cases[0]) == 200:
+                    break
+            except OSError:
+                pass
+            finally:
+                conn.close()
+            time.sleep(0.05)
+        t_ready = time.perf_counter() - t0
+        local = threading.local()
+
+        def one(x):
+            if not hasattr(local, "conn"):
+                local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            return _post_json(local.conn, "/api/predict", x)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=conc) as ex:
+            codes = list(ex.map(one, cases))
+        return t_ready, time.perf_counter() - t0, codes
+
+    for preload in ("1", "0"):
+        for w in range(1, max_workers + 1):
+            port += 1
+            env = dict(os.environ, WEB_CONCURRENCY=str(w), PRELOAD_MODEL=preload, PORT=str(port),
+                       PRED_CACHE_SIZE="0", PRED_WORKERS="1")
+            t_start = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"],
+                                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                t_ready, el, codes = load(port)
+                ok = sum(c == 200 for c in codes)
+                print(f"workers  preload={preload}  worker={w}  ilk yanıt={time.perf_counter() - t_start - el:5.2f}s  "
+                      f"{len(cases)/el:6.0f} istek/s  ok={ok}/{len(cases)}  toplam PSS={_tree_pss_mb(proc.pid):6.0f} MB")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+BENCHES = {
+    "neighbor": bench_neighbor,
+    "guardrails": bench_guardrails,
+    "lsh": bench_lsh,
+    "batch": bench_batch,
+    "many": bench_many,
+    "microbatch": bench_microbatch,
+    "workers": bench_workers,
+}
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "neighbor"
+    args = [int(a) for a in sys.argv[2:]]
+    m = motor.load_model()
+    BENCHES[name](m, *args)
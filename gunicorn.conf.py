@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# gunicorn ayarları:  gunicorn -c gunicorn.conf.py server:app
+# preload_app: server + model master'da bir kez yüklenir (server.preload), UvicornWorker'lar fork ile salt-okunur paylaşır.
+#   WEB_CONCURRENCY  worker sayısı (varsayılan: CPU sayısı)
+#   PRELOAD_MODEL    0 → her worker modeli ilk istekte kendisi yükler (eski davranış)
+#   PORT             dinlenecek port (varsayılan 8000)
+#   MODEL_WATCH_S    >0 → her worker model_out/'u izler ve yeni paketi kesintisiz devreye alır
+#                    (/admin/reload yalnızca isteği alan worker'ı yeniler)
+#   MODEL_TABLE_GRACE_S  izleyici yeni pakete bağlı pred_table.bundle'ı en çok bu kadar bekler (varsayılan 60)
+import os, multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get("PRELOAD_MODEL", "1") != "0"
+timeout = 120
+
+# Süreç başına bir tahmin iş parçacığı: paralellik worker süreçlerinden gelir (GIL'e takılmaz)
+os.environ.setdefault("PRED_WORKERS", "1")
+
+
+def when_ready(arbiter):
+    # preload_app ile server zaten import edildi; worker'lar bundan sonra fork edilir
+    if preload_app:
+        import server
+        arbiter.log.info("Model önyüklendi (%.2fs)", server.preload())
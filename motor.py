@@ -0,0 +1,1585 @@
+# -*- coding: utf-8 -*-
+# Tahmin motoru: Kural (3D→2D→1D→komşu + β/γ) ve XGB ensemble çıkarımı.
+# Eğitim (proje.py) ve servis (server.py) aynı kodu kullanır:
+#   - proje.py  : veriden durumu hesaplar, LosModel kurar ve save_model() ile model_out/ altına yazar
+#   - server.py : load_model() ile model_out/model.bundle'ı okur (Excel/pandas/eğitim YOK)
+import os, json, re, itertools, math, functools, bisect
+from decimal import Decimal, ROUND_HALF_UP
+from collections import defaultdict
+
+import pandas as pd
+import numpy as np
+
+from scipy import sparse
+from scipy.sparse import hstack
+from xgboost import XGBRegressor
+
+import paket
+
+MODEL_DIR = "model_out"
+CONFIG_FILE = "config.json"
+PRED_TABLE_FILE = "pred_table.bundle"  # PRED_LOS'un ikili eşi (servisin O(1) ilk katmanı)
+
+# XGB özellik düzeni: [OHE(Bölüm) | OHE(YaşGrup) | ICD multi-hot (TOPK) | ICD sayısı]
+FEATURE_CAT_COLUMNS = ["Bölüm", "YaşGrup"]
+
+# Alt-küme floor: 2^|T| bu sınırı aşmıyorsa alt kümeler sayılarak yoklanır, aşarsa ters indeks kullanılır
+SUBSET_ENUM_MAX = 1 << 10
+
+# Komşu/alt-küme sayımı: hedefin ters indeks listeleri toplamı bu sınırı aşarsa seyrek (numpy) yol, aşmazsa dict sayımı
+# (küçük kapsamlarda numpy çağrı maliyeti Python döngüsünden pahalı)
+VECTOR_MIN_POSTINGS = 64
+
+# Yaklaşık komşu (NEIGHBOR_MODE="lsh"): yalnızca bu kadar ve daha çok adaylı kapsamlarda MinHash/LSH kullanılır
+LSH_MIN_CANDIDATES = 5000
+LSH_ROWS = 2          # bant başına imza satırı (r); bant sayısı LSH_RECALL/LSH_MIN_J'den hesaplanır
+LSH_SEED = 20240101   # MinHash hash ailesi tohumu (aynı paket + ayar → aynı indeks)
+
+# clean_icd önbelleği (benzersiz ICD parçası birkaç bin; sınır, serbest metin girdilerinde belleği sabit tutar)
+ICD_CLEAN_CACHE_MAX = 1 << 16
+
+# Çıkarımda kullanılan ayarlar (proje.py KULLANICI AYARLARI'ndan gelir, config.json'a yazılır)
+PARAM_KEYS = [
+    "TOPK_NEIGHBORS", "RHO_J",
+    "SHRINK_1SUPPORT_SCALE", "REMOVAL_PENALTY", "CAP_MARJ",
+    "SATURATION_ON", "SATURATION_K",
+    "XGB_ENS_ON", "XGB_ALPHA_LOG", "XGB_RULE_BLEND",
+    "GUARDRAILS_ON",
+    "NEIGHBOR_MODE", "LSH_RECALL", "LSH_MIN_J",
+]
+
+def round_half_up(x):
+    if pd.isna(x): return None
+    return int(Decimal(str(float(x))).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+def round_half_up_many(x) -> np.ndarray:
+    """
+    round_half_up'ın vektörel eşi → int64 (NaN varsa nesne dizisi, NaN → None).
+    Decimal(str(x)) ile aynı: str(x) gidiş-dönüş kesin olduğundan ,5 sınırının x ile aynı tarafında kalır;
+    kesir |x| − floor(|x|) kayan noktada kesin hesaplanır, yarım sıfırdan uzağa yuvarlanır.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    a = np.abs(x)
+    whole = np.floor(a)
+    r = np.copysign(whole + (a - whole >= 0.5), x)
+    nan = np.isnan(x)
+    if not nan.any():
+        return r.astype(np.int64)
+    out = np.full(x.shape, None, dtype=object)
+    out[~nan] = r[~nan].astype(np.int64)
+    return out
+
+def yas_to_years(val):
+    if pd.isna(val): return pd.NA
+    if isinstance(val, (int, float)): return float(val)
+    s = str(val).strip().lower()
+    if re.fullmatch(r"\d+(?:[.,]\d+)?", s):
+        return float(s.replace(",", "."))
+    yil = re.findall(r"(\d+)\s*yıl", s)
+    ay  = re.findall(r"(\d+)\s*ay", s)
+    gun = re.findall(r"(\d+)\s*gün", s)
+    years = 0.0
+    if yil: years += sum(float(x) for x in yil)
+    if ay:  years += sum(float(x) for x in ay) / 12
+    if gun: years += sum(float(x) for x in gun) / 365
+    if years == 0.0 and not (yil or ay or gun): return pd.NA
+    return round(years, 2)
+
+def yas_to_years_many(s: pd.Series) -> pd.Series:
+    """
+    yas_to_years'ın vektörel eşi → float64 (eksik/ayrıştırılamayan → NaN). Metin sütunu önce benzersiz değerlere
+    indirgenir (pd.factorize); düz sayılar tek fullmatch ile, "3 yıl 2 ay" biçimleri birim başına bir str.extractall ile.
+    """
+    if s.dtype.kind in "biuf":
+        return pd.Series(s.to_numpy(dtype=np.float64), index=s.index, name=s.name)
+
+    codes, uniq = pd.factorize(s)  # eksik → -1 (out'un son hücresi NaN)
+    vals = list(uniq)
+    out = np.full(len(vals) + 1, np.nan)
+
+    num = np.fromiter((isinstance(v, (int, float)) for v in vals), dtype=bool, count=len(vals))
+    out[:-1][num] = [float(v) for v, is_num in zip(vals, num) if is_num]
+    pos = np.flatnonzero(~num)
+    t = pd.Series([str(vals[i]) for i in pos], index=pos, dtype=object).str.strip().str.lower()
+
+    plain = t.str.fullmatch(r"\d+(?:[.,]\d+)?").to_numpy(dtype=bool)
+    out[pos[plain]] = t[plain].str.replace(",", ".", regex=False).astype(np.float64).to_numpy()
+
+    rest = t[~plain]
+    years = pd.Series(0.0, index=rest.index)
+    found = np.zeros(len(rest), dtype=bool)
+    for unit, div in (("yıl", 1), ("ay", 12), ("gün", 365)):
+        per_row = rest.str.extractall(rf"(\d+)\s*{unit}")[0].astype(np.float64).groupby(level=0).sum()
+        hit = rest.index.isin(per_row.index)
+        years[hit] += per_row.reindex(rest.index[hit]).to_numpy() / div
+        found |= hit
+    # round(…, 2) Python yuvarlamasıyla (np.round ondalık sınırda farklı sonuç verebilir)
+    out[rest.index[found]] = [round(v, 2) for v in years[found].tolist()]
+    return pd.Series(out[codes], index=s.index, name=s.name)
+
+# Parantez/Etiket temizliği + Regex
+_PAREN_MAP = str.maketrans({'（':'(', '）':')', '【':'[', '】':']', '＜':'<', '＞':'>', '｛':'{', '｝':'}'})
+_PAREN_RE = re.compile("[（）【】＜＞｛｝]")
+
+def _norm_paren(s: str) -> str:
+    # translate (sözlük tablosu) karakter başına yavaş; tam genişlik parantez yoksa metin aynen döner
+    return s.translate(_PAREN_MAP) if _PAREN_RE.search(s) else s
+_PREFIX_RE = re.compile(r"""^\s*[\(\[\{\<]\s*(?:ö|ö|k|a)\s*[\)\]\}\>]\s*""", re.IGNORECASE | re.VERBOSE)
+_ANYWHERE_TAG_RE = re.compile(r"\(\s*(?:ö|ö|k|a)\s*\)", re.IGNORECASE)
+_ICD_CODE_RE = re.compile(r"\b([A-Z][0-9]{2}(?:\.[A-Z0-9]{1,4})?)\b", re.IGNORECASE)
+
+def clean_icd(raw) -> str:
+    if raw is None or (isinstance(raw, float) and pd.isna(raw)): return ""
+    return _clean_icd_str(raw if type(raw) is str else str(raw))
+
+@functools.lru_cache(maxsize=ICD_CLEAN_CACHE_MAX)
+def _clean_icd_str(s: str) -> str:
+    s = s.strip()
+    if not s: return ""
+    s = _norm_paren(s)
+    prev = None
+    while prev != s:
+        prev = s
+        s = _PREFIX_RE.sub("", s)
+    return s.strip().upper()
+
+def clean_text_anywhere_tags(raw) -> str:
+    if raw is None or (isinstance(raw, float) and pd.isna(raw)): return ""
+    s = str(raw).strip()
+    if not s: return ""
+    s = _norm_paren(s)
+    s = _ANYWHERE_TAG_RE.sub("", s)
+    s = re.sub(r"\s{2,}", " ", s).strip()
+    return s
+
+def split_icd_cell(s, clean=clean_icd):
+    if pd.isna(s): return []
+    s = _norm_paren(str(s))
+    parts = re.split(r"[;,]", s)
+    parts = [clean(p) for p in parts]
+    parts = [p for p in parts if p]
+    return parts
+
+def normalize_icd_set(lst, clean=clean_icd):
+    lst_clean = [clean(x) for x in lst if str(x).strip() != ""]
+    uniq = sorted(set(lst_clean), key=str)
+    return uniq, "||".join(uniq)
+
+def clean_icd_set_key(key: str, clean=clean_icd) -> str:
+    if key is None or (isinstance(key, float) and pd.isna(key)): return ""
+    parts = [p.strip().upper() for p in str(key).split("||")]
+    parts = [clean(p) for p in parts]
+    parts = [p for p in parts if p]
+    return "||".join(sorted(set(parts), key=str))
+
+def _object_series(values, index) -> pd.Series:
+    """Liste/demet elemanlı seri (pandas iç içe listeyi 2B diziye çevirmesin diye önce nesne dizisi)."""
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return pd.Series(arr, index=index, dtype=object)
+
+def map_unique(s: pd.Series, fn) -> list:
+    """
+    [fn(v) for v in s] — metin hücrelerde fn her benzersiz değer için bir kez çalışır (Excel hücreleri çok tekrar eder).
+    Metin olmayan değerler (NaN, sayı) her satırda ayrı çağrılır. Aynı hücrenin sonucu (liste) satırlar arasında paylaşılır.
+    """
+    memo = {}
+    out = []
+    for v in s.tolist():
+        if type(v) is str:
+            r = memo.get(v, memo)
+            if r is memo:
+                r = memo[v] = fn(v)
+        else:
+            r = fn(v)
+        out.append(r)
+    return out
+
+def parse_icd_cells(cells: pd.Series):
+    """
+    'ICD Kodu' hücreleri → (ICD_List, ICD_List_Norm, ICD_Set_Key) serileri (cells.index'li).
+    split_icd_cell → normalize_icd_set → clean_icd_set_key zinciri her benzersiz hücre için bir kez çalışır;
+    kod parçaları clean_icd'nin ortak önbelleğinden çözülür.
+    """
+    def parse(cell):  # zincir içinde parçalar hep metin → NaN denetimi atlanır
+        lst = split_icd_cell(cell, _clean_icd_str)
+        norm, key = normalize_icd_set(lst, _clean_icd_str)
+        return lst, norm, clean_icd_set_key(key, _clean_icd_str)
+
+    parsed = map_unique(cells, parse)
+    return (_object_series([p[0] for p in parsed], cells.index),
+            _object_series([p[1] for p in parsed], cells.index),
+            pd.Series([p[2] for p in parsed], index=cells.index))
+
+def icd_aliases(cells: pd.Series) -> list:
+    """
+    'ICD Kodu' hücrelerinde görülen, kanonik koddan farklı yazılan parçalar (API biçiminde: strip + upper).
+    Ör. '(Ö) I10' → I10; modelle birlikte paketlenir (IcdCanon).
+    """
+    tokens = set()
+    for cell in {v for v in cells.tolist() if type(v) is str}:
+        tokens.update(p.strip().upper() for p in re.split(r"[;,]", _norm_paren(cell)))
+    return sorted(t for t in tokens if t and clean_icd(t) != t)
+
+class IcdLists:
+    """
+    Satır ICD listeleri (ICD_List_Norm) için CSR: her benzersiz ICD_Set_Key bir kez → offsets int64[k+1] + ids int32[nnz]
+    (ids = codes'taki sıra; codes sıralı). Satırlar listeyi taşımaz, set kimliğini (kategorik ICD_Set_Key kodu) taşır.
+    parse_icd_cells çıktısında liste = anahtarın '||' parçaları (ikisi de sıralı, tekrarsız).
+    """
+    __slots__ = ("keys", "codes", "sizes", "offsets", "ids")
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        parts = [k.split("||") if k else [] for k in self.keys]
+        self.codes = sorted({c for p in parts for c in p})
+        ix = {c: i for i, c in enumerate(self.codes)}
+        self.sizes = np.fromiter((len(p) for p in parts), dtype=np.int64, count=len(parts))
+        self.offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+        self.ids = np.fromiter((ix[c] for p in parts for c in p), dtype=np.int32, count=int(self.offsets[-1]))
+
+    @classmethod
+    def from_keys(cls, key_col: pd.Series):
+        """Kategorik ICD_Set_Key sütunu → IcdLists (set kimliği = kategori kodu)."""
+        return cls(key_col.cat.categories)
+
+    def lists(self, set_ids) -> list:
+        """Satır başına kod listesi (aynı setin satırları aynı listeyi paylaşır) — pack_features/MultiLabelBinarizer için."""
+        set_ids = np.asarray(set_ids)
+        uniq, inv = np.unique(set_ids, return_inverse=True)
+        off, ids, codes = self.offsets, self.ids, self.codes
+        per_set = [[codes[j] for j in ids[off[s]:off[s + 1]].tolist()] for s in uniq.tolist()]
+        return [per_set[i] for i in inv.tolist()]
+
+    def present(self, set_ids) -> list:
+        """Satırlarda geçen kodlar (sıralı)."""
+        used = np.zeros(len(self.keys), dtype=bool)
+        used[np.asarray(set_ids)] = True
+        mask = np.zeros(len(self.codes), dtype=bool)
+        mask[self.ids[np.repeat(used, self.sizes)]] = True
+        return [self.codes[i] for i in np.flatnonzero(mask).tolist()]
+
+    def pairs(self, set_ids):
+        """(set anahtarı, kod) çiftleri; setler satırlarda ilk görülme sırasıyla — explode + drop_duplicates sırası."""
+        _u, first = np.unique(np.asarray(set_ids), return_index=True)
+        sets = _u[np.argsort(first, kind="stable")]
+        keys, icds = [], []
+        for s in sets.tolist():
+            row = self.ids[self.offsets[s]:self.offsets[s + 1]].tolist()
+            keys.extend([self.keys[s]] * len(row))
+            icds.extend(self.codes[j] for j in row)
+        return keys, icds
+
+    def most_common(self, set_ids, n: int = None) -> list:
+        """
+        Counter(satırların tüm kodları).most_common(n) ile aynı [(kod, adet)]: adet azalan,
+        eşitlikte kodun satır akışında ilk görülme sırası (Counter ekleme sırası).
+        """
+        set_ids = np.asarray(set_ids)
+        rows_per_set = np.bincount(set_ids, minlength=len(self.keys))
+        elem_set = np.repeat(np.arange(len(self.keys)), self.sizes)
+        counts = np.bincount(self.ids, weights=rows_per_set[elem_set], minlength=len(self.codes)).astype(np.int64)
+
+        # İlk görülme: (setin ilk satırı, liste içi konum) sözlük sırasıyla en küçüğü
+        first_row = np.full(len(self.keys), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_row, set_ids, np.arange(len(set_ids), dtype=np.int64))
+        pos_in_set = np.arange(len(self.ids), dtype=np.int64) - self.offsets[elem_set]
+        seen = rows_per_set[elem_set] > 0
+        width = int(self.sizes.max(initial=0)) + 1
+        rank = np.full(len(self.codes), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(rank, self.ids[seen], first_row[elem_set[seen]] * width + pos_in_set[seen])
+
+        present = np.flatnonzero(counts > 0)
+        order = present[np.lexsort((rank[present], -counts[present]))]
+        if n is not None:
+            order = order[:n]
+        return [(self.codes[i], int(counts[i])) for i in order.tolist()]
+
+def extract_icd_from_text(text: str):
+    if not isinstance(text, str) or not text.strip(): return []
+    t = _ANYWHERE_TAG_RE.sub("", _norm_paren(text))
+    return [m.upper() for m in _ICD_CODE_RE.findall(t)]
+
+# Yaş grupları: sağdan kapalı kenarlar (y <= 1 → "0-1", 1 < y <= 5 → "2-5", …, 65 < y → "65+"); eğitim ve servis ortak
+YAS_EDGES = [1, 5, 10, 15, 25, 35, 50, 65]
+YAS_GROUPS = ["0-1", "2-5", "5-10", "10-15", "15-25", "25-35", "35-50", "50-65", "65+"]
+
+def yas_to_group(y):
+    if pd.isna(y): return pd.NA
+    y = float(y)
+    if y < 0: return pd.NA
+    return YAS_GROUPS[bisect.bisect_left(YAS_EDGES, y)]
+
+def yas_to_group_many(years) -> pd.Series:
+    """yas_to_group'un vektörel eşi (np.digitize, YAS_EDGES); eksik/negatif/sayı olmayan → NA."""
+    years = pd.Series(years) if not isinstance(years, pd.Series) else years
+    y = pd.to_numeric(years, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    groups = np.asarray(YAS_GROUPS, dtype=object)[np.digitize(y, YAS_EDGES, right=True)]
+    groups[~(y >= 0)] = pd.NA
+    return pd.Series(groups.tolist(), index=years.index, name=years.name)
+
+def jaccard(a:set, b:set)->float:
+    if not a and not b: return 0.0
+    inter = len(a & b)
+    union = len(a | b)
+    return inter/union if union>0 else 0.0
+
+def as_set(key:str)->set:
+    if not key: return set()
+    return set([k for k in key.split("||") if k])
+
+def as_key(s:set)->str:
+    return "||".join(sorted(s))
+
+def as_csr(x):
+    return x if sparse.issparse(x) else sparse.csr_matrix(x)
+
+# ---- Lookup tabloları: groupby(...).agg(N, Ortalama, P50, P90) / groupby(...).quantile'in segment eşleri
+def _level_segments(frame: pd.DataFrame, cols, values: np.ndarray, by_value: np.ndarray):
+    """
+    Bir seviyenin grupları (groupby(cols, sort=True, dropna=True) sırası) → (grup sütun değerleri, starts, counts,
+    değer sıralı satırlar, özgün sıralı satırlar). by_value: values'ın kararlı artan sırası (seviyeler arasında ortak).
+    """
+    keep = ~np.isnan(values)
+    comp = np.zeros(len(values), dtype=np.int64)
+    level = []
+    for c in cols:
+        codes, uniq = pd.factorize(frame[c], sort=True)  # sıralı kod = groupby sırası; eksik → -1 (grup dışı)
+        keep &= codes >= 0
+        comp = comp * (len(uniq) + 1) + codes
+        level.append((codes, np.asarray(uniq, dtype=object)))
+
+    rows_v = by_value[keep[by_value]]
+    rows_v = rows_v[np.argsort(comp[rows_v], kind="stable")]  # grup içinde değer artan
+    rows_o = np.flatnonzero(keep)
+    rows_o = rows_o[np.argsort(comp[rows_o], kind="stable")]  # grup içinde özgün satır sırası (toplam için)
+    g = comp[rows_v]
+    starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]]) if len(g) else np.zeros(0, dtype=np.int64)
+    counts = np.diff(np.r_[starts, len(g)])
+    first = rows_v[starts]
+    group_values = {c: uniq[codes[first]].tolist() for c, (codes, uniq) in zip(cols, level)}
+    return group_values, starts, counts, rows_v, rows_o
+
+def _segment_quantile(sorted_vals: np.ndarray, starts, counts, q: float, series_lerp: bool) -> np.ndarray:
+    """
+    Doğrusal kantil (segmentler artan sıralı). series_lerp=True: Series.quantile (numpy _lerp; t >= 0,5 için
+    b − (b−a)(1−t)); False: groupby(...).quantile (a + (b−a)·t). İki yol son bitte ayrışabilir.
+    """
+    vi = (counts - 1) * q
+    lo = np.floor(vi)
+    t = vi - lo
+    last = vi >= counts - 1
+    ia = starts + np.where(last, counts - 1, lo).astype(np.int64)
+    ib = np.where(last, ia, ia + 1)
+    a, b = sorted_vals[ia], sorted_vals[ib]
+    d = b - a
+    r = a + d * t
+    if series_lerp:
+        r = np.where(t >= 0.5, b - d * (1 - t), r)
+    return np.where(last, sorted_vals[starts + counts - 1], r)
+
+def _segment_mean(values: np.ndarray, rows_o: np.ndarray, starts, counts) -> np.ndarray:
+    """
+    Series.mean (np.sum ikili toplama / N) ile aynı sonucu veren segment ortalaması. Vektörel toplam (reduceat,
+    sıralı) son bitte ayrışabilir; yalnızca round_half_up'ın ,5 sınırına bu hata payı kadar yakın segmentler
+    np.sum ile yeniden toplanır (başka yerde fark yuvarlamayı değiştiremez).
+    """
+    seg = values[rows_o]
+    mean = np.add.reduceat(seg, starts) / counts
+    tol = 4.0 * counts * np.finfo(np.float64).eps * np.maximum.reduceat(np.abs(seg), starts)
+    a = np.abs(mean)
+    near = np.flatnonzero(np.abs(a - np.floor(a) - 0.5) <= tol)
+    for i, s, n in zip(near.tolist(), starts[near].tolist(), counts[near].tolist()):
+        mean[i] = np.sum(seg[s:s + n]) / n
+    return mean
+
+def lookup_tables(frame: pd.DataFrame, value_col: str, levels, q: float = 0.9) -> list:
+    """
+    Her seviye (grup sütunları listesi; [] = tüm veri) için DataFrame [*sütunlar, N, Ortalama, P50, P90] —
+    groupby(cols).agg(N="count", Ortalama=round_half_up(mean), P50="median", P90=Series.quantile(q)) ile aynı.
+    Değerler bir kez sıralanır; her seviye tek kararlı tamsayı sıralaması + segment indirgemeleri (Python lambda yok).
+    NaN değerli satırlar sayılmaz (eğitimde LOS > 0 süzgecinden sonra NaN yok).
+    """
+    values = frame[value_col].to_numpy(dtype=np.float64)
+    by_value = np.argsort(values, kind="stable")
+    out = []
+    for cols in levels:
+        group_values, starts, counts, rows_v, rows_o = _level_segments(frame, cols, values, by_value)
+        if not len(starts):
+            out.append(pd.DataFrame({**group_values, "N": counts, "Ortalama": np.zeros(0, dtype=np.int64),
+                                     "P50": np.zeros(0), "P90": np.zeros(0)}))
+            continue
+        sv = values[rows_v]
+        mid = starts + counts // 2
+        p50 = np.where(counts % 2 == 1, sv[mid], (sv[mid - (counts % 2 == 0)] + sv[mid]) / 2)
+        out.append(pd.DataFrame({
+            **group_values,
+            "N": counts,
+            "Ortalama": round_half_up_many(_segment_mean(values, rows_o, starts, counts)),
+            "P50": p50,
+            "P90": _segment_quantile(sv, starts, counts, q, series_lerp=True),
+        }))
+    return out
+
+def group_quantile(frame: pd.DataFrame, value_col: str, cols, q: float = 0.9) -> pd.DataFrame:
+    """groupby(cols)[value_col].quantile(q).reset_index() eşi → DataFrame [*cols, value_col]."""
+    values = frame[value_col].to_numpy(dtype=np.float64)
+    group_values, starts, counts, rows_v, _rows_o = _level_segments(frame, cols, values, np.argsort(values, kind="stable"))
+    return pd.DataFrame({**group_values, value_col: _segment_quantile(values[rows_v], starts, counts, q, series_lerp=False)})
+
+def pack_features(df_part: pd.DataFrame, ohe, mlb, top_icds, icd_lists=None):
+    # icd_lists: satır başına ICD listesi (verilmezse df_part["ICD_List_Norm"]; proje.py IcdLists.lists ile verir)
+    # Kategorikler
+    X_cat = ohe.transform(df_part[FEATURE_CAT_COLUMNS])
+    # ICD multi-hot (sadece TOPK)
+    if icd_lists is None:
+        icd_lists = df_part["ICD_List_Norm"]
+    icd_lists = [[c for c in lst if c in top_icds] for lst in icd_lists]
+    X_icd = mlb.transform(icd_lists)
+    # Sayısal küçük özellikler (ICD sayısı)
+    x_icd_count = np.asarray(df_part["ICD_Sayısı"]).reshape(-1, 1)
+    X = hstack([X_cat, X_icd, x_icd_count], format="csr")
+    return X
+
+
+class FeatureEncoder:
+    """
+    pack_features'ın derlenmiş hali: (YaşGrup, Bölüm, ICD listesi) → CSR satır(lar)ı, dict ile sütun indeksine.
+    pandas/sklearn yok; çıktı pack_features ile bayt bayt aynı (float64 veri, int32 indeks, sıralı, ICD sayısı 0 ise saklanmaz).
+    """
+
+    def __init__(self, ohe_categories, top_icds):
+        cats_b, cats_y = ohe_categories  # FEATURE_CAT_COLUMNS sırası
+        self.ohe_categories = [list(cats_b), list(cats_y)]
+        self.top_icds = list(top_icds)
+        self.bolum_col = {v: i for i, v in enumerate(cats_b)}
+        self.yg_col = {v: len(cats_b) + i for i, v in enumerate(cats_y)}
+        off = len(cats_b) + len(cats_y)
+        self.icd_col = {c: off + i for i, c in enumerate(self.top_icds)}
+        self.count_col = off + len(self.top_icds)
+        self.n_features = self.count_col + 1
+
+    def signature(self, icds):
+        """ICD listesinin XGB'ye görünen kısmı: (top-ICD sütunları, ICD sayısı) — aynı imza → aynı özellik satırı."""
+        return tuple(sorted({self.icd_col[x] for x in icds if x in self.icd_col})), len(icds)
+
+    def transform(self, rows):
+        """rows: iterable of (yg, bolum, icd_list) → csr_matrix (len(rows) × n_features)"""
+        indptr, indices, data = [0], [], []
+        for yg, bolum, icds in rows:
+            c = self.bolum_col.get(bolum)
+            if c is not None:
+                indices.append(c); data.append(1.0)
+            c = self.yg_col.get(yg)
+            if c is not None:
+                indices.append(c); data.append(1.0)
+            cols = sorted({self.icd_col[x] for x in icds if x in self.icd_col})
+            indices.extend(cols); data.extend([1.0] * len(cols))
+            if len(icds):
+                indices.append(self.count_col); data.append(float(len(icds)))
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+            shape=(len(indptr) - 1, self.n_features),
+        )
+
+
+# predict_one meta sütunları (PRED_LOS / VALID_PREDICTIONS sırası)
+META_COLUMNS = ["ANCHOR_SRC", "ANCHOR_KEY", "ANCHOR_P50", "ALPHA_JACCARD", "ADDED_ICDS",
+                "BETA_SUM", "GAMMA_SUM", "MODEL_PRED", "PRED_BLEND"]
+
+def _exact_meta(src: str, key: str, p50: float) -> dict:
+    """3D/2D/1D tam eşleşme kısa devresinin meta'sı (katkı yok, guardrail yok)."""
+    return {
+        "ANCHOR_SRC": src,
+        "ANCHOR_KEY": key if key else "",
+        "ANCHOR_P50": float(p50),
+        "ALPHA_JACCARD": 0.0,
+        "ADDED_ICDS": "",
+        "BETA_SUM": 0.0,
+        "GAMMA_SUM": 0.0,
+        "MODEL_PRED": float(p50),
+        "PRED_BLEND": float(p50),
+    }
+
+def _blend_topk(scored, K:int, rho:float):
+    """
+    scored: [(J, p50, n, key)] — aday tarama sırasında
+    Dönüş: (bestJ, weighted_p50, bestKey); ağırlık w = (J**rho) * log(1+N)
+    """
+    if not scored:
+        return 0.0, None, None
+
+    # En iyi tek komşu (tutarlılık için anchor_key bu); kararlı sıralama → eşitlikte tarama sırası
+    scored.sort(key=lambda x: (x[0], x[2], x[1]), reverse=True)
+    return _blend_sorted(scored, K, rho)
+
+def _blend_sorted(scored, K:int, rho:float):
+    """_blend_topk'un sıralama sonrası kısmı: scored (J, n, p50) azalan sırada (eşitlikte tarama sırası)."""
+    bestJ, bestP50, _bestN, bestKey = scored[0]
+
+    # Sıfır Jaccard durumunda ağırlık toplamı 0 olabilir → tek komşuya düş
+    topk = [r for r in scored if r[0] > 0.0][:K]
+    if not topk:
+        return bestJ, bestP50, bestKey
+
+    weights = []
+    vals = []
+    for J, p50, n, _k in topk:
+        w = (J ** float(rho)) * math.log1p(max(0, n))
+        weights.append(w)
+        vals.append(p50)
+
+    W = sum(weights)
+    if W <= 0:
+        return bestJ, bestP50, bestKey
+
+    weighted_p50 = sum(v*w for v, w in zip(vals, weights)) / W
+    return bestJ, float(weighted_p50), bestKey
+
+
+class IcdVocab:
+    """
+    Global ICD sözlüğü: kod → yoğun tamsayı kimlik. Kimlikler kod sırasıyla verilir (sorted(codes)),
+    böylece sıralı kimlik demeti = sıralı kod listesi (β toplama ve çift sırası string sürümüyle aynı kalır).
+    Setler motor içinde sıralı int demetleri; metin anahtarlar yalnızca API sınırında.
+    """
+    __slots__ = ("codes", "ids")
+
+    def __init__(self, codes):
+        self.codes = sorted(set(codes))
+        self.ids = {c: i for i, c in enumerate(self.codes)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def encode(self, key: str):
+        """'A||B' → (sıralı bilinen kimlikler, sözlükte olmayan kodlar) — bilinmeyen kodlar hiçbir adayla kesişmez."""
+        known, unknown = [], []
+        for c in as_set(key):
+            i = self.ids.get(c)
+            if i is None:
+                unknown.append(c)
+            else:
+                known.append(i)
+        return tuple(sorted(known)), tuple(sorted(unknown))
+
+    def decode(self, ids):
+        return [self.codes[i] for i in ids]
+
+
+class IcdCanon:
+    """
+    Kanonik ICD sözlüğü: API biçimindeki parça (strip + upper) → clean_icd sonucu, model yüklenirken bir kez hesaplanır.
+    Kanonik kodlar (IcdVocab) ve eğitimde görülen farklı yazımlar (icd_aliases) tek sözlük aramasıyla çözülür;
+    sözlükte olmayan parça clean_icd'ye (sınırlı önbellek) düşer → sonuç her zaman clean_icd ile aynı.
+    """
+    __slots__ = ("table",)
+
+    def __init__(self, tokens):
+        self.table = {t: clean_icd(t) for t in tokens}
+
+    def __len__(self):
+        return len(self.table)
+
+    def resolve(self, token: str) -> str:
+        c = self.table.get(token)
+        return c if c is not None else clean_icd(token)
+
+    def set_key(self, key: str) -> str:
+        """clean_icd_set_key ile aynı anahtar; parçalar sözlükten."""
+        return clean_icd_set_key(key, self.resolve)
+
+
+class ScopeIndex:
+    """
+    Bir lookup kapsamı (3D demo / 2D bölüm / 1D global): adaylar (sıralı ICD kimlik demetleri) +
+    aday × ICD seyrek insidans matrisi (CSC: ICD kimliği → aday satırları) + kimlik demeti → max P50.
+    Komşu: hedefin sütunları toplanır (M @ x_hedef, x_hedef ikili gösterge) → yalnızca hedefle en az bir ICD
+    paylaşan adayların kesişimleri; birleşim = |T| + satır uzunluğu − kesişim. Top-K argpartition ile seçilir,
+    sıra (J, N, P50) azalan, eşitlikte tarama sırası → sonuç tam taramayla aynı.
+    Az kesişimde (VECTOR_MIN_POSTINGS altı) aynı sayım ters indeks dict'iyle yapılır.
+    NEIGHBOR_MODE="lsh": büyük kapsamlarda adaylar MinHashLSH'tan gelir (yaklaşık; yeniden sıralama tam J ile).
+    Hiç ortak ICD yoksa tam taramanın seçeceği (N, P50) en büyük ilk aday döner.
+    Alt-küme floor: küçük T için T'nin alt kümeleri (sıralı demetler) hash'te yoklanır, büyük T için
+    kesişim = satır uzunluğu olan adaylar (S ⊆ T) alınır.
+    """
+    __slots__ = ("keys", "sizes", "p50", "n", "sizes_a", "p50_a", "n_a", "col_ids", "col_ptr", "col_rows",
+                 "zero_best", "lsh", "_inv", "_p50_by_ids")
+
+    def __init__(self, keys, p50_a, n_a, sizes_a, col_ids, col_ptr, col_rows):
+        """
+        Dizilerden kurulur (paketten okunan memmap görünümleri olabilir). Adaylar tarama sırasında.
+        CSC yalnızca kapsamda geçen ICD'ler üzerinde: col_ids sıralı kimlikler, col_ptr[k] → col_ids[k]'nın aday satırları.
+        """
+        self.keys = keys
+        self.sizes_a, self.p50_a, self.n_a = sizes_a, p50_a, n_a
+        self.sizes, self.p50, self.n = sizes_a.tolist(), p50_a.tolist(), n_a.tolist()
+        self.col_ids, self.col_ptr, self.col_rows = col_ids, col_ptr, col_rows
+        # Ortak ICD yoksa: (N, P50) en büyük, eşitlikte ilk aday (max() ile aynı)
+        self.zero_best = int(np.lexsort((np.arange(len(keys)), -self.p50_a, -self.n_a))[0]) if keys else None
+        self._inv = self._p50_by_ids = None  # dict yolları ilk kullanımda diziden kurulur
+        self.lsh = None  # LosModel._build_lsh_index (NEIGHBOR_MODE="lsh", büyük kapsamlar)
+
+    @classmethod
+    def from_candidates(cls, candidates, vocab: IcdVocab):
+        # candidates: iterable of (key, p50, n) — tarama sırası korunur (eşitlik bozmada önemli)
+        keys, sizes, p50s, ns = [], [], [], []
+        inv = defaultdict(list)
+        for key, p50, n in candidates:
+            if p50 is None:
+                continue
+            pos = len(keys)
+            ids, _unknown = vocab.encode(key)  # adaylar sözlüğü kurar → bilinmeyen yok
+            keys.append(key)
+            sizes.append(len(ids))
+            p50s.append(float(p50))
+            ns.append(int(n if n is not None else 0))
+            for i in ids:
+                inv[i].append(pos)
+
+        # CSC (sütun içinde aday sırası = tarama sırası)
+        col_ids = sorted(inv)
+        col_ptr = np.cumsum([0] + [len(inv[i]) for i in col_ids], dtype=np.int64)
+        col_rows = np.array([pos for i in col_ids for pos in inv[i]], dtype=np.int64)
+        return cls(keys, np.array(p50s, dtype=np.float64), np.array(ns, dtype=np.int64),
+                   np.array(sizes, dtype=np.int64), np.array(col_ids, dtype=np.int64), col_ptr, col_rows)
+
+    def _csr(self):
+        """Aday × ICD satırları (CSR, satır içi kimlikler artan): (indptr, global kimlikler)."""
+        csr = sparse.csc_matrix((np.ones(len(self.col_rows), dtype=np.int8), self.col_rows, self.col_ptr),
+                                shape=(len(self.keys), len(self.col_ids))).tocsr()
+        csr.sort_indices()  # col_ids sıralı → yerel sütun sırası = kimlik sırası
+        return csr.indptr.astype(np.int64), np.asarray(self.col_ids, dtype=np.int64)[csr.indices]
+
+    @property
+    def inv(self) -> dict:
+        """ICD kimliği → aday konumları (dict yolu; CSC'nin eşi)."""
+        if self._inv is None:
+            ptr, rows = self.col_ptr.tolist(), self.col_rows
+            self._inv = {i: rows[ptr[k]:ptr[k + 1]].tolist() for k, i in enumerate(self.col_ids.tolist())}
+        return self._inv
+
+    @property
+    def p50_by_ids(self) -> dict:
+        """Aday kimlik demeti → max P50 (alt-küme floor); satırlar CSC'nin devriğinden."""
+        if self._p50_by_ids is None:
+            ptr, ids = self._csr()
+            ptr, ids = ptr.tolist(), ids.tolist()
+            out = {}
+            for pos, p50 in enumerate(self.p50):
+                key = tuple(ids[ptr[pos]:ptr[pos + 1]])
+                out[key] = max(p50, out.get(key, p50))
+            self._p50_by_ids = out
+        return self._p50_by_ids
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _postings(self, target_ids) -> int:
+        inv = self.inv
+        return sum(len(inv[i]) for i in target_ids if i in inv)
+
+    def _count(self, target_ids) -> dict:
+        """Dict yolu: aday konumu → kesişim boyu."""
+        inter = {}
+        for i in target_ids:
+            for pos in self.inv.get(i, ()):
+                inter[pos] = inter.get(pos, 0) + 1
+        return inter
+
+    def _intersections(self, target_ids):
+        """Seyrek yol: M @ x_hedef'in sıfır olmayan kısmı → (aday konumları artan, kesişim boyları)."""
+        ids, ptr, rows = self.col_ids, self.col_ptr, self.col_rows
+        t = np.asarray(target_ids, dtype=np.int64)
+        k = np.searchsorted(ids, t)
+        k = k[ids[np.minimum(k, len(ids) - 1)] == t]  # kapsamda geçmeyen kimlikler düşer
+        hit = np.concatenate([rows[ptr[j]:ptr[j + 1]] for j in k.tolist()])
+        return np.unique(hit, return_counts=True)
+
+    def topk_weighted_anchor(self, target_ids, t: int, K:int, rho:float):
+        """target_ids: sıralı bilinen kimlikler; t: hedef set boyu (bilinmeyen kodlar dahil, birleşim için)."""
+        if not self.keys:
+            return 0.0, None, None
+        scored = self.scored(target_ids, t, K)
+        if not scored:
+            i = self.zero_best
+            return 0.0, self.p50[i], self.keys[i]
+        return _blend_sorted(scored, K, rho)
+
+    def scored(self, target_ids, t: int, K:int):
+        """
+        J>0 adaylar [(J, p50, n, key)], (J, N, P50) azalan / eşitlikte tarama sırası; ilk K'si top-K'dir.
+        LSH açıksa (self.lsh) adaylar MinHash bantlarından gelir ve tam J ile yeniden sıralanır;
+        bantlar hiçbir aday döndürmezse tam yola düşülür. Ortak ICD yoksa boş liste.
+        """
+        if self.lsh is not None:
+            pos = self.lsh.query(target_ids)
+            if pos is not None:
+                return self._rank(pos, self.lsh.intersections(pos, target_ids), t, K)
+        m = self._postings(target_ids)
+        if m == 0:
+            return []
+        if m < VECTOR_MIN_POSTINGS:
+            inter = self._count(target_ids)
+            scored = []
+            for pos in sorted(inter):
+                k = inter[pos]
+                scored.append((k / (t + self.sizes[pos] - k), self.p50[pos], self.n[pos], self.keys[pos]))
+            scored.sort(key=lambda x: (x[0], x[2], x[1]), reverse=True)
+            return scored
+        return self._rank(*self._intersections(target_ids), t, K)
+
+    def _rank(self, pos, inter, t: int, K:int):
+        """Seyrek yol sıralaması: pos artan aday konumları, inter kesişim boyları (>0)."""
+        J = inter / (t + self.sizes_a[pos] - inter)
+        if len(J) > K > 0:
+            # K. en büyük J'ye eşit olanlar da kalır → eşitlik bozma tam sıralamadakiyle aynı
+            keep = np.flatnonzero(J >= np.partition(J, len(J) - K)[len(J) - K])
+            pos, J = pos[keep], J[keep]
+        n, p50 = self.n_a[pos], self.p50_a[pos]
+        order = np.lexsort((pos, -p50, -n, -J)).tolist()
+        pos = pos.tolist()
+        return [(float(J[o]), self.p50[pos[o]], self.n[pos[o]], self.keys[pos[o]]) for o in order]
+
+    def subset_floor(self, target_ids, floor:float) -> float:
+        """max(floor, P50(S)) — S ⊆ hedef olan tüm kapsam setleri üzerinde (target_ids sıralı)."""
+        if not self.keys:
+            return floor
+        if (1 << len(target_ids)) <= SUBSET_ENUM_MAX:
+            # combinations sıralı girdiden sıralı demet üretir → doğrudan anahtar
+            for r in range(len(target_ids) + 1):
+                for sub in itertools.combinations(target_ids, r):
+                    p50 = self.p50_by_ids.get(sub)
+                    if p50 is not None and p50 > floor:
+                        floor = p50
+            return floor
+        # Büyük T: S ⊆ T ⇔ |S ∩ T| = |S| (+ boş set)
+        m = self._postings(target_ids)
+        if 0 < m < VECTOR_MIN_POSTINGS:
+            for pos, k in self._count(target_ids).items():
+                if k == self.sizes[pos] and self.p50[pos] > floor:
+                    floor = self.p50[pos]
+        elif m:
+            pos, inter = self._intersections(target_ids)
+            sub = pos[inter == self.sizes_a[pos]]
+            if len(sub):
+                best = self.p50[int(sub[np.argmax(self.p50_a[sub])])]
+                if best > floor:
+                    floor = best
+        p50 = self.p50_by_ids.get(())
+        return p50 if p50 is not None and p50 > floor else floor
+
+
+def lsh_bands(recall: float, min_j: float, rows: int = LSH_ROWS) -> int:
+    """J ≥ min_j olan bir adayın en az bir bantta çakışma olasılığı ≥ recall olacak en küçük bant sayısı b."""
+    p = min_j ** rows
+    if p >= 1.0:
+        return 1
+    return max(1, math.ceil(math.log(1.0 - recall) / math.log(1.0 - p)))
+
+def minhash_table(n_ids: int, n_hash: int, seed: int = LSH_SEED) -> np.ndarray:
+    """(n_ids × n_hash) h_k(id) = (a_k·id + b_k) mod p; p asal > n_ids ve a_k ≠ 0 → her h_k kimlikler üzerinde permütasyon."""
+    p = (1 << 31) - 1
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, p, size=n_hash, dtype=np.int64)
+    b = rng.integers(0, p, size=n_hash, dtype=np.int64)
+    ids = np.arange(n_ids, dtype=np.int64)[:, None]
+    return ((a * ids + b) % p).astype(np.int64)
+
+
+class MinHashLSH:
+    """
+    Bir kapsamın yaklaşık komşu indeksi: aday imzası = min_k h_k(ICD kimliği), b bant × r satır.
+    Aynı bantta imzası çakışan aday hedefle en az bir ICD paylaşır (h_k permütasyon → aynı min = aynı kimlik);
+    J=s olan aday P = 1 − (1 − s^r)^b olasılıkla bulunur. Bulunanların kesişimleri satırlardan (CSR) tam sayılır.
+    """
+    __slots__ = ("table", "rows", "bands", "buckets", "row_ptr", "row_ids")
+
+    def __init__(self, scope: ScopeIndex, table: np.ndarray, rows: int, bands: int):
+        self.table, self.rows, self.bands = table, rows, bands
+        self.row_ptr, self.row_ids = scope._csr()
+
+        # İmzalar: boş olmayan satırlarda min(h(kimlik)); boş ICD setli adaylar hiçbir hedefle kesişmez → bantlara girmez
+        live = np.flatnonzero(np.diff(self.row_ptr) > 0)
+        h = table[self.row_ids][:, :rows * bands]
+        sig = np.minimum.reduceat(h, self.row_ptr[live], axis=0) if len(live) else h[:0]
+        self.buckets = []
+        for j in range(bands):
+            band = np.ascontiguousarray(sig[:, j * rows:(j + 1) * rows]).view(f"V{rows * sig.itemsize}").ravel()
+            # Aynı bant anahtarlı adaylar: kararlı argsort → kova içinde konumlar artan
+            order = np.argsort(band, kind="stable")
+            keys, starts = np.unique(band[order], return_index=True)
+            self.buckets.append(dict(zip(keys.tolist(), np.split(live[order], starts[1:]))))
+
+    def query(self, target_ids):
+        """Bantlarda çakışan aday konumları (artan) ya da None (bilinen kimlik yok / hiç çakışma yok)."""
+        if not target_ids:
+            return None
+        sig = self.table[list(target_ids), :self.rows * self.bands].min(axis=0).reshape(self.bands, self.rows)
+        keys = sig.view(f"V{self.rows * sig.itemsize}").ravel().tolist()
+        hit = [b[k] for b, k in zip(self.buckets, keys) if k in b]
+        if not hit:
+            return None
+        return np.unique(np.concatenate(hit))
+
+    def intersections(self, pos, target_ids):
+        """|satır(pos) ∩ hedef| — bulunan adayların satırları tek seferde toplanır."""
+        starts = self.row_ptr[pos]
+        lens = self.row_ptr[pos + 1] - starts
+        ends = np.cumsum(lens)
+        idx = np.arange(ends[-1]) - np.repeat(ends - lens, lens) + np.repeat(starts, lens)
+        mask = np.zeros(self.table.shape[0], dtype=np.int64)
+        mask[list(target_ids)] = 1
+        return np.add.reduceat(mask[self.row_ids[idx]], ends - lens)
+
+
+class LosModel:
+    """
+    Eğitilmiş durumdan (lookup map'ler, β/γ, XGB) tahmin üreten nesne.
+    server.py bunu modül gibi kullanır: predict_one, xgb_predict_ens,
+    icd_set_key, round_half_up, XGB_RULE_BLEND.
+    """
+    clean_icd_set_key = staticmethod(clean_icd_set_key)
+    round_half_up = staticmethod(round_half_up)
+
+    def __init__(self, state: dict, params: dict, xgb: dict = None, config: dict = None):
+        self.lkp3_map = state["lkp3_map"]
+        self.lkp2_map = state["lkp2_map"]
+        self.lkp1_map = state["lkp1_map"]
+        self.lkp0_p50 = float(state["lkp0_p50"])
+        self.lkp0_p90 = float(state["lkp0_p90"])
+        self.ctx3_by_demo = state["ctx3_by_demo"]
+        self.pair_floor_map = state["pair_floor_map"]
+        self.demop90_map = state["demop90_map"]
+        self.beta_icd = state["beta_icd"]
+        self.beta_support = state["beta_support"]
+        self.gamma_pairs = state["gamma_pairs"]
+        self.gamma_support = state["gamma_support"]
+        self.icd_aliases = list(state.get("icd_aliases", ()))  # eski paketlerde yok → yalnızca kanonik kodlar
+
+        self.TOPK_NEIGHBORS = int(params["TOPK_NEIGHBORS"])
+        self.RHO_J = float(params["RHO_J"])
+        self.SHRINK_1SUPPORT_SCALE = float(params["SHRINK_1SUPPORT_SCALE"])
+        self.REMOVAL_PENALTY = float(params["REMOVAL_PENALTY"])
+        self.CAP_MARJ = float(params["CAP_MARJ"])
+        self.SATURATION_ON = bool(params["SATURATION_ON"])
+        self.SATURATION_K = float(params["SATURATION_K"])
+        self.XGB_ENS_ON = bool(params["XGB_ENS_ON"])
+        self.XGB_ALPHA_LOG = float(params["XGB_ALPHA_LOG"])
+        self.XGB_RULE_BLEND = params["XGB_RULE_BLEND"]
+        self.GUARDRAILS_ON = bool(params.get("GUARDRAILS_ON", False))  # eski paketlerde yok → kapalı
+        self.NEIGHBOR_MODE = str(params.get("NEIGHBOR_MODE", "exact"))  # "exact" | "lsh" (eski paketler → exact)
+        self.LSH_RECALL = float(params.get("LSH_RECALL", 0.95))
+        self.LSH_MIN_J = float(params.get("LSH_MIN_J", 0.3))
+        if self.NEIGHBOR_MODE not in ("exact", "lsh"):
+            raise ValueError(f"NEIGHBOR_MODE 'exact' ya da 'lsh' olmalı: {self.NEIGHBOR_MODE!r}")
+
+        self.set_xgb(xgb or {})
+        self.config = config or {}
+        self._build_neighbor_index(state.get("neighbor_index"))
+        self.bundle_sha256 = None  # load_model()/save_model() doldurur (paket içerik özeti = model sürümü)
+        self.pred_table = {}  # cache_key → (PRED_RULE, PRED_XGB_ENS); load_model, pred_table.bundle varsa doldurur
+
+    def set_xgb(self, xgb: dict):
+        """xgb: xgb_plain, xgb_log, ohe_categories (Bölüm, YaşGrup sınıfları), top_icds"""
+        self.xgb_plain = xgb.get("xgb_plain")
+        self.xgb_log = xgb.get("xgb_log")
+        self.XGB_TOP_ICDS = xgb.get("top_icds")
+        self.encoder = FeatureEncoder(xgb["ohe_categories"], self.XGB_TOP_ICDS) if self.xgb_plain is not None else None
+
+    def params(self) -> dict:
+        return {k: getattr(self, k) for k in PARAM_KEYS}
+
+    def icd_set_key(self, key: str) -> str:
+        """Ham 'A||B' anahtarı → kanonik ICD_Set_Key (clean_icd_set_key ile aynı; parçalar IcdCanon'dan O(1))."""
+        return self.canon.set_key(key)
+
+    def find_anchor(self, yg:str, bolum:str, key:str):
+        """Lookup zinciri: 3D -> 2D -> 1D -> yoksa None (komşuya geçilecek)"""
+        if (yg, bolum, key) in self.lkp3_map:
+            p50, n = self.lkp3_map[(yg, bolum, key)]
+            return "3D", float(p50), n, key
+        if (bolum, key) in self.lkp2_map:
+            p50, n = self.lkp2_map[(bolum, key)]
+            return "2D", float(p50), n, key
+        if key in self.lkp1_map:
+            p50, n = self.lkp1_map[key]
+            return "1D", float(p50), n, key
+        return None, None, 0, None
+
+    def _build_neighbor_index(self, index: dict = None):
+        """
+        ICD sözlüğü (+ kanonik yazım sözlüğü IcdCanon) + kimlik tabanlı tablolar ve komşu kapsamları (tarama sırası korunarak) bir kez kurulur:
+        3D demo (ctx3_by_demo), 2D bölüm (ctx2_by_bolum), 1D global. Her kapsam ICD'leri önceden ayrılmış
+        (kimlik CSC) ve N/P50'si dizi olarak tutar; 2D geri düşüşü yalnızca o bölümün satırlarına dokunur.
+        index: paketten okunmuş hazır indeks (_unpack_neighbor_index) → anahtarlar yeniden ayrıştırılmaz.
+        """
+        # ctx2_by_bolum: Bölüm → 2D anahtar listesi (ctx3_by_demo'nun eşi; lkp2 sırası korunur)
+        self.ctx2_by_bolum = defaultdict(list)
+        for b, key in self.lkp2_map:
+            self.ctx2_by_bolum[b].append(key)
+        self.ctx2_by_bolum = dict(self.ctx2_by_bolum)
+
+        if index is not None:
+            self.vocab = IcdVocab(index["vocab"])
+            self.canon = IcdCanon(itertools.chain(self.vocab.codes, self.icd_aliases))
+            self._beta_scaled, self._gamma_scaled, self._pair_floor_ids = index["beta"], index["gamma"], index["pair_floor"]
+            scopes = index["scopes"]
+            self.scope1 = scopes[(None, None)]
+            self.scope2 = {b: scopes[(None, b)] for b in self.ctx2_by_bolum}
+            self.scope3 = {demo: scopes[demo] for demo in self.ctx3_by_demo}
+            self.neighbor_index_src = "bundle"
+            self._build_lsh_index()
+            return
+
+        codes = set()
+        for key in itertools.chain(self.lkp1_map, (k for _b, k in self.lkp2_map), (k for _y, _b, k in self.lkp3_map),
+                                   self.pair_floor_map):
+            codes.update(as_set(key))
+        codes.update(self.beta_icd)
+        for i, j in itertools.chain(self.gamma_pairs, self.gamma_support):
+            codes.update((i, j))
+        self.vocab = vocab = IcdVocab(codes)
+        self.canon = IcdCanon(itertools.chain(vocab.codes, self.icd_aliases))
+        ids = vocab.ids
+
+        # β/γ/pair-floor kimlik tablolarında (ölçekleme dahil) — model_contrib ve _pair_floor'un sözlük sorguları
+        def scale(sup):
+            return 1.0 if sup >= 3 else self.SHRINK_1SUPPORT_SCALE
+        self._beta_scaled = {ids[c]: max(0.0, v) * scale(self.beta_support.get(c, 0)) for c, v in self.beta_icd.items()}
+        self._gamma_scaled = {}
+        for a, b in itertools.chain(self.gamma_pairs, self.gamma_support):
+            i, j = (a, b) if a < b else (b, a)  # combinations(sorted(T)) sırası: i < j
+            if (ids[i], ids[j]) in self._gamma_scaled:
+                continue
+            val = max(0.0, self.gamma_pairs.get((i, j), self.gamma_pairs.get((j, i), 0.0)))
+            sup = max(self.gamma_support.get((i, j), 0), self.gamma_support.get((j, i), 0))
+            self._gamma_scaled[(ids[i], ids[j])] = val * scale(sup)
+        self._pair_floor_ids = {}
+        for key in self.pair_floor_map:
+            parts = key.split("||")
+            if len(parts) != 2:
+                continue
+            i, j = sorted(parts)
+            self._pair_floor_ids[(ids[i], ids[j])] = max(self.pair_floor_map.get(f"{i}||{j}", 0.0),
+                                                         self.pair_floor_map.get(f"{j}||{i}", 0.0))
+
+        self.scope3 = {}
+        for (yg, b), keys in self.ctx3_by_demo.items():
+            self.scope3[(yg, b)] = ScopeIndex.from_candidates(
+                ((key, *self.lkp3_map.get((yg, b, key), (None, 0))) for key in keys), vocab)
+        self.scope2 = {b: ScopeIndex.from_candidates(((key, *self.lkp2_map[(b, key)]) for key in keys), vocab)
+                       for b, keys in self.ctx2_by_bolum.items()}
+        self.scope1 = ScopeIndex.from_candidates(((key, p50, n) for key, (p50, n) in self.lkp1_map.items()), vocab)
+        self.neighbor_index_src = "rebuilt"  # eğitim ya da nb.* bölümü olmayan eski paket
+        self._build_lsh_index()
+
+    def _build_lsh_index(self):
+        """NEIGHBOR_MODE="lsh" ise LSH_MIN_CANDIDATES ve üzeri adaylı kapsamlara MinHashLSH bağlar, değilse kaldırır."""
+        scopes = [self.scope1, *self.scope2.values(), *self.scope3.values()]
+        for s in scopes:
+            s.lsh = None
+        if self.NEIGHBOR_MODE != "lsh":
+            return
+        bands = lsh_bands(self.LSH_RECALL, self.LSH_MIN_J, LSH_ROWS)
+        table = minhash_table(len(self.vocab), LSH_ROWS * bands)
+        for s in scopes:
+            if len(s) >= LSH_MIN_CANDIDATES:
+                s.lsh = MinHashLSH(s, table, LSH_ROWS, bands)
+
+    # ---- Top-K ağırlıklı ortalama (tam tarama; referans)
+    def _topk_weighted_anchor(self, candidates, target_set:set, K:int=None, rho:float=None):
+        """
+        candidates: iterable of (key, p50, n)
+        Dönüş: (bestJ, weighted_p50, bestKey)
+        Ağırlık: w = (J**rho) * log(1+N)
+        """
+        K = self.TOPK_NEIGHBORS if K is None else K
+        rho = self.RHO_J if rho is None else rho
+        scored = []
+        for key, p50, n in candidates:
+            J = jaccard(target_set, as_set(key))
+            if p50 is None:
+                continue
+            scored.append((J, float(p50), int(n if n is not None else 0), key))
+        return _blend_topk(scored, K, rho)
+
+    def nearest_neighbor_anchor(self, yg:str, bolum:str, target_key:str):
+        """
+        Jaccard komşu-ankor arama SIRASI:
+          1) 3D aynı demografi (YaşGrup+Bölüm)  -> ANCHOR_SRC='NEIGHBOR_3D_DEMO'
+          2) 2D sadece Bölüm                    -> ANCHOR_SRC='NEIGHBOR_2D'
+          3) 1D global ICD set                  -> ANCHOR_SRC='NEIGHBOR_1D'
+          4) Hiç aday yoksa 0D genel            -> ANCHOR_SRC='NEIGHBOR_0D'
+        Top-K: anchor_p50 = ağırlıklı ortalama; anchor_key = en iyi tek komşu.
+        Adaylar ters ICD indeksinden gelir (ScopeIndex); sonuç nearest_neighbor_anchor_scan ile aynıdır.
+        NEIGHBOR_MODE="lsh": büyük kapsamlarda adaylar MinHash/LSH'tan gelir → yaklaşık (bkz. bench.py lsh).
+        """
+        return self._nearest_neighbor_anchor_ids(yg, bolum, *self.vocab.encode(target_key))
+
+    def _neighbor_scope(self, yg:str, bolum:str):
+        """(YaşGrup, Bölüm) için yanıt verecek ilk kapsam: boş olmayan kapsam her hedefe bir komşu döndürür."""
+        for scope, tag in ((self.scope3.get((yg, bolum)), "3D_DEMO"), (self.scope2.get(bolum), "2D"), (self.scope1, "1D")):
+            if scope is not None and len(scope):
+                return scope, tag
+        return None, "0D"
+
+    def _nearest_neighbor_anchor_ids(self, yg:str, bolum:str, t_ids, t_unknown, scope_tag=None):
+        scope, tag = scope_tag if scope_tag is not None else self._neighbor_scope(yg, bolum)
+        if scope is not None:
+            bestJ, w_p50, bestKey = scope.topk_weighted_anchor(t_ids, len(t_ids) + len(t_unknown), self.TOPK_NEIGHBORS, self.RHO_J)
+            return bestJ, float(w_p50 if w_p50 is not None else self.lkp0_p50), bestKey, tag
+
+        # 4) 0D - genel
+        return 0.0, self.lkp0_p50, None, "0D"
+
+    def nearest_neighbor_anchor_scan(self, yg:str, bolum:str, target_key:str):
+        """Referans: her kapsamda tüm adaylar üzerinde doğrusal Jaccard taraması (bench/doğrulama)."""
+        target = as_set(target_key)
+
+        # 1) 3D - aynı demografi
+        cand3 = []
+        for key in self.ctx3_by_demo.get((yg, bolum), []):
+            p50, n = self.lkp3_map.get((yg, bolum, key), (None, 0))
+            cand3.append((key, p50, n))
+        bestJ, w_p50, bestKey = self._topk_weighted_anchor(cand3, target)
+        if bestKey is not None:
+            return bestJ, float(w_p50 if w_p50 is not None else self.lkp0_p50), bestKey, "3D_DEMO"
+
+        # 2) 2D - aynı bölüm
+        cand2 = []
+        for key in self.ctx2_by_bolum.get(bolum, []):
+            p50, n = self.lkp2_map[(bolum, key)]
+            cand2.append((key, p50, n))
+        bestJ, w_p50, bestKey = self._topk_weighted_anchor(cand2, target)
+        if bestKey is not None:
+            return bestJ, float(w_p50 if w_p50 is not None else self.lkp0_p50), bestKey, "2D"
+
+        # 3) 1D - global
+        cand1 = []
+        for key, (p50, n) in self.lkp1_map.items():
+            cand1.append((key, p50, n))
+        bestJ, w_p50, bestKey = self._topk_weighted_anchor(cand1, target)
+        if bestKey is not None:
+            return bestJ, float(w_p50 if w_p50 is not None else self.lkp0_p50), bestKey, "1D"
+
+        # 4) 0D - genel
+        return 0.0, self.lkp0_p50, None, "0D"
+
+    def model_contrib(self, target_key:str, anchor_key:str):
+        """
+        β/γ katkıları (tek taraflı imza):
+          - Eklenen tekiller (T\\A): +β
+          - Çıkan tekiller (A\\T):  –β
+          - Eklenen çiftler:        +γ
+          - Kaybolan çiftler:       –γ
+        Not: β ve γ öğrenimde ≥0; burada yalnızca 'fazlayı geri alma' amaçlı negatif işaret uygulanır.
+        """
+        a_ids = self.vocab.encode(anchor_key)[0] if anchor_key else ()
+        return self._model_contrib_ids(*self.vocab.encode(target_key), a_ids)
+
+    def _model_contrib_ids(self, t_ids, t_unknown, a_ids):
+        """Kimlik sürümü: sözlükte olmayan kodların β/γ'sı 0 (yalnızca eklenen tekiller listesinde görünürler)."""
+        A = set(a_ids)
+        T = set(t_ids)
+        beta = self._beta_scaled
+        gamma = self._gamma_scaled
+
+        # Tekiller (kimlik sırası = kod sırası → toplama sırası string sürümüyle aynı)
+        add_single = [i for i in t_ids if i not in A]
+        beta_plus  = sum(beta.get(i, 0.0) for i in add_single)
+        beta_minus = sum(beta.get(i, 0.0) for i in a_ids if i not in T)
+        beta_sum   = beta_plus - self.REMOVAL_PENALTY * beta_minus
+
+        # Çiftler: T'de olup ikisi birden A'da olmayanlar eklenir, A'da olup ikisi birden T'de olmayanlar kaybolur
+        gamma_plus  = sum(gamma.get((i, j), 0.0) for i, j in itertools.combinations(t_ids, 2) if not (i in A and j in A))
+        gamma_minus = sum(gamma.get((i, j), 0.0) for i, j in itertools.combinations(a_ids, 2) if not (i in T and j in T))
+        gamma_sum   = gamma_plus - self.REMOVAL_PENALTY * gamma_minus
+
+        added_icds = self.vocab.decode(add_single)
+        if t_unknown:
+            added_icds = sorted(added_icds + list(t_unknown))
+        return beta_sum, gamma_sum, added_icds
+
+    def saturation(self, total_add:float, k:float=None):
+        k = self.SATURATION_K if k is None else k
+        if not self.SATURATION_ON:
+            return total_add
+        return float(k * (1.0 - math.exp(-float(total_add)/float(k))))
+
+    def _pair_floor(self, T:set, floor:float) -> float:
+        for i, j in itertools.combinations(sorted(T), 2):
+            pf = self.pair_floor_map.get(f"{i}||{j}", 0.0)
+            pf = max(pf, self.pair_floor_map.get(f"{j}||{i}", 0.0))
+            floor = max(floor, pf)
+        return floor
+
+    def _pair_floor_ids_max(self, t_ids, n_total:int, floor:float) -> float:
+        if n_total >= 2:
+            floor = max(floor, 0.0)  # string sürümünde haritada olmayan her çift 0.0 verir
+        pf_map = self._pair_floor_ids
+        for pair in itertools.combinations(t_ids, 2):
+            pf = pf_map.get(pair)
+            if pf is not None and pf > floor:
+                floor = pf
+        return floor
+
+    def guardrails(self, yg:str, bolum:str, target_key:str, pred:float):
+        """
+        Tekil floor KALDIRILDI.
+        Pair floor ve alt-küme (subset) floor'lar devam ediyor.
+        Alt-küme floor ScopeIndex.subset_floor ile (tarama yok); sonuç guardrails_scan ile aynıdır.
+        """
+        return self._guardrails_ids(yg, bolum, *self.vocab.encode(target_key), pred)
+
+    def _guardrails_ids(self, yg:str, bolum:str, t_ids, t_unknown, pred:float):
+        floor1 = pred  # tekil floor kaldırıldı, doğrudan pred
+
+        # Pair floor
+        floor2 = self._pair_floor_ids_max(t_ids, len(t_ids) + len(t_unknown), floor1)
+
+        # Alt-küme floor (3D→2D→1D); bilinmeyen kod içeren alt küme hiçbir kapsamda yok
+        floor3 = floor2
+        for scope in (self.scope3.get((yg, bolum)), self.scope2.get(bolum), self.scope1):
+            if scope is not None:
+                floor3 = scope.subset_floor(t_ids, floor3)
+        return floor3
+
+    def guardrails_scan(self, yg:str, bolum:str, target_key:str, pred:float):
+        """Referans: lkp3/lkp2/lkp1 satırlarının tamamı üzerinde issubset taraması (bench/doğrulama)."""
+        T = as_set(target_key)
+        floor2 = self._pair_floor(T, pred)
+
+        floor3 = floor2
+        for key in self.ctx3_by_demo.get((yg, bolum), []):
+            if as_set(key).issubset(T):
+                floor3 = max(floor3, float(self.lkp3_map[(yg, bolum, key)][0]))
+        for key in self.ctx2_by_bolum.get(bolum, []):
+            if as_set(key).issubset(T):
+                floor3 = max(floor3, float(self.lkp2_map[(bolum, key)][0]))
+        for key, (p50, _n) in self.lkp1_map.items():
+            if as_set(key).issubset(T):
+                floor3 = max(floor3, float(p50))
+        return floor3
+
+    def predict_one(self, yg:str, bolum:str, target_key:str):
+        src, anchor_p50, n, anchor_key = self.find_anchor(yg, bolum, target_key)
+
+        # === KISA DEVRE: 3D/2D/1D tam eşleşmede HİÇBİR ŞEY ekleme, GUARDRAILS DA YOK ===
+        if anchor_p50 is not None and anchor_key == target_key and src in ("3D", "2D", "1D"):
+            return float(anchor_p50), _exact_meta(src, anchor_key, anchor_p50)
+        # === /KISA DEVRE ===
+
+        return self._predict_unseen(yg, bolum, target_key, self._neighbor_scope(yg, bolum), self._cap_val(yg, bolum),
+                                    src, anchor_p50, anchor_key)
+
+    def _cap_val(self, yg:str, bolum:str) -> float:
+        cap_ref = self.demop90_map.get((yg, bolum), self.lkp0_p90)
+        return float(cap_ref) * float(self.CAP_MARJ) if cap_ref is not None else float("inf")
+
+    def _predict_unseen(self, yg:str, bolum:str, target_key:str, scope_tag, cap_val:float,
+                        src=None, anchor_p50=None, anchor_key=None):
+        """predict_one'ın kısa devre sonrası kısmı; scope_tag (_neighbor_scope) ve cap_val (_cap_val) çağırandan gelir."""
+        # Hedef set bir kez kimliklere çevrilir (komşu, katkı ve guardrail aynı demeti kullanır)
+        t_ids, t_unknown = self.vocab.encode(target_key)
+        if anchor_p50 is None:
+            J, neigh_p50, neigh_key, neigh_src = self._nearest_neighbor_anchor_ids(yg, bolum, t_ids, t_unknown, scope_tag)
+            anchor_p50, anchor_key = float(neigh_p50), neigh_key
+            src = f"NEIGHBOR_{neigh_src}"
+            alpha = float(J)  # ALPHA = en iyi tek komşu J (değişmedi)
+        else:
+            alpha = 0.0
+
+        a_ids = self.vocab.encode(anchor_key)[0] if anchor_key else ()
+        beta_sum, gamma_sum, added_icds = self._model_contrib_ids(t_ids, t_unknown, a_ids)
+        add_total = self.saturation(beta_sum + gamma_sum)
+        model_pred = float(anchor_p50) + add_total
+        pred_blend = (1.0 - alpha) * model_pred + alpha * float(anchor_p50)
+
+        # ---- Erken guardrail (pred_blend < 1 ise anchor P50'ye kısa devre)
+        if pred_blend < 1.0:
+            pred_final = float(anchor_p50)
+        else:
+            pred_final = pred_blend
+
+        # ---- Pair + alt-küme floor (opsiyonel; GUARDRAILS_ON)
+        if self.GUARDRAILS_ON:
+            pred_final = self._guardrails_ids(yg, bolum, t_ids, t_unknown, pred_final)
+
+        # ---- P90 CAP (demografi+bölüm)
+        if cap_val is not None:
+            pred_final = min(float(pred_final), float(cap_val))
+        # ---- /P90 CAP
+
+        meta = {
+            "ANCHOR_SRC": src,
+            "ANCHOR_KEY": anchor_key if anchor_key else "",
+            "ANCHOR_P50": float(anchor_p50),
+            "ALPHA_JACCARD": float(alpha),
+            "ADDED_ICDS": ",".join(added_icds),
+            "BETA_SUM": float(beta_sum),
+            "GAMMA_SUM": float(gamma_sum),
+            "MODEL_PRED": float(model_pred),
+            "PRED_BLEND": float(pred_blend),
+        }
+        return float(pred_final), meta
+
+    def xgb_predict_ens(self, yg: str, bolum: str, key: str, icd_list_norm=None):
+        if not self.XGB_ENS_ON or self.xgb_plain is None:
+            return np.nan, np.nan, np.nan
+        # tek satır özellik kur
+        if icd_list_norm is None:
+            icd_list_norm = key.split("||") if key else []
+        X_one = self.encoder.transform([(yg, bolum, icd_list_norm)])
+        p_plain = float(self.xgb_plain.predict(X_one)[0])
+        p_log = float(np.expm1(self.xgb_log.predict(X_one)[0]))
+        p_ens = (1.0 - float(self.XGB_ALPHA_LOG)) * p_plain + float(self.XGB_ALPHA_LOG) * p_log
+        return p_plain, p_log, p_ens
+
+    def cache_key(self, yg: str, bolum: str, key: str, icd_list_norm=None):
+        """predict_one + xgb_predict_ens sonucunu belirleyen anahtar (servis önbelleği için)."""
+        if not self.XGB_ENS_ON or self.encoder is None:
+            return yg, bolum, key, None
+        if icd_list_norm is None:
+            icd_list_norm = key.split("||") if key else []
+        return yg, bolum, key, self.encoder.signature(icd_list_norm)
+
+    def xgb_predict_ens_many(self, rows):
+        """
+        rows: [(yg, bolum, key, icd_list_norm)] → (p_plain, p_log, p_ens) float64 dizileri.
+        Tüm satırlar tek CSR'de; her booster bir kez predict edilir (satır bazında xgb_predict_ens ile aynı sonuç).
+        """
+        n = len(rows)
+        if not self.XGB_ENS_ON or self.xgb_plain is None or n == 0:
+            nan = np.full(n, np.nan)
+            return nan, nan.copy(), nan.copy()
+        X = self.encoder.transform([
+            (yg, bolum, icd_list_norm if icd_list_norm is not None else (key.split("||") if key else []))
+            for yg, bolum, key, icd_list_norm in rows
+        ])
+        p_plain = self.xgb_plain.predict(X).astype(np.float64)
+        p_log = np.expm1(self.xgb_log.predict(X)).astype(np.float64)
+        p_ens = (1.0 - float(self.XGB_ALPHA_LOG)) * p_plain + float(self.XGB_ALPHA_LOG) * p_log
+        return p_plain, p_log, p_ens
+
+    def predict_one_many(self, cases):
+        """cases: [(yg, bolum, key)] → [(pred, meta)]; aynı kombinasyon bir kez hesaplanır (kapsam indeksleri ortak)."""
+        memo = {}
+        out = []
+        for case in cases:
+            r = memo.get(case)
+            if r is None:
+                r = memo[case] = self.predict_one(*case)
+            out.append(r)
+        return out
+
+    def predict_many(self, df: pd.DataFrame, yg_col: str = "YaşGrup", bolum_col: str = "Bölüm",
+                     key_col: str = "ICD_Set_Key") -> pd.DataFrame:
+        """
+        df'nin her satırı için predict_one(yg, bolum, key) → df.index'li DataFrame [PRED_RULE, *META_COLUMNS].
+        Benzersiz kombinasyonlar bir kez çözülür: tam eşleşmeler lkp3 → lkp2 → lkp1 hash join'iyle bulunur
+        (kısa devre; meta sütunları dizi olarak doldurulur); kalanlar (YaşGrup, Bölüm) gruplarında komşu yolundan
+        geçer — kapsam zinciri ve P90 tavanı grup başına bir kez, kapsam indeksleri ortak.
+        Sonuç satır satır predict_one ile aynıdır.
+        """
+        cases = df[[yg_col, bolum_col, key_col]]
+        codes, uniq = pd.factorize(pd.MultiIndex.from_frame(cases))  # uniq: ilk görülme sırasıyla benzersiz kombinasyonlar
+        yg_u, bolum_u, key_u = (uniq.get_level_values(i).to_numpy(dtype=object) for i in range(3))
+        nu = len(uniq)
+
+        # ---- 1) Tam eşleşme: 3D → 2D → 1D (predict_one kısa devresi)
+        src = np.full(nu, None, dtype=object)
+        p50 = np.full(nu, np.nan)
+        for i, (yg, bolum, key) in enumerate(zip(yg_u.tolist(), bolum_u.tolist(), key_u.tolist())):
+            hit = self.lkp3_map.get((yg, bolum, key))
+            if hit is not None:
+                src[i], p50[i] = "3D", hit[0]
+                continue
+            hit = self.lkp2_map.get((bolum, key))
+            if hit is not None:
+                src[i], p50[i] = "2D", hit[0]
+                continue
+            hit = self.lkp1_map.get(key)
+            if hit is not None:
+                src[i], p50[i] = "1D", hit[0]
+        exact = src != None  # noqa: E711 — nesne dizisinde eleman bazlı karşılaştırma
+
+        pred = p50.copy()
+        meta = {
+            "ANCHOR_SRC": src,
+            "ANCHOR_KEY": np.where(exact, key_u, ""),
+            "ANCHOR_P50": p50.copy(),
+            "ALPHA_JACCARD": np.zeros(nu),
+            "ADDED_ICDS": np.full(nu, "", dtype=object),
+            "BETA_SUM": np.zeros(nu),
+            "GAMMA_SUM": np.zeros(nu),
+            "MODEL_PRED": p50.copy(),
+            "PRED_BLEND": p50.copy(),
+        }
+
+        # ---- 2) Kalanlar: (YaşGrup, Bölüm) grupları
+        groups = defaultdict(list)
+        for i in np.flatnonzero(~exact).tolist():
+            groups[(yg_u[i], bolum_u[i])].append(i)
+        for (yg, bolum), idx in groups.items():
+            scope_tag, cap_val = self._neighbor_scope(yg, bolum), self._cap_val(yg, bolum)
+            for i in idx:
+                pred[i], m = self._predict_unseen(yg, bolum, key_u[i], scope_tag, cap_val)
+                for c in META_COLUMNS:
+                    meta[c][i] = m[c]
+
+        out = pd.DataFrame({"PRED_RULE": pred, **meta}).take(codes)
+        out.index = df.index
+        return out
+
+
+# ================== KAYDET / YÜKLE (model.bundle) ==================
+def _ix(table: dict, v) -> int:
+    return table.setdefault(v, len(table))
+
+def _pack_sections(model: LosModel):
+    """LosModel durumu → paket bölümleri (metinler sözlük tablolarına, sayılar dizilere)."""
+    yg_ix, bolum_ix, key_ix, icd_ix = {}, {}, {}, {}
+    sec = {}
+
+    rows = list(model.lkp3_map.items())
+    sec["lkp3.yg"] = np.array([_ix(yg_ix, yg) for (yg, _b, _k), _v in rows], dtype=np.int32)
+    sec["lkp3.bolum"] = np.array([_ix(bolum_ix, b) for (_yg, b, _k), _v in rows], dtype=np.int32)
+    sec["lkp3.key"] = np.array([_ix(key_ix, k) for (_yg, _b, k), _v in rows], dtype=np.int32)
+    sec["lkp3.p50"] = np.array([p50 for _k, (p50, _n) in rows], dtype=np.float64)
+    sec["lkp3.n"] = np.array([n for _k, (_p50, n) in rows], dtype=np.int64)
+
+    rows = list(model.lkp2_map.items())
+    sec["lkp2.bolum"] = np.array([_ix(bolum_ix, b) for (b, _k), _v in rows], dtype=np.int32)
+    sec["lkp2.key"] = np.array([_ix(key_ix, k) for (_b, k), _v in rows], dtype=np.int32)
+    sec["lkp2.p50"] = np.array([p50 for _k, (p50, _n) in rows], dtype=np.float64)
+    sec["lkp2.n"] = np.array([n for _k, (_p50, n) in rows], dtype=np.int64)
+
+    rows = list(model.lkp1_map.items())
+    sec["lkp1.key"] = np.array([_ix(key_ix, k) for k, _v in rows], dtype=np.int32)
+    sec["lkp1.p50"] = np.array([p50 for _k, (p50, _n) in rows], dtype=np.float64)
+    sec["lkp1.n"] = np.array([n for _k, (_p50, n) in rows], dtype=np.int64)
+
+    # ctx3_by_demo: (YG,Bölüm) → 3D anahtar listesi (sıra korunur; komşu eşitliklerinde önemli)
+    rows = [(demo, k) for demo, keys in model.ctx3_by_demo.items() for k in keys]
+    sec["ctx3.yg"] = np.array([_ix(yg_ix, yg) for (yg, _b), _k in rows], dtype=np.int32)
+    sec["ctx3.bolum"] = np.array([_ix(bolum_ix, b) for (_yg, b), _k in rows], dtype=np.int32)
+    sec["ctx3.key"] = np.array([_ix(key_ix, k) for _d, k in rows], dtype=np.int32)
+
+    rows = list(model.pair_floor_map.items())
+    sec["pair_floor.key"] = np.array([_ix(key_ix, k) for k, _v in rows], dtype=np.int32)
+    sec["pair_floor.p50"] = np.array([v for _k, v in rows], dtype=np.float64)
+
+    rows = list(model.demop90_map.items())
+    sec["demo_p90.yg"] = np.array([_ix(yg_ix, yg) for (yg, _b), _v in rows], dtype=np.int32)
+    sec["demo_p90.bolum"] = np.array([_ix(bolum_ix, b) for (_yg, b), _v in rows], dtype=np.int32)
+    sec["demo_p90.p90"] = np.array([v for _k, v in rows], dtype=np.float64)
+
+    rows = list(model.beta_icd.items())
+    sec["beta.icd"] = np.array([_ix(icd_ix, i) for i, _v in rows], dtype=np.int32)
+    sec["beta.val"] = np.array([v for _i, v in rows], dtype=np.float64)
+    sec["beta.support"] = np.array([model.beta_support.get(i, 0) for i, _v in rows], dtype=np.int64)
+
+    rows = list(model.gamma_pairs.items())
+    sec["gamma.i"] = np.array([_ix(icd_ix, i) for (i, _j), _v in rows], dtype=np.int32)
+    sec["gamma.j"] = np.array([_ix(icd_ix, j) for (_i, j), _v in rows], dtype=np.int32)
+    sec["gamma.val"] = np.array([v for _p, v in rows], dtype=np.float64)
+    sec["gamma.support"] = np.array([model.gamma_support.get(p, 0) for p, _v in rows], dtype=np.int64)
+
+    # Komşu indeksi: kapsamlar (1D, 2D bölüm, 3D demo sırası) art arda; yüklemede anahtarlar yeniden ayrıştırılmaz
+    scopes = [((-1, -1), model.scope1)]
+    scopes += [((-1, _ix(bolum_ix, b)), s) for b, s in model.scope2.items()]
+    scopes += [((_ix(yg_ix, yg), _ix(bolum_ix, b)), s) for (yg, b), s in model.scope3.items()]
+    sec["nb.scope.yg"] = np.array([y for (y, _b), _s in scopes], dtype=np.int32)
+    sec["nb.scope.bolum"] = np.array([b for (_y, b), _s in scopes], dtype=np.int32)
+    sec["nb.scope.ptr"] = np.cumsum([0] + [len(s) for _d, s in scopes], dtype=np.int64)
+    sec["nb.scope.col_ptr"] = np.cumsum([0] + [len(s.col_ids) for _d, s in scopes], dtype=np.int64)
+    sec["nb.cand.key"] = np.array([_ix(key_ix, k) for _d, s in scopes for k in s.keys], dtype=np.int32)
+    sec["nb.cand.p50"] = np.concatenate([s.p50_a for _d, s in scopes])
+    sec["nb.cand.n"] = np.concatenate([s.n_a for _d, s in scopes])
+    sec["nb.cand.size"] = np.concatenate([s.sizes_a for _d, s in scopes])
+    sec["nb.col.id"] = np.concatenate([s.col_ids for _d, s in scopes]).astype(np.int32)
+    sec["nb.col.len"] = np.concatenate([np.diff(s.col_ptr) for _d, s in scopes])
+    sec["nb.col.rows"] = np.concatenate([s.col_rows for _d, s in scopes])
+    sec["str.vocab.offsets"], sec["str.vocab.blob"] = paket.encode_strings(model.vocab.codes)
+    rows = list(model._beta_scaled.items())
+    sec["nb.beta.id"] = np.array([i for i, _v in rows], dtype=np.int32)
+    sec["nb.beta.val"] = np.array([v for _i, v in rows], dtype=np.float64)
+    for name, table in (("gamma", model._gamma_scaled), ("pair_floor", model._pair_floor_ids)):
+        rows = list(table.items())
+        sec[f"nb.{name}.i"] = np.array([i for (i, _j), _v in rows], dtype=np.int32)
+        sec[f"nb.{name}.j"] = np.array([j for (_i, j), _v in rows], dtype=np.int32)
+        sec[f"nb.{name}.val"] = np.array([v for _p, v in rows], dtype=np.float64)
+
+    for name, table in (("yg", yg_ix), ("bolum", bolum_ix), ("key", key_ix), ("icd", icd_ix)):
+        sec[f"str.{name}.offsets"], sec[f"str.{name}.blob"] = paket.encode_strings(list(table))
+    sec["str.icd_alias.offsets"], sec["str.icd_alias.blob"] = paket.encode_strings(model.icd_aliases)
+
+    xgb_meta = None
+    if model.xgb_plain is not None:
+        # Booster'lar UBJSON ham bayt; özellik kodlayıcı yalnızca sınıf listeleriyle yeniden kurulur
+        sec["xgb.plain"] = np.frombuffer(bytes(model.xgb_plain.get_booster().save_raw("ubj")), dtype=np.uint8)
+        sec["xgb.log"] = np.frombuffer(bytes(model.xgb_log.get_booster().save_raw("ubj")), dtype=np.uint8)
+        xgb_meta = {
+            "ohe_columns": FEATURE_CAT_COLUMNS,
+            "ohe_categories": [[str(v) for v in cats] for cats in model.encoder.ohe_categories],
+            "top_icds": [str(c) for c in model.XGB_TOP_ICDS],
+        }
+    return sec, xgb_meta
+
+def _unpack_state(sec: dict) -> dict:
+    yg = paket.decode_strings(sec["str.yg.offsets"], sec["str.yg.blob"])
+    bolum = paket.decode_strings(sec["str.bolum.offsets"], sec["str.bolum.blob"])
+    keys = paket.decode_strings(sec["str.key.offsets"], sec["str.key.blob"])
+    icd = paket.decode_strings(sec["str.icd.offsets"], sec["str.icd.blob"])
+
+    def col(name, table=None):
+        vals = sec[name].tolist()
+        return [table[v] for v in vals] if table is not None else vals
+
+    ctx3_by_demo = {}
+    for y, b, k in zip(col("ctx3.yg", yg), col("ctx3.bolum", bolum), col("ctx3.key", keys)):
+        ctx3_by_demo.setdefault((y, b), []).append(k)
+
+    beta_icd_ids = col("beta.icd", icd)
+    gamma_ids = list(zip(col("gamma.i", icd), col("gamma.j", icd)))
+    return {
+        "lkp3_map": dict(zip(zip(col("lkp3.yg", yg), col("lkp3.bolum", bolum), col("lkp3.key", keys)),
+                             zip(col("lkp3.p50"), col("lkp3.n")))),
+        "lkp2_map": dict(zip(zip(col("lkp2.bolum", bolum), col("lkp2.key", keys)),
+                             zip(col("lkp2.p50"), col("lkp2.n")))),
+        "lkp1_map": dict(zip(col("lkp1.key", keys), zip(col("lkp1.p50"), col("lkp1.n")))),
+        "ctx3_by_demo": ctx3_by_demo,
+        "pair_floor_map": dict(zip(col("pair_floor.key", keys), col("pair_floor.p50"))),
+        "demop90_map": dict(zip(zip(col("demo_p90.yg", yg), col("demo_p90.bolum", bolum)), col("demo_p90.p90"))),
+        "beta_icd": dict(zip(beta_icd_ids, col("beta.val"))),
+        "beta_support": dict(zip(beta_icd_ids, col("beta.support"))),
+        "gamma_pairs": dict(zip(gamma_ids, col("gamma.val"))),
+        "gamma_support": dict(zip(gamma_ids, col("gamma.support"))),
+        "icd_aliases": (paket.decode_strings(sec["str.icd_alias.offsets"], sec["str.icd_alias.blob"])
+                        if "str.icd_alias.offsets" in sec else []),
+        "neighbor_index": _unpack_neighbor_index(sec, yg, bolum, keys) if "nb.scope.ptr" in sec else None,  # eski paketler → yeniden kurulur
+    }
+
+def _unpack_neighbor_index(sec: dict, yg: list, bolum: list, keys: list) -> dict:
+    """nb.* bölümleri → LosModel._build_neighbor_index girdisi; ScopeIndex dizileri paket görünümleri (col_ptr hariç)."""
+    scope_ptr, col_ptr_ptr = sec["nb.scope.ptr"].tolist(), sec["nb.scope.col_ptr"].tolist()
+    cand_keys = [keys[i] for i in sec["nb.cand.key"].tolist()]
+    p50, n, size = sec["nb.cand.p50"], sec["nb.cand.n"], sec["nb.cand.size"]
+    col_id, col_len, col_rows = sec["nb.col.id"], sec["nb.col.len"], sec["nb.col.rows"]
+    scopes, r0 = {}, 0
+    for s, (y, b) in enumerate(zip(sec["nb.scope.yg"].tolist(), sec["nb.scope.bolum"].tolist())):
+        a, e = scope_ptr[s], scope_ptr[s + 1]
+        c0, c1 = col_ptr_ptr[s], col_ptr_ptr[s + 1]
+        col_ptr = np.zeros(c1 - c0 + 1, dtype=np.int64)
+        np.cumsum(col_len[c0:c1], out=col_ptr[1:])
+        r1 = r0 + int(col_ptr[-1])
+        scopes[(yg[y] if y >= 0 else None, bolum[b] if b >= 0 else None)] = ScopeIndex(
+            cand_keys[a:e], p50[a:e], n[a:e], size[a:e], col_id[c0:c1], col_ptr, col_rows[r0:r1])
+        r0 = r1
+
+    def pairs(name):
+        return dict(zip(zip(sec[f"nb.{name}.i"].tolist(), sec[f"nb.{name}.j"].tolist()), sec[f"nb.{name}.val"].tolist()))
+    return {
+        "vocab": paket.decode_strings(sec["str.vocab.offsets"], sec["str.vocab.blob"]),
+        "scopes": scopes,
+        "beta": dict(zip(sec["nb.beta.id"].tolist(), sec["nb.beta.val"].tolist())),
+        "gamma": pairs("gamma"),
+        "pair_floor": pairs("pair_floor"),
+    }
+
+def _unpack_xgb(sec: dict, xgb_meta: dict) -> dict:
+    xgb_plain = XGBRegressor()
+    xgb_plain.load_model(bytearray(sec["xgb.plain"]))
+    xgb_log = XGBRegressor()
+    xgb_log.load_model(bytearray(sec["xgb.log"]))
+    return {
+        "xgb_plain": xgb_plain, "xgb_log": xgb_log,
+        "ohe_categories": xgb_meta["ohe_categories"], "top_icds": list(xgb_meta["top_icds"]),
+    }
+
+def save_model(model: LosModel, model_dir: str = MODEL_DIR, config: dict = None) -> str:
+    """Servisin ihtiyaç duyduğu tüm durumu tek model.bundle dosyasına yazar; sha256 döner."""
+    os.makedirs(model_dir, exist_ok=True)
+    sec, xgb_meta = _pack_sections(model)
+    cfg = dict(config or {})
+    meta = {
+        "lkp0_p50": model.lkp0_p50,
+        "lkp0_p90": model.lkp0_p90,
+        "params": model.params(),
+        "config": cfg,
+        "xgb": xgb_meta,
+    }
+    sha = paket.write_bundle(os.path.join(model_dir, paket.BUNDLE_FILE), sec, meta)
+    # İnsan okuması için (servis kullanmaz)
+    with open(os.path.join(model_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({**cfg, "params": model.params(), "bundle_sha256": sha,
+                   "bundle_format": paket.FORMAT_VERSION}, f, ensure_ascii=False, indent=2)
+    model.bundle_sha256 = sha
+    return sha
+
+def save_pred_table(model: LosModel, yg, bolum, keys, pred_rule, pred_xgb_ens, model_dir: str = MODEL_DIR) -> str:
+    """PRED_LOS sütunları → model_dir/pred_table.bundle; modelin bundle_sha256'sına bağlıdır (başka modelle yüklenmez)."""
+    sec = {"pred_rule": np.asarray(pred_rule, dtype=np.float64), "pred_xgb_ens": np.asarray(pred_xgb_ens, dtype=np.float64)}
+    yg, bolum, keys = list(yg), list(bolum), list(keys)
+    for name, vals in (("yg", yg), ("bolum", bolum)):  # az sayıda ayrı değer → sözlük tablosu + kimlik dizisi
+        table = {}
+        sec[f"{name}.id"] = np.array([_ix(table, v) for v in vals], dtype=np.int32)
+        sec[f"str.{name}.offsets"], sec[f"str.{name}.blob"] = paket.encode_strings(list(table))
+    sec["str.key.offsets"], sec["str.key.blob"] = paket.encode_strings(keys)
+    sigs = [model.cache_key(y, b, k)[3] for y, b, k in zip(yg, bolum, keys)]
+    if all(sig is not None for sig in sigs):
+        # cache_key imzaları (top-ICD sütunları CSR + ICD sayısı) → yüklemede FeatureEncoder.signature yeniden hesaplanmaz
+        sec["sig.ptr"] = np.cumsum([0] + [len(cols) for cols, _n in sigs], dtype=np.int64)
+        sec["sig.cols"] = np.array([c for cols, _n in sigs for c in cols], dtype=np.int32)
+        sec["sig.count"] = np.array([n for _cols, n in sigs], dtype=np.int32)
+    meta = {"bundle_sha256": model.bundle_sha256, "n": int(len(sec["pred_rule"]))}
+    return paket.write_bundle(os.path.join(model_dir, PRED_TABLE_FILE), sec, meta)
+
+def _unpack_signatures(sec: dict) -> list:
+    ptr, cols = sec["sig.ptr"].tolist(), sec["sig.cols"].tolist()
+    return [(tuple(cols[a:b]), n) for a, b, n in zip(ptr, ptr[1:], sec["sig.count"].tolist())]
+
+def load_pred_table(model: LosModel, model_dir: str = MODEL_DIR, verify: bool = True) -> dict:
+    """pred_table.bundle → {cache_key: (PRED_RULE, PRED_XGB_ENS)}; dosya yoksa ya da başka modele aitse boş sözlük."""
+    path = os.path.join(model_dir, PRED_TABLE_FILE)
+    if not os.path.exists(path):
+        return {}
+    meta, sec, _sha = paket.read_bundle(path, verify=verify)
+    if meta.get("bundle_sha256") != model.bundle_sha256:
+        return {}
+    yg, bolum, keys = (paket.decode_strings(sec[f"str.{n}.offsets"], sec[f"str.{n}.blob"]) for n in ("yg", "bolum", "key"))
+    if "yg.id" in sec:  # eski tablolarda YaşGrup/Bölüm satır başına metin
+        yg, bolum = [yg[i] for i in sec["yg.id"].tolist()], [bolum[i] for i in sec["bolum.id"].tolist()]
+    vals = zip(sec["pred_rule"].tolist(), sec["pred_xgb_ens"].tolist())
+    if not model.XGB_ENS_ON or model.encoder is None:
+        return {(y, b, k, None): v for y, b, k, v in zip(yg, bolum, keys, vals)}
+    if "sig.ptr" not in sec:  # eski tablolar: imza satır satır yeniden hesaplanır
+        return {model.cache_key(y, b, k): v for y, b, k, v in zip(yg, bolum, keys, vals)}
+    return {(y, b, k, sig): v for y, b, k, sig, v in zip(yg, bolum, keys, _unpack_signatures(sec), vals)}
+
+def pred_table_matches(model_dir: str = MODEL_DIR) -> bool:
+    """pred_table.bundle var ve model_dir/model.bundle'a mı bağlı (yalnızca başlıklar; sha doğrulaması yok)."""
+    try:
+        _meta, _sec, sha = paket.read_bundle(os.path.join(model_dir, paket.BUNDLE_FILE), verify=False)
+        meta, _sec, _sha = paket.read_bundle(os.path.join(model_dir, PRED_TABLE_FILE), verify=False)
+    except (OSError, ValueError):
+        return False
+    return meta.get("bundle_sha256") == sha
+
+def load_model(model_dir: str = MODEL_DIR, verify: bool = True) -> LosModel:
+    """Yalnızca servis: model_dir/model.bundle'dan LosModel kurar (yeniden eğitim yok, pandas okuması yok)."""
+    path = os.path.join(model_dir, paket.BUNDLE_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model paketi bulunamadı: {path} (önce `python proje.py` ile eğitin)")
+    meta, sec, sha = paket.read_bundle(path, verify=verify)
+    state = _unpack_state(sec)
+    state["lkp0_p50"] = meta["lkp0_p50"]
+    state["lkp0_p90"] = meta["lkp0_p90"]
+    xgb = _unpack_xgb(sec, meta["xgb"]) if meta.get("xgb") else None
+    model = LosModel(state, meta["params"], xgb=xgb, config=meta["config"])
+    model.bundle_sha256 = sha
+    model.pred_table = load_pred_table(model, model_dir, verify=verify)
+    return model
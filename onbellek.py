@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Servis katmanı tahmin önbelleği: sınırlı LRU + TTL, /tahmin, /api/predict ve /api/predict/batch ortak kullanır.
+# Anahtar: (YaşGrup, Bölüm, ICD_Set_Key, XGB imzası) — predict_one normalize anahtarın, xgb_predict_ens ise
+# FeatureEncoder.signature'ın saf fonksiyonu; imza ham ICD listesinin XGB'ye görünen kısmıdır (top-ICD + sayı).
+# Model değişince (set_model, yeni bundle_sha256) önbellek boşalır; eski modelle süren isteklerin get/put'u
+# (farklı sha) önbelleğe dokunmaz — yeniden yükleme sırasında yeni modelin girdileri silinmez.
+#   PRED_CACHE_SIZE (varsayılan 20000, 0 → kapalı), PRED_CACHE_TTL saniye (varsayılan 3600, 0 → süresiz)
+import os, time, threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    def __init__(self, maxsize: int = 20000, ttl: float = 3600.0, clock=time.monotonic):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self._clock = clock
+        self._data = OrderedDict()  # key → (son geçerlilik, değer)
+        self._lock = threading.Lock()
+        self._sha = None
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def _check_model(self, sha) -> bool:
+        # kilit altında çağrılır; ilk görülen sha benimsenir, sonrası yalnızca set_model ile değişir
+        if self._sha is None:
+            self._sha = sha
+        return sha == self._sha
+
+    def set_model(self, sha) -> None:
+        """Yeni model devreye girdi: farklı sha ise önbelleği boşaltır."""
+        with self._lock:
+            if sha != self._sha:
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._sha = sha
+
+    def get(self, sha, key):
+        """Değer ya da None; sha önbelleğin modeli değilse (eski/yeni model geçişi) ıskalama sayılır."""
+        if self.maxsize <= 0:
+            self.misses += 1
+            return None
+        with self._lock:
+            if not self._check_model(sha):
+                self.misses += 1
+                return None
+            item = self._data.get(key)
+            if item is not None:
+                exp, value = item
+                if exp is None or exp > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, sha, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if not self._check_model(sha):
+                return
+            exp = self._clock() + self.ttl if self.ttl > 0 else None
+            self._data[key] = (exp, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data), "maxsize": self.maxsize, "ttl_s": self.ttl,
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions, "expirations": self.expirations,
+            "invalidations": self.invalidations, "bundle_sha256": self._sha,
+        }
+
+
+def from_env() -> PredictionCache:
+    return PredictionCache(
+        maxsize=int(os.environ.get("PRED_CACHE_SIZE", "20000")),
+        ttl=float(os.environ.get("PRED_CACHE_TTL", "3600")),
+    )
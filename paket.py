@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Paket biçimi: tek, sürümlü ikili dosya (model_out/model.bundle; veri.py sütunsal önbelleği de bunu kullanır)
+# Yerleşim:
+#   [0:8)      MAGIC  b"LOSBNDL\0"
+#   [8:16)     header uzunluğu H (uint64, little-endian)
+#   [16:16+H)  header JSON (utf-8): format_version, sha256, meta, sections{ad: {offset, dtype, shape}}
+#   ...        64 bayt hizalı bölümler (ham numpy dizileri)
+# Okuma np.memmap (salt-okunur, MAP_SHARED) ile yapılır: aynı paketi açan süreçler sayfaları paylaşır,
+# pandas/pickle yoktur. sha256 = meta JSON + tüm bölüm baytları (ad sırasıyla).
+import os, json, hashlib
+
+import numpy as np
+
+MAGIC = b"LOSBNDL\0"
+FORMAT_VERSION = 1
+BUNDLE_FILE = "model.bundle"
+_ALIGN = 64
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _content_hash(meta: dict, sections: dict) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(meta, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    for name in sorted(sections):
+        h.update(name.encode("utf-8"))
+        h.update(np.ascontiguousarray(sections[name]).view(np.uint8).reshape(-1).tobytes())
+    return h.hexdigest()
+
+def encode_strings(values):
+    """Metin listesi → (offsets int64[n+1], blob uint8) — memmap'lenebilir metin tablosu."""
+    parts = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    if parts:
+        offsets[1:] = np.cumsum([len(p) for p in parts])
+    blob = np.frombuffer(b"".join(parts), dtype=np.uint8)
+    return offsets, blob
+
+def decode_strings(offsets, blob):
+    raw = bytes(blob)
+    off = offsets.tolist()
+    return [raw[off[i]:off[i + 1]].decode("utf-8") for i in range(len(off) - 1)]
+
+def write_bundle(path: str, sections: dict, meta: dict) -> str:
+    """Bölümleri (ad → np.ndarray) ve meta'yı tek dosyaya yazar; sha256 döner. Yazım atomiktir (tmp + replace)."""
+    sections = {k: np.ascontiguousarray(v) for k, v in sections.items()}
+    sha = _content_hash(meta, sections)
+
+    # Offset'ler header uzunluğuna bağlı → uzunluk sabitlenene kadar yeniden hesapla
+    layout, header_bytes = {}, b""
+    while True:
+        start = _align(16 + len(header_bytes))
+        layout, pos = {}, start
+        for name in sorted(sections):
+            arr = sections[name]
+            layout[name] = {"offset": pos, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+            pos = _align(pos + arr.nbytes)
+        header = {"format_version": FORMAT_VERSION, "sha256": sha, "meta": meta, "sections": layout}
+        new_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        stable = len(new_bytes) == len(header_bytes)
+        header_bytes = new_bytes  # offset'ler bu turun yerleşiminden: uzunluk aynı olsa da içerik güncel olmalı
+        if stable:
+            break
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name in sorted(sections):
+            off = layout[name]["offset"]
+            f.write(b"\0" * (off - f.tell()))
+            f.write(sections[name].tobytes())
+    os.replace(tmp, path)
+    return sha
+
+def read_bundle(path: str, verify: bool = True):
+    """(meta, sections, sha256) döner; sections salt-okunur memmap görünümleridir (kopya yok)."""
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(buf[:8]) != MAGIC:
+        raise ValueError(f"Geçersiz model paketi: {path}")
+    hlen = int(buf[8:16].view(np.uint64)[0])
+    header = json.loads(bytes(buf[16:16 + hlen]).decode("utf-8"))
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Desteklenmeyen paket sürümü: {header.get('format_version')} (beklenen {FORMAT_VERSION})")
+
+    sections = {}
+    for name, sec in header["sections"].items():
+        dtype = np.dtype(sec["dtype"])
+        shape = tuple(sec["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        off = sec["offset"]
+        sections[name] = buf[off:off + nbytes].view(dtype).reshape(shape)
+
+    if verify and _content_hash(header["meta"], sections) != header["sha256"]:
+        raise ValueError(f"Model paketi bozuk (sha256 uyuşmuyor): {path}")
+    return header["meta"], sections, header["sha256"]
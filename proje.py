@@ -2,29 +2,28 @@
 # Hepsi bir arada: Lookup Excel + β/γ Katkı Modeli + Jaccard Harmanlama + Guardrails
 # ŞEMA (Cinsiyetsiz): 3D(YaşGrup+Bölüm+ICD_Set) → 2D(Bölüm+ICD_Set) → 1D(ICD_Set) → 0D(genel/komşu)
 # Opsiyoneller dahil "BİREBİR" uygulandı; cinsiyet tamamen çıkarıldı; eşik değerleri=1.
-import os, json, re, warnings, datetime, itertools, math, random
-from decimal import Decimal, ROUND_HALF_UP
-from collections import defaultdict, Counter
+# Eğitim scripti: `python proje.py` (servis bu dosyayı import ETMEZ; model_out/ artefaktlarını motor.load_model ile okur)
+import os, json, re, warnings, datetime, math, random
+from collections import defaultdict
 
 import pandas as pd
 import numpy as np
 
 from sklearn.model_selection import train_test_split
-from scipy import sparse
-from scipy.sparse import hstack  # <-- EKLENDİ
 
 # (Şimdilik kullanılmıyor ama kancalar dursun)
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer
 from xgboost import XGBRegressor
-import joblib
 
-# ---- YENİ: Progress bar için tqdm (yoksa zarifçe boş döngüye düş)
-try:
-    from tqdm.auto import tqdm
-except Exception:
-    def tqdm(x, **k): return x
-# ---- /YENİ
+from motor import (
+    LosModel, META_COLUMNS, save_model, save_pred_table, PRED_TABLE_FILE, pack_features,
+    round_half_up, yas_to_years_many, clean_text_anywhere_tags,
+    clean_icd_set_key, extract_icd_from_text, yas_to_group_many, map_unique, parse_icd_cells, icd_aliases,
+    IcdLists, lookup_tables, group_quantile,
+    as_set, as_key,
+)
+from veri import read_veri
 
 warnings.filterwarnings("ignore", category=UserWarning)
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -58,6 +57,12 @@ RHO_J = 1.2                          # ρ ~ 1..2 arası
 SHRINK_1SUPPORT_SCALE = 0.15         # support<3 için katkı ölçeği
 REMOVAL_PENALTY = 0.5                # A\T ve kaybolan çift cezalarını yumuşat
 CAP_MARJ = 1.0                      # P90 üst tavan marjı
+GUARDRAILS_ON = False                # True: komşu yolunda pair + alt-küme floor uygula (indeksli, tarama yok)
+
+# ---- YENİ (yaklaşık komşu: çok büyük lookup tabloları için)
+NEIGHBOR_MODE = "exact"              # "exact" | "lsh" (MinHash/LSH aday + tam Jaccard ile yeniden sıralama)
+LSH_RECALL = 0.95                    # J >= LSH_MIN_J olan komşunun bulunma olasılığı (bant sayısı buradan)
+LSH_MIN_J = 0.3                      # recall garantisinin geçerli olduğu en düşük Jaccard
 
 # ---- YENİ (TRUNCATE KALDIRILDI, SADECE WINSORIZE EKLENDİ) ----
 WINSORIZE_ON = True                  # True: train set LOS winsorize edilir (truncate yok)
@@ -82,120 +87,18 @@ XGB_PARAMS = dict(                   # makul başlangıç hiperparam.
 
 def stage(msg): print(f"[STAGE] {msg}", flush=True)
 
-def round_half_up(x):
-    if pd.isna(x): return None
-    return int(Decimal(str(float(x))).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
-
-def yas_to_years(val):
-    if pd.isna(val): return pd.NA
-    if isinstance(val, (int, float)): return float(val)
-    s = str(val).strip().lower()
-    if re.fullmatch(r"\d+(?:[.,]\d+)?", s):
-        return float(s.replace(",", "."))
-    yil = re.findall(r"(\d+)\s*yıl", s)
-    ay  = re.findall(r"(\d+)\s*ay", s)
-    gun = re.findall(r"(\d+)\s*gün", s)
-    years = 0.0
-    if yil: years += sum(float(x) for x in yil)
-    if ay:  years += sum(float(x) for x in ay) / 12
-    if gun: years += sum(float(x) for x in gun) / 365
-    if years == 0.0 and not (yil or ay or gun): return pd.NA
-    return round(years, 2)
-
-# Parantez/Etiket temizliği + Regex
-_PAREN_MAP = str.maketrans({'（':'(', '）':')', '【':'[', '】':']', '＜':'<', '＞':'>', '｛':'{', '｝':'}'})
-_PREFIX_RE = re.compile(r"""^\s*[\(\[\{\<]\s*(?:ö|ö|k|a)\s*[\)\]\}\>]\s*""", re.IGNORECASE | re.VERBOSE)
-_ANYWHERE_TAG_RE = re.compile(r"\(\s*(?:ö|ö|k|a)\s*\)", re.IGNORECASE)
-_ICD_CODE_RE = re.compile(r"\b([A-Z][0-9]{2}(?:\.[A-Z0-9]{1,4})?)\b", re.IGNORECASE)
-
-def clean_icd(raw) -> str:
-    if raw is None or (isinstance(raw, float) and pd.isna(raw)): return ""
-    s = str(raw).strip()
-    if not s: return ""
-    s = s.translate(_PAREN_MAP)
-    prev = None
-    while prev != s:
-        prev = s
-        s = _PREFIX_RE.sub("", s)
-    return s.strip().upper()
-
-def clean_text_anywhere_tags(raw) -> str:
-    if raw is None or (isinstance(raw, float) and pd.isna(raw)): return ""
-    s = str(raw).strip()
-    if not s: return ""
-    s = s.translate(_PAREN_MAP)
-    s = _ANYWHERE_TAG_RE.sub("", s)
-    s = re.sub(r"\s{2,}", " ", s).strip()
-    return s
-
-def split_icd_cell(s):
-    if pd.isna(s): return []
-    s = str(s).translate(_PAREN_MAP)
-    parts = re.split(r"[;,]", s)
-    parts = [clean_icd(p) for p in parts]
-    parts = [p for p in parts if p]
-    return parts
-
-def normalize_icd_set(lst):
-    lst_clean = [clean_icd(x) for x in lst if str(x).strip() != ""]
-    uniq = sorted(set(lst_clean), key=str)
-    return uniq, "||".join(uniq)
-
-def clean_icd_set_key(key: str) -> str:
-    if key is None or (isinstance(key, float) and pd.isna(key)): return ""
-    parts = [p.strip().upper() for p in str(key).split("||")]
-    parts = [clean_icd(p) for p in parts]
-    parts = [p for p in parts if p]
-    return "||".join(sorted(set(parts), key=str))
-
-def extract_icd_from_text(text: str):
-    if not isinstance(text, str) or not text.strip(): return []
-    t = _ANYWHERE_TAG_RE.sub("", text.translate(_PAREN_MAP))
-    return [m.upper() for m in _ICD_CODE_RE.findall(t)]
-
-def p90(x): return x.quantile(0.9)
-
-def yas_to_group(y):
-    if pd.isna(y): return pd.NA
-    y = float(y)
-    if y < 0: return pd.NA
-    if y <= 1:  return "0-1"
-    if y <= 5:  return "2-5"
-    if y <= 10: return "5-10"
-    if y <= 15: return "10-15"
-    if y <= 25: return "15-25"
-    if y <= 35: return "25-35"
-    if y <= 50: return "35-50"
-    if y <= 65: return "50-65"
-    return "65+"
-
-def jaccard(a:set, b:set)->float:
-    if not a and not b: return 0.0
-    inter = len(a & b)
-    union = len(a | b)
-    return inter/union if union>0 else 0.0
-
-def as_set(key:str)->set:
-    if not key: return set()
-    return set([k for k in key.split("||") if k])
-
-def as_key(s:set)->str:
-    return "||".join(sorted(s))
-
-def as_csr(x):
-    return x if sparse.issparse(x) else sparse.csr_matrix(x)
-
 # ================== 1) VERİYİ YÜKLE & TEMİZLE ==================
-stage("Excel okunuyor")
+stage("Excel okunuyor (sütunsal önbellek: .cache/)")
 if not os.path.exists(EXCEL_PATH):
     raise FileNotFoundError(f"Bulunamadı: {EXCEL_PATH}")
 
-df_raw = pd.read_excel(EXCEL_PATH)
-df = df_raw.copy()
+# Yalnız eğitimin kullandığı sütunlar okunur (önbellek sütunsal; diğer ~60 sütun belleğe hiç gelmez)
+SOURCE_COLUMNS = ["Yaş", "Yatış Gün Sayısı", "ICD Kodu", "ICD Adi Ve Kodu", "Bölüm"]
+df = read_veri(EXCEL_PATH, columns=SOURCE_COLUMNS)
 
 # Yaş & LOS
 if "Yaş" in df.columns:
-    df["Yaş"] = df["Yaş"].apply(yas_to_years)
+    df["Yaş"] = yas_to_years_many(df["Yaş"])
 else:
     df["Yaş"] = pd.NA
 df["Yatış Gün Sayısı"] = pd.to_numeric(df["Yatış Gün Sayısı"], errors="coerce")
@@ -209,28 +112,49 @@ if REQUIRE_ICD and df["ICD Kodu"].fillna("").eq("") .any() and FALLBACK_FROM_TEX
     base_text_col = "ICD Adi Ve Kodu" if "ICD Adi Ve Kodu" in df.columns else None
     if base_text_col:
         ix = df["ICD Kodu"].fillna("").eq("")
-        df.loc[ix, "ICD Kodu"] = df.loc[ix, base_text_col].fillna("").apply(
-            lambda t: ",".join(extract_icd_from_text(t))
-        )
-
-df["ICD_List"] = df["ICD Kodu"].apply(split_icd_cell)
-df["ICD_List_Norm"], df["ICD_Set_Key"] = zip(*df["ICD_List"].apply(normalize_icd_set))
-df["ICD_Set_Key"] = df["ICD_Set_Key"].apply(clean_icd_set_key)
-df["ICD_Sayısı"] = df["ICD_List_Norm"].apply(len)
+        df.loc[ix, "ICD Kodu"] = map_unique(df.loc[ix, base_text_col].fillna(""),
+                                            lambda t: ",".join(extract_icd_from_text(t)))
+
+# split → normalize → clean_icd_set_key: her benzersiz hücre bir kez (hücreler çok tekrar eder)
+# ICD listeleri satırda tutulmaz: liste = ICD_Set_Key'in parçaları → set başına CSR (aşağıda icd_sets)
+_icd_list, _icd_norm, df["ICD_Set_Key"] = parse_icd_cells(df["ICD Kodu"])
+df["ICD_Sayısı"] = _icd_norm.apply(len)
+del _icd_list, _icd_norm
 df = df[~(REQUIRE_ICD & (df["ICD_Sayısı"]==0))].copy()
+ICD_ALIASES = icd_aliases(df["ICD Kodu"])  # servis: ham parça → kanonik kod sözlüğü (IcdCanon)
 
 # Embedding metni (kanca)
 base_text_col = "ICD Adi Ve Kodu" if "ICD Adi Ve Kodu" in df.columns else "ICD Kodu"
-df["ICD_Text_Embed"] = df[base_text_col].map(clean_text_anywhere_tags).fillna("")
+df["ICD_Text_Embed"] = (pd.Series(map_unique(df[base_text_col], clean_text_anywhere_tags), index=df.index)
+                        .fillna("").astype("category"))
+df = df.drop(columns=["ICD Kodu", "ICD Adi Ve Kodu"], errors="ignore")  # ham metinler artık gerekmiyor
 
 # Yaş grup
 df["Yaş_Yıl_Int"] = pd.to_numeric(df["Yaş"], errors="coerce").round().astype("Int64")
-df["YaşGrup"] = df["Yaş"].apply(yas_to_group)
+df["YaşGrup"] = yas_to_group_many(df["Yaş"])  # motor.YAS_EDGES (servis de aynı kenarları kullanır)
+
+# Bellek: tekrar eden metinler kategorik (kategoriler sıralı → groupby sırası metin sütunuyla aynı);
+# ICD listeleri benzersiz set başına CSR, satır → set kimliği = ICD_Set_Key kategori kodu
+for _c in ("Bölüm", "YaşGrup", "ICD_Set_Key"):
+    df[_c] = df[_c].astype("category")
+icd_sets = IcdLists.from_keys(df["ICD_Set_Key"])
+
+def set_ids(frame: pd.DataFrame) -> np.ndarray:
+    return frame["ICD_Set_Key"].cat.codes.to_numpy()
+
+def _plain(frame: pd.DataFrame) -> pd.DataFrame:
+    """groupby çıktısındaki kategorik sütunlar → metin (sözlük anahtarları ve Excel çıktısı aynı kalır)."""
+    for c in frame.columns:
+        if isinstance(frame[c].dtype, pd.CategoricalDtype):
+            frame[c] = frame[c].astype(frame[c].cat.categories.dtype)
+    return frame
 
 # ================== 2) TRAIN/VALID SPLIT ==================
 stage("Train/Valid ayrımı (kombinasyon temelli)")
-# Kombinasyon id: (YG,Bölüm,ICD_Set_Key)
-df["ComboID"] = df["YaşGrup"].astype(str)+"||"+df["Bölüm"].astype(str)+"||"+df["ICD_Set_Key"].astype(str)
+# Kombinasyon id: (YG,Bölüm,ICD_Set_Key) → tamsayı, ilk görülme sırasıyla (eksik YG/Bölüm ayrı bir değer)
+_yg_c, _b_c, _k_c = (df[c].cat.codes.to_numpy(dtype=np.int64) + 1 for c in ("YaşGrup", "Bölüm", "ICD_Set_Key"))
+_nb, _nk = len(df["Bölüm"].cat.categories) + 1, len(df["ICD_Set_Key"].cat.categories) + 1
+df["ComboID"] = pd.factorize((_yg_c * _nb + _b_c) * _nk + _k_c)[0]
 unique_combos = df["ComboID"].dropna().unique()
 train_combos, valid_combos = train_test_split(unique_combos, test_size=0.2, random_state=RANDOM_SEED)
 is_train = df["ComboID"].isin(train_combos)
@@ -251,41 +175,19 @@ if WINSORIZE_ON:
 # ================== 3) LOOKUP TABLOLARI (train üzerinde) ==================
 stage("Lookup tabloları hesaplanıyor (train, cinsiyetsiz)")
 
-# 3D
-lkp3 = (
-    train_df.groupby(["YaşGrup", "Bölüm", "ICD_Set_Key"])["Yatış Gün Sayısı"]
-        .agg(N="count", Ortalama=lambda x: round_half_up(x.mean()), P50="median", P90=p90)
-        .reset_index()
+# 3D / 2D / 1D / 0D: değerler bir kez sıralanır, her seviye segment indirgemeleriyle
+# (groupby.agg(N, round_half_up(mean), median, quantile(0.9)) ile aynı tablolar; motor.lookup_tables)
+lkp3, lkp2, lkp1, lkp0 = lookup_tables(
+    train_df, "Yatış Gün Sayısı",
+    [["YaşGrup", "Bölüm", "ICD_Set_Key"], ["Bölüm", "ICD_Set_Key"], ["ICD_Set_Key"], []],
 )
 lkp3["ICD_Set_Key"] = lkp3["ICD_Set_Key"].apply(clean_icd_set_key)
-
-# 2D
-lkp2 = (
-    train_df.groupby(["Bölüm", "ICD_Set_Key"])["Yatış Gün Sayısı"]
-        .agg(N="count", Ortalama=lambda x: round_half_up(x.mean()), P50="median", P90=p90)
-        .reset_index()
-)
 lkp2["ICD_Set_Key"] = lkp2["ICD_Set_Key"].apply(clean_icd_set_key)
-
-# 1D
-lkp1 = (
-    train_df.groupby(["ICD_Set_Key"])["Yatış Gün Sayısı"]
-        .agg(N="count", Ortalama=lambda x: round_half_up(x.mean()), P50="median", P90=p90)
-        .reset_index()
-)
 lkp1["ICD_Set_Key"] = lkp1["ICD_Set_Key"].apply(clean_icd_set_key)
 
-# 0D
-lkp0 = pd.DataFrame({
-    "N":   [train_df.shape[0]],
-    "Ortalama": [round_half_up(train_df["Yatış Gün Sayısı"].mean())],
-    "P50": [train_df["Yatış Gün Sayısı"].median()],
-    "P90": [train_df["Yatış Gün Sayısı"].quantile(0.9)]
-})
-
 # Tekil ICD P50 (global)
 single = train_df[train_df["ICD_Sayısı"]==1].copy()
-single["ICD_Kod"] = single["ICD_List_Norm"].str[0]
+single["ICD_Kod"] = single["ICD_Set_Key"].astype(str)  # tek elemanlı set: anahtar = kod
 LKP_ICD = (
     single.groupby("ICD_Kod")["Yatış Gün Sayısı"]
           .agg(N="count", P50="median").reset_index()
@@ -293,17 +195,14 @@ LKP_ICD = (
 
 # İkili setlerin P50'si (tam iki ICD'li satırlardan) — γ öğrenimine yardımcı
 pairs = train_df[train_df["ICD_Sayısı"]==2].copy()
-pairs["PairKey"] = pairs["ICD_List_Norm"].apply(lambda lst: "||".join(sorted(lst)))
+pairs["PairKey"] = pairs["ICD_Set_Key"].astype(str)  # iki elemanlı set: anahtar = sıralı çift
 LKP_PAIR = (
-    pairs.groupby(["YaşGrup","Bölüm","PairKey"])["Yatış Gün Sayısı"]
-         .agg(N="count", P50="median").reset_index()
+    pairs.groupby(["YaşGrup","Bölüm","PairKey"], observed=True)["Yatış Gün Sayısı"]
+         .agg(N="count", P50="median").reset_index().pipe(_plain)
 )
 
 # ---- YENİ: Demografi (YG+Bölüm) bazlı P90 cap referansı
-DEMO_P90_MAP = (
-    train_df.groupby(["YaşGrup","Bölüm"])["Yatış Gün Sayısı"]
-            .quantile(0.9).reset_index().rename(columns={"Yatış Gün Sayısı":"P90"})
-)
+DEMO_P90_MAP = group_quantile(train_df, "Yatış Gün Sayısı", ["YaşGrup","Bölüm"], 0.9).rename(columns={"Yatış Gün Sayısı":"P90"})
 demop90_map = {(r["YaşGrup"], r["Bölüm"]): float(r["P90"]) for _, r in DEMO_P90_MAP.iterrows()}
 
 # ================== 4) β (tekil) ve γ (ikili) KATKILARI ÖĞREN ==================
@@ -366,12 +265,10 @@ for pair, samples in pair_to_gamma_samples.items():
 stage("Lookup Excel yazılıyor (cinsiyetsiz)")
 
 # ---- EKLE: Görsellik için ek sayfalar (modelden bağımsız)
-_br_base = df[["ICD_Set_Key","ICD_List_Norm"]].copy()
-BR_ICDSET_MAP = _br_base.explode("ICD_List_Norm").rename(columns={"ICD_List_Norm":"ICD"})
-BR_ICDSET_MAP = BR_ICDSET_MAP.dropna(subset=["ICD"]).drop_duplicates().reset_index(drop=True)
-BR_ICDSET_MAP = BR_ICDSET_MAP.dropna(subset=["ICD"]).reset_index(drop=True)
+_br_keys, _br_icds = icd_sets.pairs(set_ids(df))  # explode + drop_duplicates sırası
+BR_ICDSET_MAP = pd.DataFrame({"ICD_Set_Key": _br_keys, "ICD": _br_icds})
 
-_all_icds = sorted({icd for lst in df["ICD_List_Norm"] for icd in lst})
+_all_icds = icd_sets.present(set_ids(df))
 DIM_ICD = pd.DataFrame({"ICD": _all_icds})
 
 _age_order = ["0-1","2-5","5-10","10-15","15-25","25-35","35-50","50-65","65+"]
@@ -413,243 +310,31 @@ for _, r in LKP_PAIR.iterrows():
 
 single_floor_map = dict(zip(LKP_ICD["ICD_Kod"], LKP_ICD["P50"]))
 
-def find_anchor(yg:str, bolum:str, key:str):
-    """Lookup zinciri: 3D -> 2D -> 1D -> yoksa None (komşuya geçilecek)"""
-    if (yg, bolum, key) in lkp3_map:
-        p50, n = lkp3_map[(yg, bolum, key)]
-        return "3D", float(p50), n, key
-    if (bolum, key) in lkp2_map:
-        p50, n = lkp2_map[(bolum, key)]
-        return "2D", float(p50), n, key
-    if key in lkp1_map:
-        p50, n = lkp1_map[key]
-        return "1D", float(p50), n, key
-    return None, None, 0, None
-
-# ---- DEĞİŞTİ: Tek komşu yerine Top-K ağırlıklı ortalama
-def _topk_weighted_anchor(candidates, target_set:set, K:int=TOPK_NEIGHBORS, rho:float=RHO_J):
-    """
-    candidates: iterable of (key, p50, n)
-    Dönüş: (bestJ, weighted_p50, bestKey)
-    Ağırlık: w = (J**rho) * log(1+N)
-    """
-    scored = []
-    for key, p50, n in candidates:
-        J = jaccard(target_set, as_set(key))
-        if p50 is None:
-            continue
-        scored.append((J, float(p50), int(n if n is not None else 0), key))
-
-    if not scored:
-        return 0.0, None, None
-
-    # En iyi tek komşu (tutarlılık için anchor_key bu)
-    scored.sort(key=lambda x: (x[0], x[2], x[1]), reverse=True)
-    bestJ, bestP50, _bestN, bestKey = scored[0]
-
-    # Sıfır Jaccard durumunda ağırlık toplamı 0 olabilir → tek komşuya düş
-    topk = [r for r in scored if r[0] > 0.0][:K]
-    if not topk:
-        return bestJ, bestP50, bestKey
-
-    weights = []
-    vals = []
-    for J, p50, n, _k in topk:
-        w = (J ** float(rho)) * math.log1p(max(0, n))
-        weights.append(w)
-        vals.append(p50)
-
-    W = sum(weights)
-    if W <= 0:
-        return bestJ, bestP50, bestKey
-
-    weighted_p50 = sum(v*w for v, w in zip(vals, weights)) / W
-    return bestJ, float(weighted_p50), bestKey
-
-def nearest_neighbor_anchor(yg:str, bolum:str, target_key:str):
-    """
-    Jaccard komşu-ankor arama SIRASI:
-      1) 3D aynı demografi (YaşGrup+Bölüm)  -> ANCHOR_SRC='NEIGHBOR_3D_DEMO'
-      2) 2D sadece Bölüm                    -> ANCHOR_SRC='NEIGHBOR_2D'
-      3) 1D global ICD set                  -> ANCHOR_SRC='NEIGHBOR_1D'
-      4) Hiç aday yoksa 0D genel            -> ANCHOR_SRC='NEIGHBOR_0D'
-    Top-K: anchor_p50 = ağırlıklı ortalama; anchor_key = en iyi tek komşu.
-    """
-    target = as_set(target_key)
-
-    # 1) 3D - aynı demografi
-    cand3 = []
-    for key in ctx3_by_demo.get((yg, bolum), []):
-        p50, n = lkp3_map.get((yg, bolum, key), (None, 0))
-        cand3.append((key, p50, n))
-    bestJ, w_p50, bestKey = _topk_weighted_anchor(cand3, target)
-    if bestKey is not None:
-        return bestJ, float(w_p50 if w_p50 is not None else lkp0_p50), bestKey, "3D_DEMO"
-
-    # 2) 2D - aynı bölüm
-    cand2 = []
-    for (b, key), (p50, n) in lkp2_map.items():
-        if b == bolum:
-            cand2.append((key, p50, n))
-    bestJ, w_p50, bestKey = _topk_weighted_anchor(cand2, target)
-    if bestKey is not None:
-        return bestJ, float(w_p50 if w_p50 is not None else lkp0_p50), bestKey, "2D"
-
-    # 3) 1D - global
-    cand1 = []
-    for key, (p50, n) in lkp1_map.items():
-        cand1.append((key, p50, n))
-    bestJ, w_p50, bestKey = _topk_weighted_anchor(cand1, target)
-    if bestKey is not None:
-        return bestJ, float(w_p50 if w_p50 is not None else lkp0_p50), bestKey, "1D"
-
-    # 4) 0D - genel
-    return 0.0, lkp0_p50, None, "0D"
-# ---- /DEĞİŞTİ
-
-def model_contrib(target_key:str, anchor_key:str):
-    """
-    β/γ katkıları (tek taraflı imza):
-      - Eklenen tekiller (T\\A): +β
-      - Çıkan tekiller (A\\T):  –β
-      - Eklenen çiftler:        +γ
-      - Kaybolan çiftler:       –γ
-    Not: β ve γ öğrenimde ≥0; burada yalnızca 'fazlayı geri alma' amaçlı negatif işaret uygulanır.
-    """
-    T = as_set(target_key)
-    A = as_set(anchor_key) if anchor_key else set()
-
-    # ---- YENİ: destek tabanlı büzme yardımcıları
-    def beta_scaled(icd):
-        val = max(0.0, beta_icd.get(icd, 0.0))
-        sup = beta_support.get(icd, 0)
-        scale = 1.0 if sup >= 3 else SHRINK_1SUPPORT_SCALE
-        return val * scale
-
-    def gamma_lookup_scaled(i, j):
-        val = max(0.0, gamma_pairs.get((i, j), gamma_pairs.get((j, i), 0.0)))
-        sup = max(gamma_support.get((i, j), 0), gamma_support.get((j, i), 0))
-        scale = 1.0 if sup >= 3 else SHRINK_1SUPPORT_SCALE
-        return val * scale
-
-    # Tekiller
-    add_single = sorted(list(T - A))
-    rem_single = sorted(list(A - T))
-    beta_plus  = sum(beta_scaled(i) for i in add_single)
-    beta_minus = sum(beta_scaled(i) for i in rem_single)
-    beta_sum   = beta_plus - REMOVAL_PENALTY * beta_minus  # ---- DEĞİŞTİ
-
-    # Çiftler
-    pairs_T = set()
-    for i, j in itertools.combinations(sorted(T), 2):
-        pairs_T.add((i, j))
-
-    pairs_A = set()
-    for i, j in itertools.combinations(sorted(A), 2):
-        pairs_A.add((i, j))
-
-    add_pairs = pairs_T - pairs_A
-    rem_pairs = pairs_A - pairs_T
-
-    gamma_plus  = sum(gamma_lookup_scaled(i, j) for (i, j) in add_pairs)
-    gamma_minus = sum(gamma_lookup_scaled(i, j) for (i, j) in rem_pairs)
-    gamma_sum   = gamma_plus - REMOVAL_PENALTY * gamma_minus  # ---- DEĞİŞTİ
-
-    return beta_sum, gamma_sum, add_single
-
-def saturation(total_add:float, k:float=SATURATION_K):
-    if not SATURATION_ON:
-        return total_add
-    return float(k * (1.0 - math.exp(-float(total_add)/float(k))))
-
-def guardrails(yg:str, bolum:str, target_key:str, pred:float):
-    """
-    Tekil floor KALDIRILDI.
-    Pair floor ve alt-küme (subset) floor'lar devam ediyor.
-    """
-    T = as_set(target_key)
-    floor1 = pred  # tekil floor kaldırıldı, doğrudan pred
-
-    # Pair floor
-    floor2 = floor1
-    for i, j in itertools.combinations(sorted(T), 2):
-        pf = pair_floor_map.get(f"{i}||{j}", 0.0)
-        pf = max(pf, pair_floor_map.get(f"{j}||{i}", 0.0))
-        floor2 = max(floor2, pf)
-
-    # Alt-küme floor (3D→2D→1D)
-    floor3 = floor2
-    for r in lkp3[(lkp3["YaşGrup"]==yg) & (lkp3["Bölüm"]==bolum)].itertuples():
-        S = as_set(r.ICD_Set_Key)
-        if S.issubset(T):
-            floor3 = max(floor3, float(r.P50))
-    for r in lkp2[lkp2["Bölüm"]==bolum].itertuples():
-        S = as_set(r.ICD_Set_Key)
-        if S.issubset(T):
-            floor3 = max(floor3, float(r.P50))
-    for r in lkp1.itertuples():
-        S = as_set(r.ICD_Set_Key)
-        if S.issubset(T):
-            floor3 = max(floor3, float(r.P50))
-    return floor3
-
-def predict_one(yg:str, bolum:str, target_key:str):
-    src, anchor_p50, n, anchor_key = find_anchor(yg, bolum, target_key)
-
-    # === KISA DEVRE: 3D/2D/1D tam eşleşmede HİÇBİR ŞEY ekleme, GUARDRAILS DA YOK ===
-    if anchor_p50 is not None and anchor_key == target_key and src in ("3D", "2D", "1D"):
-        meta = {
-            "ANCHOR_SRC": src,
-            "ANCHOR_KEY": anchor_key if anchor_key else "",
-            "ANCHOR_P50": float(anchor_p50),
-            "ALPHA_JACCARD": 0.0,
-            "ADDED_ICDS": "",
-            "BETA_SUM": 0.0,
-            "GAMMA_SUM": 0.0,
-            "MODEL_PRED": float(anchor_p50),
-            "PRED_BLEND": float(anchor_p50),
-        }
-        return float(anchor_p50), meta
-    # === /KISA DEVRE ===
-
-    if anchor_p50 is None:
-        J, neigh_p50, neigh_key, neigh_src = nearest_neighbor_anchor(yg, bolum, target_key)
-        anchor_p50, anchor_key = float(neigh_p50), neigh_key
-        src = f"NEIGHBOR_{neigh_src}"
-        alpha = float(J)  # ALPHA = en iyi tek komşu J (değişmedi)
-    else:
-        alpha = 0.0
-
-    beta_sum, gamma_sum, added_icds = model_contrib(target_key, anchor_key)
-    add_total = saturation(beta_sum + gamma_sum)
-    model_pred = float(anchor_p50) + add_total
-    pred_blend = (1.0 - alpha) * model_pred + alpha * float(anchor_p50)
-
-    # ---- YENİ: Erken guardrail (pred_blend < 1 ise anchor P50'ye kısa devre)
-    if pred_blend < 1.0:
-        pred_final = float(anchor_p50)
-    else:
-        pred_final = pred_blend
-
-    # ---- YENİ: P90 CAP (demografi+bölüm)
-    cap_ref = demop90_map.get((yg, bolum), lkp0_p90)
-    cap_val = float(cap_ref) * float(CAP_MARJ) if cap_ref is not None else float("inf")
-    if cap_val is not None:
-        pred_final = min(float(pred_final), float(cap_val))
-    # ---- /P90 CAP
-
-    meta = {
-        "ANCHOR_SRC": src,
-        "ANCHOR_KEY": anchor_key if anchor_key else "",
-        "ANCHOR_P50": float(anchor_p50),
-        "ALPHA_JACCARD": float(alpha),
-        "ADDED_ICDS": ",".join(added_icds),
-        "BETA_SUM": float(beta_sum),
-        "GAMMA_SUM": float(gamma_sum),
-        "MODEL_PRED": float(model_pred),
-        "PRED_BLEND": float(pred_blend),
-    }
-    return float(pred_final), meta
+# Kural motoru (motor.LosModel) — servis aynı nesneyi model_out/ artefaktlarından kurar
+model = LosModel(
+    state={
+        "lkp3_map": lkp3_map, "lkp2_map": lkp2_map, "lkp1_map": lkp1_map,
+        "lkp0_p50": lkp0_p50, "lkp0_p90": lkp0_p90,
+        "ctx3_by_demo": dict(ctx3_by_demo), "pair_floor_map": pair_floor_map, "demop90_map": demop90_map,
+        "beta_icd": beta_icd, "beta_support": beta_support,
+        "gamma_pairs": gamma_pairs, "gamma_support": gamma_support,
+        "icd_aliases": ICD_ALIASES,
+    },
+    params={
+        "TOPK_NEIGHBORS": TOPK_NEIGHBORS, "RHO_J": RHO_J,
+        "SHRINK_1SUPPORT_SCALE": SHRINK_1SUPPORT_SCALE, "REMOVAL_PENALTY": REMOVAL_PENALTY, "CAP_MARJ": CAP_MARJ,
+        "SATURATION_ON": SATURATION_ON, "SATURATION_K": SATURATION_K,
+        "XGB_ENS_ON": XGB_ENS_ON, "XGB_ALPHA_LOG": XGB_ALPHA_LOG, "XGB_RULE_BLEND": XGB_RULE_BLEND,
+        "GUARDRAILS_ON": GUARDRAILS_ON,
+        "NEIGHBOR_MODE": NEIGHBOR_MODE, "LSH_RECALL": LSH_RECALL, "LSH_MIN_J": LSH_MIN_J,
+    },
+)
+find_anchor = model.find_anchor
+nearest_neighbor_anchor = model.nearest_neighbor_anchor
+model_contrib = model.model_contrib
+saturation = model.saturation
+guardrails = model.guardrails
+predict_one = model.predict_one
 
 # ================== 7) MODEL DOSYALARINI OLUŞTUR ==================
 stage("Model dosyaları yazılıyor")
@@ -659,22 +344,13 @@ with open(os.path.join(MODEL_DIR, "beta_icd.json"), "w", encoding="utf-8") as f:
 with open(os.path.join(MODEL_DIR, "gamma_pairs.json"), "w", encoding="utf-8") as f:
     gamma_serial = {f"{i}||{j}":v for (i,j), v in gamma_pairs.items()}
     json.dump(gamma_serial, f, ensure_ascii=False, indent=2)
-with open(os.path.join(MODEL_DIR, "config.json"), "w", encoding="utf-8") as f:
-    json.dump({
-        "created_at": datetime.datetime.now().isoformat(),
-        "min_support": MIN_SUPPORT,
-        "saturation_on": SATURATION_ON,
-        "saturation_k": SATURATION_K,
-        "notes": "Cinsiyetsiz β/γ; α=Jaccard; guardrails aktif"
-    }, f, ensure_ascii=False, indent=2)
 
 # ================== 7.5) XGB ENSEMBLE EĞİTİM (YENİ) ==================
 if XGB_ENS_ON:
     stage("XGB (plain + log-target) özellikleri hazırlanıyor ve eğitiliyor")
 
     # ---- ICD top-K sınıfları (train'den)
-    icd_counts = Counter([icd for lst in train_df["ICD_List_Norm"] for icd in lst])
-    XGB_TOP_ICDS = [icd for icd, _ in icd_counts.most_common(TOPK_ICD)]
+    XGB_TOP_ICDS = [icd for icd, _ in icd_sets.most_common(set_ids(train_df), TOPK_ICD)]
 
     # Dönüştürücüler
     ohe = OneHotEncoder(handle_unknown="ignore", sparse_output=True)
@@ -685,15 +361,7 @@ if XGB_ENS_ON:
     mlb.fit([XGB_TOP_ICDS])  # sınıfları sabitle
 
     def _pack_features(df_part: pd.DataFrame):
-        # Kategorikler
-        X_cat = ohe.transform(df_part[["Bölüm", "YaşGrup"]])
-        # ICD multi-hot (sadece TOPK)
-        icd_lists = df_part["ICD_List_Norm"].apply(lambda lst: [c for c in lst if c in XGB_TOP_ICDS])
-        X_icd = mlb.transform(icd_lists)
-        # Sayısal küçük özellikler (ICD sayısı)
-        x_icd_count = np.asarray(df_part["ICD_Sayısı"]).reshape(-1, 1)
-        X = hstack([X_cat, X_icd, x_icd_count], format="csr")
-        return X
+        return pack_features(df_part, ohe, mlb, XGB_TOP_ICDS, icd_sets.lists(set_ids(df_part)))
 
     X_train = _pack_features(train_df)
     y_train = train_df["Yatış Gün Sayısı"].astype(float).values
@@ -705,106 +373,91 @@ if XGB_ENS_ON:
     xgb_plain.fit(X_train, y_train)
     xgb_log.fit(X_train, y_log)
 
-    # Artefaktları kaydet
-    joblib.dump(xgb_plain, os.path.join(MODEL_DIR, "xgb_plain.joblib"))
-    joblib.dump(xgb_log, os.path.join(MODEL_DIR, "xgb_log.joblib"))
-    joblib.dump(ohe, os.path.join(MODEL_DIR, "xgb_ohe.joblib"))
-    joblib.dump(mlb, os.path.join(MODEL_DIR, "xgb_mlb.joblib"))
-    joblib.dump(XGB_TOP_ICDS, os.path.join(MODEL_DIR, "xgb_top_icds.joblib"))
-
-    def xgb_predict_ens(yg: str, bolum: str, key: str, icd_list_norm=None):
-        # tek satır özellik kur
-        if icd_list_norm is None:
-            icd_list_norm = key.split("||") if key else []
-        df_one = pd.DataFrame({
-            "Bölüm": [bolum],
-            "YaşGrup": [yg],
-            "ICD_List_Norm": [icd_list_norm],
-            "ICD_Sayısı": [len(icd_list_norm)]
-        })
-        X_one = _pack_features(df_one)
-        p_plain = float(xgb_plain.predict(X_one)[0])
-        p_log = float(np.expm1(xgb_log.predict(X_one)[0]))
-        p_ens = (1.0 - float(XGB_ALPHA_LOG)) * p_plain + float(XGB_ALPHA_LOG) * p_log
-        return p_plain, p_log, p_ens
-else:
-    def xgb_predict_ens(yg, bolum, key, icd_list_norm=None):
-        return np.nan, np.nan, np.nan
+    model.set_xgb({
+        "xgb_plain": xgb_plain, "xgb_log": xgb_log,
+        "ohe_categories": ohe.categories_, "top_icds": XGB_TOP_ICDS,
+    })
+
+xgb_predict_ens = model.xgb_predict_ens
+
+# Artefaktları kaydet (kural durumu + XGB + config) — server.py bunları motor.load_model ile okur
+save_model(model, MODEL_DIR, config={
+    "created_at": datetime.datetime.now().isoformat(),
+    "min_support": MIN_SUPPORT,
+    "saturation_on": SATURATION_ON,
+    "saturation_k": SATURATION_K,
+    "notes": "Cinsiyetsiz β/γ; α=Jaccard; guardrails aktif"
+})
 
 # ================== 8) PRED_LOS (tüm benzersiz kombinasyonlar) ==================
 stage("PRED_LOS.xlsx üretiliyor")
 uniq_combos_df = df[["YaşGrup","Bölüm","ICD_Set_Key"]].drop_duplicates().reset_index(drop=True)
-pred_rows = []
-for r in tqdm(uniq_combos_df.itertuples(), total=len(uniq_combos_df), desc="PRED_LOS"):
-    pred_rule, meta = predict_one(r.YaşGrup, r.Bölüm, r.ICD_Set_Key)
 
-    # XGB tahminleri (YENİ)
-    icd_list_norm = r.ICD_Set_Key.split("||") if isinstance(r.ICD_Set_Key, str) and r.ICD_Set_Key else []
-    p_plain, p_log, p_ens = xgb_predict_ens(r.YaşGrup, r.Bölüm, r.ICD_Set_Key, icd_list_norm)
-
-    # Opsiyonel kural+XGB blend
-    if XGB_RULE_BLEND is None or (not np.isfinite(p_ens)):
-        pred_final_out = pred_rule
-    else:
-        w = float(XGB_RULE_BLEND)
-        pred_final_out = (1.0 - w) * float(pred_rule) + w * float(p_ens)
-
-    pred_rows.append({
-        "YaşGrup": r.YaşGrup,
-        "Bölüm": r.Bölüm,
-        "ICD_Set_Key": r.ICD_Set_Key,
-        "Pred_Final": round_half_up(pred_final_out),
-        "PRED_RULE": float(pred_rule),
-        "PRED_XGB_PLAIN": float(p_plain) if pd.notna(p_plain) else np.nan,
-        "PRED_XGB_LOG": float(p_log) if pd.notna(p_log) else np.nan,
-        "PRED_XGB_ENS": float(p_ens) if pd.notna(p_ens) else np.nan,
-        **meta
-    })
-pred_df = pd.DataFrame(pred_rows)
+def predict_frame(cases):
+    """
+    cases[YaşGrup, Bölüm, ICD_Set_Key] → (kural [PRED_RULE + meta], p_plain, p_log, p_ens) — toplu motor yolu:
+    model.predict_many (satır satır predict_one ile aynı) + tek CSR'de XGB (xgb_predict_ens_many).
+    """
+    rule = model.predict_many(cases)
+    p_plain, p_log, p_ens = model.xgb_predict_ens_many([
+        (yg, bol, key, key.split("||") if isinstance(key, str) and key else [])
+        for yg, bol, key in zip(cases["YaşGrup"], cases["Bölüm"], cases["ICD_Set_Key"])
+    ])
+    return rule, p_plain, p_log, p_ens
+
+def blend_rule_xgb(pred_rule, p_ens, w):
+    """Kural+XGB harmanı; w None ya da XGB NaN ise saf kural."""
+    pred_rule = np.asarray(pred_rule, dtype=float)
+    if w is None:
+        return pred_rule
+    w = float(w)
+    return np.where(np.isfinite(p_ens), (1.0 - w) * pred_rule + w * p_ens, pred_rule)
+
+rule, p_plain, p_log, p_ens = predict_frame(uniq_combos_df)
+pred_final_out = blend_rule_xgb(rule["PRED_RULE"], p_ens, XGB_RULE_BLEND)
+pred_df = pd.concat([
+    uniq_combos_df,
+    pd.DataFrame({
+        "Pred_Final": [round_half_up(v) for v in pred_final_out],
+        "PRED_RULE": rule["PRED_RULE"].to_numpy(),
+        "PRED_XGB_PLAIN": p_plain,
+        "PRED_XGB_LOG": p_log,
+        "PRED_XGB_ENS": p_ens,
+    }),
+    rule[META_COLUMNS].reset_index(drop=True),
+], axis=1)
 pred_df.to_excel(PRED_LOS_XLSX, index=False)
 print(f"OK -> {PRED_LOS_XLSX}")
+# Servisin ilk katmanı: aynı tablo ikili (model paketine sha ile bağlı) — bilinen kombinasyonlar O(1)
+_pt = pred_df[pred_df[["YaşGrup","Bölüm","ICD_Set_Key"]].map(lambda v: isinstance(v, str)).all(axis=1)]
+save_pred_table(model, _pt["YaşGrup"], _pt["Bölüm"], _pt["ICD_Set_Key"], _pt["PRED_RULE"], _pt["PRED_XGB_ENS"], MODEL_DIR)
+print(f"OK -> {os.path.join(MODEL_DIR, PRED_TABLE_FILE)}")
 
 # ================== 9) YeniVakalar (sentetik) ==================
 if MAKE_YENI_VAKALAR:
     stage("YeniVakalar.xlsx üretiliyor (sentetik örnekler)")
     yg_vals = df["YaşGrup"].dropna().unique().tolist()
     bolum_vals = df["Bölüm"].dropna().unique().tolist()
-    icd_counts = Counter([icd for lst in df["ICD_List_Norm"] for icd in lst])
-    top_icds = [icd for icd, _ in icd_counts.most_common(100)]
+    top_icds = [icd for icd, _ in icd_sets.most_common(set_ids(df), 100)]
     def sample_icd_set():
         k = np.random.randint(1, min(5, max(2, len(top_icds))))
         return as_key(set(np.random.choice(top_icds, size=k, replace=False)))
 
+    # Örnekleme sırası (yg, bölüm, set) korunur → aynı tohumla aynı vakalar; tahmin toplu
     rows = []
-    for _ in tqdm(range(N_SAMPLES_YENI), desc="YeniVakalar"):
+    for _ in range(N_SAMPLES_YENI):
         yg = np.random.choice(yg_vals) if yg_vals else "35-50"
         bol = np.random.choice(bolum_vals) if bolum_vals else "Dahiliye"
-        key = sample_icd_set()
-        pred_rule, meta = predict_one(yg, bol, key)
-        icd_list_norm = key.split("||") if key else []
-        _, _, p_ens = xgb_predict_ens(yg, bol, key, icd_list_norm)
-
-        if XGB_RULE_BLEND is None or (not np.isfinite(p_ens)):
-            pred_out = pred_rule
-        else:
-            w = float(XGB_RULE_BLEND)
-            pred_out = (1.0 - w) * float(pred_rule) + w * float(p_ens)
-
-        rows.append({
-            "YaşGrup": yg,
-            "Bölüm": bol,
-            "ICD_Set_Key": key,
-            "Pred_Final": round_half_up(pred_out),
-            **meta
-        })
-    yeni_df = pd.DataFrame(rows)
+        rows.append((yg, bol, sample_icd_set()))
+    yeni_df = pd.DataFrame(rows, columns=["YaşGrup", "Bölüm", "ICD_Set_Key"])
+    rule, _, _, p_ens = predict_frame(yeni_df)
+    yeni_df["Pred_Final"] = [round_half_up(v) for v in blend_rule_xgb(rule["PRED_RULE"], p_ens, XGB_RULE_BLEND)]
+    yeni_df = pd.concat([yeni_df, rule[META_COLUMNS]], axis=1)
     yeni_df.to_excel(YENI_VAKALAR_XLSX, index=False)
     print(f"OK -> {YENI_VAKALAR_XLSX}")
 
-# ================== 10) VALID_PREDICTIONS (valid split üzerinde) ==================
 # ================== 10) VALID_PREDICTIONS (valid split üzerinde) ==================
 stage("VALID_PREDICTIONS.xlsx üretiliyor (valid set)")
-valid_rows = []
 
 # --- DÜZELTİLEN KISIM: True_LOS sütununu sağlam biçimde tespit et ---
 import unicodedata
@@ -830,54 +483,34 @@ if TRUE_LOS_COL is None:
         TRUE_LOS_COL = "Yatış_Gün_Sayısı"
 # --- /DÜZELTİLEN KISIM ---
 
-for r in tqdm(valid_df.itertuples(), total=len(valid_df), desc="VALID_PREDICTIONS"):
-    yg = r.YaşGrup
-    bol = r.Bölüm
-    key = r.ICD_Set_Key
-
-    # True_LOS güvenli okuma
-    if TRUE_LOS_COL is not None:
-        _val = valid_df.loc[r.Index, TRUE_LOS_COL]
-        try:
-            true_los = float(_val) if pd.notna(_val) else np.nan
-        except Exception:
-            true_los = np.nan
-    else:
-        true_los = np.nan
-
-    # Kural tabanlı tahmin
-    pred_rule, meta = predict_one(yg, bol, key)
-
-    # XGB ensemble (plain + log-target → ens)
-    icd_list_norm = key.split("||") if isinstance(key, str) and key else []
-    p_plain, p_log, p_ens = xgb_predict_ens(yg, bol, key, icd_list_norm)
+# True_LOS güvenli okuma
+def _safe_float(v):
+    try:
+        return float(v) if pd.notna(v) else np.nan
+    except Exception:
+        return np.nan
 
-    # Blend oranı (tanımlı değilse 0.5 al)
-    _v = globals().get("XGB_RULE_BLEND")
-    w = 0.5 if _v is None else float(_v)
+true_los = (valid_df[TRUE_LOS_COL].map(_safe_float).to_numpy(dtype=float) if TRUE_LOS_COL is not None
+            else np.full(len(valid_df), np.nan))
 
-    # Eğer XGB yoksa ya da NaN ise sadece kuralı kullan
-    if (p_ens is None) or (not np.isfinite(p_ens)):
-        pred_out = float(pred_rule)
-    else:
-        pred_out = (1.0 - w) * float(pred_rule) + w * float(p_ens)
+# Kural tabanlı tahmin + XGB ensemble (plain + log-target → ens); blend oranı tanımlı değilse 0.5
+rule, p_plain, p_log, p_ens = predict_frame(valid_df)
+_v = globals().get("XGB_RULE_BLEND")
+pred_out = blend_rule_xgb(rule["PRED_RULE"], p_ens, 0.5 if _v is None else float(_v))
 
-    valid_rows.append({
-        "YaşGrup": yg,
-        "Bölüm": bol,
-        "ICD_Set_Key": key,
+valid_pred_df = pd.concat([
+    valid_df[["YaşGrup", "Bölüm", "ICD_Set_Key"]].reset_index(drop=True),
+    pd.DataFrame({
         "True_LOS": true_los,
-        "Pred_Final": float(pred_out),                     # harmanlı çıktı
-        "Pred_Final_Rounded": round_half_up(pred_out),
-        "PRED_RULE": float(pred_rule),                     # saf kural
-        "PRED_XGB_PLAIN": float(p_plain) if pd.notna(p_plain) else np.nan,
-        "PRED_XGB_LOG": float(p_log) if pd.notna(p_log) else np.nan,
-        "PRED_XGB_ENS": float(p_ens) if pd.notna(p_ens) else np.nan,  # saf XGB ens
-        **meta
-    })
-
-# DF'yi OLUŞTUR ve yaz
-valid_pred_df = pd.DataFrame(valid_rows)
+        "Pred_Final": pred_out,                                       # harmanlı çıktı
+        "Pred_Final_Rounded": [round_half_up(v) for v in pred_out],
+        "PRED_RULE": rule["PRED_RULE"].to_numpy(),                    # saf kural
+        "PRED_XGB_PLAIN": p_plain,
+        "PRED_XGB_LOG": p_log,
+        "PRED_XGB_ENS": p_ens,                                        # saf XGB ens
+    }),
+    rule[META_COLUMNS].reset_index(drop=True),
+], axis=1)
 valid_pred_df.to_excel(VALID_PRED_XLSX, index=False)
 print(f"OK -> {VALID_PRED_XLSX}")
 
@@ -1,46 +1,162 @@
 # server.py
 # Yerel:  python -m uvicorn server:app --host 0.0.0.0 --port 8500 --reload
-# Render: gunicorn -w 1 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:$PORT server:app
+# Render: gunicorn -c gunicorn.conf.py server:app  (model master'da bir kez yüklenir, worker'lar fork ile paylaşır)
+# Model: önce `python proje.py` ile eğitin (model_out/ üretir); servis yalnızca artefaktları yükler.
 
 from __future__ import annotations
 
-from fastapi import FastAPI, Form
+from fastapi import FastAPI, Form, Request
 from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
-import os, math
+import os, gc, math, time, random, asyncio, itertools, threading
+from contextlib import asynccontextmanager
+from collections import Counter
 from typing import List, Optional
-from importlib import import_module
 from string import Template
 
+import motor
+import onbellek
+import paket
+import yurutucu
+from veri import read_veri
+
 # -------- Dosya yolları --------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 EXCEL_PATH = os.path.join(BASE_DIR, "Veri2024.xlsx")
 PRED_LOS_XLSX = os.path.join(BASE_DIR, "PRED_LOS.xlsx")
+BATCH_MAX = int(os.environ.get("BATCH_MAX", "5000"))  # /api/predict/batch tek istekte en çok vaka
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(BASE_DIR, motor.MODEL_DIR))
+MODEL_RETRY_S = float(os.environ.get("MODEL_RETRY_S", "30"))  # yükleme hatası bu kadar süre önbellekte kalır, sonra yeniden denenir
 
-# -------- Lazy model import --------
+# -------- Lazy model yükleme (eğitim YOK; model_out/ artefaktları) --------
+# İstekler modeli başta bir kez alır (m = _get_model()) ve sonuna kadar onu kullanır: yeniden yükleme
+# yalnızca _model referansını değiştirir, süren istekler eski nesneyle biter.
 _model = None
 _model_err: Optional[str] = None
+_model_err_at = 0.0
+
+_model_lock = threading.Lock()
 
 def _get_model():
-    global _model, _model_err
+    global _model, _model_err, _model_err_at
     if _model is not None:
         return _model
-    if _model_err is not None:
-        raise RuntimeError(_model_err)
-    try:
-        _model = import_module("proje")
+    with _model_lock:  # havuzdaki iş parçacıkları aynı anda yüklemesin
+        if _model is not None:
+            return _model
+        if _model_err is not None and time.monotonic() - _model_err_at < MODEL_RETRY_S:
+            raise RuntimeError(_model_err)
+        try:
+            t0 = time.perf_counter()
+            _model = motor.load_model(MODEL_DIR)
+            _pred_cache.set_model(_model.bundle_sha256)
+            if _model_err is not None:  # önceki deneme başarısızdı → /ready toparlansın
+                _mark_ready(_model, time.perf_counter() - t0)
+            _model_err = None
+            return _model
+        except Exception as e:
+            _model_err = f"Model yüklenemedi: {e}"
+            _model_err_at = time.monotonic()
+            raise RuntimeError(_model_err)
+
+def preload() -> float:
+    """
+    gunicorn master'ında (preload_app) fork'tan önce: modeli + form seçeneklerini yükler, gc.freeze() ile
+    bu nesneleri GC taramasından çıkarır — worker'lar sayfaları copy-on-write paylaşır, her biri yeniden yüklemez.
+    Tahmin çalıştırmaz (fork öncesi XGBoost/OpenMP iş parçacığı açılmasın). Süreyi (s) döner.
+    """
+    t0 = time.perf_counter()
+    _get_model()
+    _load_options_once()
+    gc.collect()
+    gc.freeze()
+    return time.perf_counter() - t0
+
+def _blend_final(m, pred_rule, p_ens) -> float:
+    """Harman (Rule ∘ XGB_ENS) — ağırlık tahmini üreten modelden (m.XGB_RULE_BLEND); XGB yoksa/NaN ise saf kural."""
+    if p_ens is not None and not (isinstance(p_ens, float) and (math.isnan(p_ens) or math.isinf(p_ens))):
+        w = float(m.XGB_RULE_BLEND)
+        return (1.0 - w) * float(pred_rule) + w * float(p_ens)
+    return float(pred_rule)
+
+# -------- Tahmin katmanları: 1) PRED_LOS tablosu (O(1), model.pred_table) → 2) LRU/TTL önbellek → 3) canlı --------
+# 1-2 olay döngüsünde (mikro saniyeler); 3 ve ilk model yüklemesi sınırlı havuzda (yurutucu) → döngü bloklanmaz.
+_pred_cache = onbellek.from_env()
+_executor = yurutucu.from_env()
+_serve_counts = Counter()  # kaynak ("table" | "cache" | "live") → istek sayısı
+
+def _lookup(m, ck):
+    """(pred_rule, p_ens, kaynak) ya da None — tablo, sonra önbellek."""
+    hit = m.pred_table.get(ck)
+    if hit is not None:
+        return hit + ("table",)
+    hit = _pred_cache.get(m.bundle_sha256, ck)
+    if hit is not None:
+        return hit + ("cache",)
+    return None
+
+def _predict_live(m, yasgrup: str, bolum: str, icd_key: str, icds, ck) -> tuple:
+    pred_rule, _meta = m.predict_one(yasgrup, bolum, icd_key)
+    _, _, p_ens = m.xgb_predict_ens(yasgrup, bolum, icd_key, icds)
+    value = (float(pred_rule), p_ens)
+    _pred_cache.put(m.bundle_sha256, ck, value)
+    return value + ("live",)
+
+def _predict_live_many(m, todo: dict) -> dict:
+    """todo: cache_key → (yg, bolum, key, icds); toplu kural + tek CSR XGB."""
+    rows = list(todo.values())
+    rules = m.predict_one_many([r[:3] for r in rows])
+    _, _, p_ens = m.xgb_predict_ens_many(rows)
+    out = {}
+    for ck, (pred_rule, _meta), pe in zip(todo, rules, p_ens.tolist()):
+        _pred_cache.put(m.bundle_sha256, ck, (float(pred_rule), pe))
+        out[ck] = (float(pred_rule), pe, "live")
+    return out
+
+def _predict_live_batch(items) -> list:
+    """Mikro-toplama işi: items [(m, cache_key, (yg, bolum, key, icds))] → aynı sırada (pred_rule, p_ens, "live")."""
+    groups = {}  # model → {cache_key: satır}; toplamada yeniden yükleme öncesi/sonrası istekler karışabilir
+    for m, ck, row in items:
+        groups.setdefault(id(m), (m, {}))[1][ck] = row
+    out = {mid: _predict_live_many(m, todo) for mid, (m, todo) in groups.items()}
+    return [out[id(m)][ck] for m, ck, _row in items]
+
+# Eşzamanlı canlı istekler MICROBATCH_WINDOW_MS içinde (ya da MICROBATCH_MAX birikince) tek işte hesaplanır; MAX=1 → kapalı
+_batcher = yurutucu.MicroBatcher(
+    _executor, _predict_live_batch,
+    window_ms=float(os.environ.get("MICROBATCH_WINDOW_MS", "2")),
+    max_batch=int(os.environ.get("MICROBATCH_MAX", "64")),
+)
+
+# Aynı anda gelen özdeş canlı istekler (ör. pano yenilemesi) tek hesabı paylaşır
+_single_flight = yurutucu.SingleFlight()
+
+async def _compute_live(m, yasgrup: str, bolum: str, icd_key: str, icds, ck) -> tuple:
+    if _batcher.max_batch > 1:
+        return await _batcher.submit((m, ck, (yasgrup, bolum, icd_key, icds)))
+    return await _executor.run(_predict_live, m, yasgrup, bolum, icd_key, icds, ck)
+
+async def _predict(m, yasgrup: str, bolum: str, icd_key: str, icds) -> tuple:
+    """(pred_rule, p_ens, kaynak); canlı hesap havuzda (tek uçuş + mikro-toplama). Kapasite doluysa yurutucu.Overloaded."""
+    ck = m.cache_key(yasgrup, bolum, icd_key, icds)
+    value = _lookup(m, ck)
+    if value is None:
+        value = await _single_flight.do((id(m), ck), lambda: _compute_live(m, yasgrup, bolum, icd_key, icds, ck))
+    _serve_counts[value[2]] += 1
+    return value
+
+async def _get_model_async():
+    if _model is not None:
         return _model
-    except Exception as e:
-        _model_err = f"Model yüklenemedi: {e}"
-        raise RuntimeError(_model_err)
+    return await _executor.run(_get_model)
 
-def _get_blend_w(default: float = 0.50) -> float:
-    try:
-        m = _get_model()
-        return float(getattr(m, "XGB_RULE_BLEND", default))
-    except Exception:
-        return default
+async def _load_options_async() -> None:
+    if not _OPTIONS_READY:
+        await _executor.run(_load_options_once)
+
+def _overloaded_json(e) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
 
 # -------- Form seçenekleri (tek sefer) --------
 YASGRUP_LIST: List[str] = []
@@ -67,24 +183,9 @@ def _derive_yasgrup_if_needed(df: pd.DataFrame) -> pd.DataFrame:
         df["YaşGrup"] = None
         return df
 
-    def _yas_to_group(y):
-        try:
-            y = float(y)
-        except Exception:
-            return None
-        if y < 0: return None
-        if y <= 1:  return "0-1"
-        if y <= 5:  return "2-5"
-        if y <= 10: return "5-10"
-        if y <= 15: return "10-15"
-        if y <= 25: return "15-25"
-        if y <= 35: return "25-35"
-        if y <= 50: return "35-50"
-        if y <= 65: return "50-65"
-        return "65+"
-
+    # Eğitimle aynı ayrıştırma ve kenarlar (motor.YAS_EDGES): "3 yıl 2 ay" gibi metinler de gruplanır
     df = df.copy()
-    df["YaşGrup"] = df["Yaş"].apply(_yas_to_group)
+    df["YaşGrup"] = motor.yas_to_group_many(motor.yas_to_years_many(df["Yaş"]))
     return df
 
 def _load_options_once() -> None:
@@ -93,7 +194,7 @@ def _load_options_once() -> None:
         return
     try:
         if os.path.exists(EXCEL_PATH):
-            df = pd.read_excel(EXCEL_PATH)
+            df = read_veri(EXCEL_PATH, columns=["ICD Kodu", "Yaş", "YaşGrup", "Bölüm"])
             df = _derive_yasgrup_if_needed(df)
 
             if "ICD Kodu" in df.columns:
@@ -110,7 +211,7 @@ def _load_options_once() -> None:
             BOLUM_LIST   = _safe_unique(df.get("Bölüm",   pd.Series([], dtype=object)))
 
         elif os.path.exists(PRED_LOS_XLSX):
-            df = pd.read_excel(PRED_LOS_XLSX)
+            df = read_veri(PRED_LOS_XLSX, columns=["YaşGrup", "Bölüm", "ICD_Set_Key"])
             YASGRUP_LIST = _safe_unique(df.get("YaşGrup", pd.Series([], dtype=object)))
             BOLUM_LIST   = _safe_unique(df.get("Bölüm",   pd.Series([], dtype=object)))
             icd = set()
@@ -224,8 +325,196 @@ def _icd_key_from_inputs(icd_multi, icd_free_text: Optional[str]):
     key = "||".join(icds)
     return key, icds
 
+# -------- Başlangıç: arka planda yükleme + ısınma (/ready bunu raporlar; /health yalnızca canlılık) --------
+WARMUP_ON = os.environ.get("WARMUP", "1") != "0"
+_READY = {"state": "starting", "load_s": None, "warmup_s": None, "model_version": None, "error": None,
+          "warmup_error": None}
+
+def _mark_ready(m, load_s: float) -> None:
+    """Model devrede (gecikmeli yükleme ya da yeniden yükleme başarılı): /ready hazır, hata temizlenir."""
+    _READY.update(state="ready", load_s=round(load_s, 3), model_version=m.bundle_sha256, error=None)
+
+def _warmup_cases(m, n_demo: int = 8) -> list:
+    """Temsilî girdiler: 3D tam eşleşme, görülmemiş set (komşu + guardrail yolu), bilinmeyen YaşGrup (2D/1D geri düşüş)."""
+    cases = []
+    for (yg, b), keys in itertools.islice(m.ctx3_by_demo.items(), n_demo):
+        cases.append((yg, b, keys[0]))
+        cases.append((yg, b, motor.as_key(motor.as_set(keys[0]) | motor.as_set(keys[-1]))))
+        cases.append(("", b, keys[0]))
+    return cases
+
+def _warmup(m) -> None:
+    cases = _warmup_cases(m)
+    for yg, b, key in cases:
+        m.predict_one(yg, b, key)
+        m.xgb_predict_ens(yg, b, key)
+    m.predict_one_many(cases)
+    m.xgb_predict_ens_many([(yg, b, key, None) for yg, b, key in cases])
+
+async def _startup() -> None:
+    """
+    Modeli yükler (hata → MODEL_RETRY_S aralıkla yeniden dener; bu sürede /ready "loading" + son hata),
+    sonra seçenekleri yükler ve ısıtır (hata → warmup_error; model hizmet verebildiği için yine hazır).
+    /ready modelin gerçek durumunu izler.
+    """
+    _READY["state"] = "loading"
+    while True:
+        t0 = time.perf_counter()
+        try:
+            m = await _executor.run(_get_model)
+            break
+        except Exception as e:
+            _READY["error"] = str(e)
+            await asyncio.sleep(max(MODEL_RETRY_S, 1.0))
+    already = _READY["state"] == "ready"  # bekleme sırasında gecikmeli yükleme/yeniden yükleme devreye aldıysa
+    _READY["load_s"] = round(time.perf_counter() - t0, 3)
+    _READY["model_version"] = m.bundle_sha256
+    _READY["error"] = None
+    try:
+        await _executor.run(_load_options_once)
+        if WARMUP_ON:
+            if not already:
+                _READY["state"] = "warming"
+            t0 = time.perf_counter()
+            await _executor.run(_warmup, m)
+            _READY["warmup_s"] = round(time.perf_counter() - t0, 3)
+    except Exception as e:
+        # Model yüklü ve hizmet verebilir: seçenek/ısınma hatası hazır olmayı engellemez, yalnızca kaydedilir
+        _READY["warmup_error"] = f"{type(e).__name__}: {e}"
+    _READY["state"] = "ready"
+
+# -------- Kesintisiz yeniden yükleme: yükle → doğrula (duman testi) → ısıt → referansı değiştir --------
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")  # boş → /admin/reload kapalı
+MODEL_WATCH_S = float(os.environ.get("MODEL_WATCH_S", "0"))  # >0 → model_out/ bu aralıkla izlenir (çok worker'da önerilen yol)
+MODEL_TABLE_GRACE_S = float(os.environ.get("MODEL_TABLE_GRACE_S", "60"))  # izleyici: yeni pakete bağlı PRED_LOS tablosunu en çok bu kadar bekler
+_reload_lock = threading.Lock()
+_RELOAD = {"reloads": 0, "failures": 0, "last_at": None, "last_s": None, "last_error": None}
+
+class ModelValidationError(ValueError):
+    pass
+
+VALIDATE_TABLE_N = 128  # duman testinde canlı hesapla karşılaştırılan PRED_LOS satırı (rastgele örnek)
+
+def _same_pred(a: float, b: float) -> bool:
+    """Tablo ve canlı yol farklı toplama sırası kullanır → son bit farkı kabul (NaN = NaN)."""
+    if math.isnan(a) or math.isnan(b):
+        return math.isnan(a) and math.isnan(b)
+    return math.isclose(a, b, rel_tol=1e-9)
+
+def _validate_model(m) -> dict:
+    """Duman testi: temsilî vakalar sonlu ve pozitif; PRED_LOS tablosu (varsa) rastgele örnekte canlı hesapla aynı."""
+    cases = _warmup_cases(m)
+    rules = [p for p, _meta in m.predict_one_many(cases)]
+    _, _, p_ens = m.xgb_predict_ens_many([(yg, b, key, None) for yg, b, key in cases])
+    if not all(math.isfinite(p) and p > 0 for p in rules):
+        raise ModelValidationError("kural tahmini sonlu/pozitif değil")
+    if m.XGB_ENS_ON and m.xgb_plain is not None and not all(math.isfinite(p) for p in p_ens.tolist()):
+        raise ModelValidationError("XGB tahmini sonlu değil")
+    # Örnek paket sürümüyle tohumlanır: aynı paket her worker'da aynı satırlarla doğrulanır
+    items = list(m.pred_table.items())
+    sample = random.Random(m.bundle_sha256).sample(items, min(VALIDATE_TABLE_N, len(items)))
+    if sample:
+        live = zip(m.predict_one_many([ck[:3] for ck, _v in sample]),
+                   m.xgb_predict_ens_many([ck[:3] + (None,) for ck, _v in sample])[2].tolist())
+        bad = sum(not (_same_pred(float(r), v[0]) and _same_pred(pe, v[1]))
+                  for ((r, _meta), pe), (_ck, v) in zip(live, sample))
+        if bad:
+            raise ModelValidationError(f"PRED_LOS tablosu modelle uyuşmuyor ({bad}/{len(sample)})")
+    return {"smoke_cases": len(cases), "table_checked": len(sample)}
+
+def _reload_model(force: bool = False) -> dict:
+    """Yeni paketi arka planda yükler; doğrulama geçerse atomik olarak devreye alır. Hata → eski model kalır."""
+    global _model, _model_err
+    if not _reload_lock.acquire(blocking=False):
+        return {"status": "busy"}
+    try:
+        t0 = time.perf_counter()
+        old = _model
+        try:
+            new = motor.load_model(MODEL_DIR)
+            load_s = time.perf_counter() - t0
+            if (not force and old is not None and new.bundle_sha256 == old.bundle_sha256
+                    and len(new.pred_table) == len(old.pred_table)):
+                return {"status": "unchanged", "model_version": old.bundle_sha256}
+            check = _validate_model(new)
+            _warmup(new)  # soğuk başlangıç sıçraması trafiğe yansımasın
+        except Exception as e:
+            _RELOAD["failures"] += 1
+            _RELOAD["last_error"] = f"{type(e).__name__}: {e}"
+            raise
+        with _model_lock:
+            _model = new
+            _model_err = None
+        _pred_cache.set_model(new.bundle_sha256)
+        _mark_ready(new, load_s)
+        _RELOAD["reloads"] += 1
+        _RELOAD["last_at"] = time.time()
+        _RELOAD["last_s"] = round(time.perf_counter() - t0, 3)
+        _RELOAD["last_error"] = None
+        return {"status": "swapped", "old_version": old.bundle_sha256 if old is not None else None,
+                "model_version": new.bundle_sha256, "reload_s": _RELOAD["last_s"], **check}
+    finally:
+        _reload_lock.release()
+
+def _model_files_stamp():
+    out = []
+    for name in (paket.BUNDLE_FILE, motor.PRED_TABLE_FILE):
+        try:
+            st = os.stat(os.path.join(MODEL_DIR, name))
+            out.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+async def _watch_model_dir() -> None:
+    """
+    model.bundle / pred_table.bundle değişince yeniden yükler (yazım atomik: tmp + replace).
+    proje.py PRED_LOS tablosunu paketten saniyeler sonra yazar: tablo yeni pakete bağlanana kadar
+    (ya da MODEL_TABLE_GRACE_S boyunca tablo gelmezse) beklenir — arada tablosuz model devreye girmez.
+    Değişiklik yalnızca devreye alınınca (ya da paket doğrulamayı geçemezse) işlenmiş sayılır; geçici hatalar yeniden denenir.
+    """
+    stamp = _model_files_stamp()
+    changed_at = None
+    retry_at, backoff = 0.0, MODEL_WATCH_S
+    while True:
+        await asyncio.sleep(MODEL_WATCH_S)
+        now = _model_files_stamp()
+        if now == stamp or now[0] is None:
+            changed_at = None
+            continue
+        if changed_at is None:
+            changed_at = time.monotonic()
+            retry_at, backoff = 0.0, MODEL_WATCH_S
+        if time.monotonic() < retry_at:
+            continue
+        if (time.monotonic() - changed_at < MODEL_TABLE_GRACE_S
+                and not await asyncio.to_thread(motor.pred_table_matches, MODEL_DIR)):
+            continue
+        try:
+            out = await asyncio.to_thread(_reload_model, True)
+        except ModelValidationError:
+            out = {}  # paket doğrulamayı geçmedi: dosyalar yeniden değişene kadar denenmez (hata /api/stats'ta)
+        except Exception:
+            # Geçici hata (G/Ç, yazımı süren tablo…): aynı değişiklik üstel geri çekilmeyle yeniden denenir
+            retry_at = time.monotonic() + backoff
+            backoff = min(backoff * 2, max(MODEL_RETRY_S, MODEL_WATCH_S))
+            continue
+        if out.get("status") == "busy":
+            continue  # /admin/reload sürüyor → bu değişiklik bir sonraki turda yeniden denenir
+        stamp = now
+        changed_at = None
+
+@asynccontextmanager
+async def _lifespan(_app):
+    tasks = [asyncio.create_task(_startup())]
+    if MODEL_WATCH_S > 0:
+        tasks.append(asyncio.create_task(_watch_model_dir()))
+    yield
+    for t in tasks:
+        t.cancel()
+
 # -------- FastAPI --------
-app = FastAPI(title="Yatış Günü Tahmin API (Formlu + JSON)")
+app = FastAPI(title="Yatış Günü Tahmin API (Formlu + JSON)", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -239,6 +528,42 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """Hazırlık: model yüklendi + ısındı → 200; aksi halde 503 (yük dengeleyici trafiği göndermesin)."""
+    m = _model
+    body = {**_READY, "bundle_format": paket.FORMAT_VERSION,
+            "created_at": (m.config.get("created_at") if m is not None else None)}
+    return JSONResponse(body, status_code=200 if _READY["state"] == "ready" else 503)
+
+@app.get("/api/stats")
+def api_stats():
+    m = _model
+    return {
+        "served_by": dict(_serve_counts),
+        "pred_table": {"size": len(m.pred_table) if m is not None else 0},
+        "neighbor_index": m.neighbor_index_src if m is not None else None,  # "bundle" | "rebuilt"
+        "pred_cache": _pred_cache.stats(),
+        "executor": _executor.stats(),
+        "microbatch": _batcher.stats(),
+        "single_flight": _single_flight.stats(),
+        "reload": dict(_RELOAD),
+    }
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request, force: bool = False):
+    """model_out/ içindeki paketi yeniden yükler (X-Admin-Token başlığı = ADMIN_TOKEN). Yalnızca bu süreci etkiler."""
+    if not ADMIN_TOKEN or request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    try:
+        # Tahmin havuzunu meşgul etmemek için ayrı iş parçacığında
+        out = await asyncio.to_thread(_reload_model, force)
+    except ModelValidationError as e:
+        return JSONResponse({"status": "rejected", "error": str(e)}, status_code=422)
+    except Exception as e:
+        return JSONResponse({"status": "failed", "error": str(e)}, status_code=500)
+    return JSONResponse(out, status_code=409 if out["status"] == "busy" else 200)
+
 @app.head("/")
 def root_head():
     return Response(status_code=200)
@@ -265,10 +590,7 @@ async def tahmin_post(
     icd_list: Optional[List[str]] = Form(default=None),
     icd_free: Optional[str] = Form(default=None),
 ):
-    _load_options_once()
-    try:
-        m = _get_model()
-    except Exception as e:
+    def error_page(e, status_code):
         error_html = f'<div class="warn"><b>Hata:</b> {e}</div>'
         page = HTML_PAGE_TPL.substitute(
             yas_opts=_make_opts(YASGRUP_LIST, [yasgrup]),
@@ -277,19 +599,24 @@ async def tahmin_post(
             result_block=error_html,
             warn_block="",
         )
-        return HTMLResponse(page, status_code=500)
+        return HTMLResponse(page, status_code=status_code)
 
-    icd_key, icds = _icd_key_from_inputs(icd_list, icd_free)
-    icd_key = m.clean_icd_set_key(icd_key)
+    try:
+        await _load_options_async()
+        m = await _get_model_async()
+    except yurutucu.Overloaded as e:
+        return error_page(e, 503)
+    except Exception as e:
+        return error_page(e, 500)
 
-    pred_rule, _meta = m.predict_one(yasgrup, bolum, icd_key)
-    _, _, p_ens = m.xgb_predict_ens(yasgrup, bolum, icd_key, icds)
+    icd_key, icds = _icd_key_from_inputs(icd_list, icd_free)
+    icd_key = m.icd_set_key(icd_key)
 
-    if p_ens is not None and not (isinstance(p_ens, float) and (math.isnan(p_ens) or math.isinf(p_ens))):
-        w = _get_blend_w(0.50)
-        pred_final = (1.0 - w) * float(pred_rule) + w * float(p_ens)
-    else:
-        pred_final = float(pred_rule)
+    try:
+        pred_rule, p_ens, source = await _predict(m, yasgrup, bolum, icd_key, icds)
+    except yurutucu.Overloaded as e:
+        return error_page(e, 503)
+    pred_final = _blend_final(m, pred_rule, p_ens)
 
     pred_final_rounded = m.round_half_up(pred_final)
 
@@ -297,6 +624,7 @@ async def tahmin_post(
     <div class="result">
       <div><b>Seçim</b>: YaşGrup=<code>{yasgrup}</code>, Bölüm=<code>{bolum}</code>, ICD=<code>{', '.join(icds) if icds else '(yok)'}</code></div>
       <div style="margin-top:8px;"><b>Tahminî Yatış Günü (Pred_Final_Rounded)</b>: <span style="font-size:20px;">{pred_final_rounded}</span></div>
+      <div class="muted">Kaynak: {source}</div>
     </div>
     """
 
@@ -309,30 +637,20 @@ async def tahmin_post(
     )
     return HTMLResponse(page)
 
-@app.post("/api/predict")
-async def api_predict(payload: dict):
-    _load_options_once()
-    try:
-        m = _get_model()
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
-
+def _parse_case(payload: dict):
+    """JSON vaka → (yasgrup, bolum, icds_in, ham ICD anahtarı); icd liste değilse ya da öğeleri skaler değilse ValueError."""
     yasgrup = str(payload.get("yasgrup", "")).strip()
     bolum   = str(payload.get("bolum", "")).strip()
     icds_in = payload.get("icd", []) or []
     if not isinstance(icds_in, list):
-        return JSONResponse({"error": "icd must be list"}, status_code=400)
-
-    icd_key = m.clean_icd_set_key("||".join(sorted(set([str(x).strip().upper() for x in icds_in if str(x).strip()]))))
-    pred_rule, _meta = m.predict_one(yasgrup, bolum, icd_key)
-    _, _, p_ens = m.xgb_predict_ens(yasgrup, bolum, icd_key, icds_in)
-
-    if p_ens is not None and not (isinstance(p_ens, float) and (math.isnan(p_ens) or math.isinf(p_ens))):
-        w = _get_blend_w(0.50)
-        pred_final = (1.0 - w) * float(pred_rule) + w * float(p_ens)
-    else:
-        pred_final = float(pred_rule)
-
+        raise ValueError("icd must be list")
+    if any(isinstance(x, (list, dict)) for x in icds_in):  # iç içe öğe anahtar/imza hesabında hashlenemez
+        raise ValueError("icd items must be strings")
+    raw_key = "||".join(sorted(set([str(x).strip().upper() for x in icds_in if str(x).strip()])))
+    return yasgrup, bolum, icds_in, raw_key
+
+def _case_response(m, yasgrup, bolum, icds_in, pred_rule, p_ens, source) -> dict:
+    pred_final = _blend_final(m, pred_rule, p_ens)
     return {
         "yasgrup": yasgrup,
         "bolum": bolum,
@@ -341,8 +659,94 @@ async def api_predict(payload: dict):
         "pred_xgb_ens": (None if p_ens is None else float(p_ens)),
         "pred_final": float(pred_final),
         "pred_final_rounded": m.round_half_up(pred_final),
+        "source": source,
     }
 
+@app.post("/api/predict")
+async def api_predict(payload: dict):
+    try:
+        await _load_options_async()
+        m = await _get_model_async()
+    except yurutucu.Overloaded as e:
+        return _overloaded_json(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    try:
+        yasgrup, bolum, icds_in, raw_key = _parse_case(payload)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    icd_key = m.icd_set_key(raw_key)
+    try:
+        pred_rule, p_ens, source = await _predict(m, yasgrup, bolum, icd_key, icds_in)
+    except yurutucu.Overloaded as e:
+        return _overloaded_json(e)
+    return _case_response(m, yasgrup, bolum, icds_in, pred_rule, p_ens, source)
+
+@app.post("/api/predict/batch")
+async def api_predict_batch(payload: dict):
+    """
+    {"cases": [{yasgrup, bolum, icd}, ...]} → {"n": .., "results": [...]} (sıra korunur).
+    ICD anahtarları toplu normalize edilir, XGB çifti tek CSR üzerinde birer kez çalışır,
+    kural motoru her benzersiz (YaşGrup, Bölüm, ICD_Set_Key) için bir kez hesaplanır; PRED_LOS tablosu ve önbellek ortaktır.
+    Hatalı vaka {"index", "error"} döner; diğerleri etkilenmez.
+    """
+    try:
+        m = await _get_model_async()
+    except yurutucu.Overloaded as e:
+        return _overloaded_json(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    cases = payload.get("cases")
+    if not isinstance(cases, list):
+        return JSONResponse({"error": "cases must be list"}, status_code=400)
+    if len(cases) > BATCH_MAX:
+        return JSONResponse({"error": f"too many cases (max {BATCH_MAX})"}, status_code=413)
+
+    parsed, errors = [], {}
+    for i, c in enumerate(cases):
+        try:
+            if not isinstance(c, dict):
+                raise ValueError("case must be object")
+            parsed.append((i,) + _parse_case(c))
+        except ValueError as e:
+            errors[i] = str(e)
+
+    # Toplu normalize: aynı ham anahtar bir kez çözülür (parçalar modelin kanonik ICD sözlüğünden)
+    key_cache = {}
+    for _i, _yg, _b, _icds, raw_key in parsed:
+        if raw_key not in key_cache:
+            key_cache[raw_key] = m.icd_set_key(raw_key)
+    keys = [key_cache[p[4]] for p in parsed]
+
+    # Tabloda/önbellekte olmayan benzersiz kombinasyonlar toplu hesaplanır
+    cks = [m.cache_key(yg, b, key, icds) for (_i, yg, b, icds, _r), key in zip(parsed, keys)]
+    values, todo = {}, {}
+    for ck, (_i, yg, b, icds, _r), key in zip(cks, parsed, keys):
+        if ck in values or ck in todo:
+            continue
+        hit = _lookup(m, ck)
+        if hit is not None:
+            values[ck] = hit
+        else:
+            todo[ck] = (yg, b, key, icds)
+    if todo:
+        try:
+            values.update(await _executor.run(_predict_live_many, m, todo))
+        except yurutucu.Overloaded as e:
+            return _overloaded_json(e)
+
+    results = [None] * len(cases)
+    for i, msg in errors.items():
+        results[i] = {"index": i, "error": msg}
+    for (i, yg, b, icds, _r), ck in zip(parsed, cks):
+        pred_rule, pe, source = values[ck]
+        _serve_counts[source] += 1
+        results[i] = _case_response(m, yg, b, icds, pred_rule, pe, source)
+    return {"n": len(cases), "results": results}
+
 @app.get("/api/options")
 def api_options():
     _load_options_once()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Excel → sütunsal disk önbelleği (paket biçimi, memmap'lenebilir numpy bölümleri)
+# openpyxl ayrıştırması yalnızca kaynak değiştiğinde çalışır; eğitim ve servis önbellekten okur.
+# Anahtar: kaynağın boyut + mtime'ı; bunlar değiştiyse sha256 karşılaştırılır (dokunulmuş ama aynı dosya → önbellek geçerli, yeni mtime kaydedilir).
+# Ingest (tek sefer):  python veri.py [Veri2024.xlsx ...]
+import os, sys, time, pickle, hashlib
+
+import numpy as np
+import pandas as pd
+
+import paket
+
+CACHE_DIR = ".cache"
+CACHE_FORMAT = 1
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_path_for(path: str) -> str:
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), CACHE_DIR, os.path.basename(path) + ".cols")
+
+def _source_info(path: str, with_hash: bool = True) -> dict:
+    st = os.stat(path)
+    info = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        info["sha256"] = file_sha256(path)
+    return info
+
+# ---- Sütun kodlama: sayısal/tarih → ham dizi; metin → offsets+blob (+null maskesi); karışık → pickle
+def _encode_column(i: int, s: pd.Series):
+    p = f"c{i}"
+    values = s.to_numpy()
+    if s.dtype.kind in "biuf":
+        return {f"{p}.v": values}, {"kind": "num"}
+    if s.dtype.kind == "M":
+        return {f"{p}.v": values.view(np.int64)}, {"kind": "datetime", "np_dtype": values.dtype.str}
+
+    mask = s.isna().to_numpy()
+    present = values[~mask]
+    if all(isinstance(v, str) for v in present):
+        off, blob = paket.encode_strings(present.tolist())
+        return {f"{p}.null": mask.astype(np.uint8), f"{p}.off": off, f"{p}.blob": blob}, {"kind": "str"}
+    raw = pickle.dumps(values.tolist(), protocol=pickle.HIGHEST_PROTOCOL)
+    return {f"{p}.pkl": np.frombuffer(raw, dtype=np.uint8)}, {"kind": "pickle"}
+
+def _decode_column(i: int, cm: dict, sec: dict, nrows: int) -> pd.Series:
+    p = f"c{i}"
+    kind = cm["kind"]
+    if kind == "num":
+        s = pd.Series(np.array(sec[f"{p}.v"]))
+    elif kind == "datetime":
+        s = pd.Series(np.array(sec[f"{p}.v"]).view(cm["np_dtype"]))
+    elif kind == "str":
+        mask = sec[f"{p}.null"].astype(bool)
+        out = np.full(nrows, np.nan, dtype=object)
+        out[~mask] = paket.decode_strings(sec[f"{p}.off"], sec[f"{p}.blob"])
+        s = pd.Series(out, dtype=object)
+    else:
+        s = pd.Series(pickle.loads(bytes(sec[f"{p}.pkl"])), dtype=object)
+    if str(s.dtype) != cm["dtype"]:
+        s = s.astype(cm["dtype"])
+    s.name = cm["name"]
+    return s
+
+def write_cache(df: pd.DataFrame, cache_path: str, source: dict) -> None:
+    sections, cols = {}, []
+    for i, c in enumerate(df.columns):
+        sec, cm = _encode_column(i, df[c])
+        sections.update(sec)
+        cols.append({"name": c, "dtype": str(df[c].dtype), **cm})
+    meta = {"cache_format": CACHE_FORMAT, "source": source, "nrows": int(len(df)), "columns": cols}
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    paket.write_bundle(cache_path, sections, meta)
+
+def _read_cache(cache_path: str, columns=None) -> pd.DataFrame:
+    meta, sec, _sha = paket.read_bundle(cache_path, verify=False)
+    nrows = meta["nrows"]
+    data = {}
+    for i, cm in enumerate(meta["columns"]):
+        if columns is not None and cm["name"] not in columns:
+            continue
+        data[cm["name"]] = _decode_column(i, cm, sec, nrows)
+    return pd.DataFrame(data, index=pd.RangeIndex(nrows))
+
+def _cache_is_fresh(path: str, cache_path: str) -> bool:
+    if not os.path.exists(cache_path):
+        return False
+    meta, _sec, _sha = paket.read_bundle(cache_path, verify=False)
+    if meta.get("cache_format") != CACHE_FORMAT:
+        return False
+    cached = meta["source"]
+    now = _source_info(path, with_hash=False)
+    if now["size"] == cached["size"] and now["mtime_ns"] == cached["mtime_ns"]:
+        return True
+    if now["size"] != cached["size"]:
+        return False
+    sha = file_sha256(path)
+    if sha != cached["sha256"]:
+        return False
+    try:
+        _refresh_source(cache_path, {**now, "sha256": sha})
+    except OSError:
+        pass  # salt-okunur disk: önbellek yine geçerli, yalnızca sonraki okumalar da hash'ler
+    return True
+
+def _refresh_source(cache_path: str, source: dict) -> None:
+    """Dokunulmuş ama aynı kaynak: yeni mtime meta'ya yazılır → sonraki okumalar yine boyut + mtime ile geçer."""
+    meta, sec, _sha = paket.read_bundle(cache_path, verify=False)
+    paket.write_bundle(cache_path, sec, {**meta, "source": source})
+
+def ingest(path: str) -> str:
+    """Excel'i (yeniden) ayrıştırıp sütunsal önbelleğe yazar; önbellek yolunu döner."""
+    cache_path = cache_path_for(path)
+    source = _source_info(path)
+    df = pd.read_excel(path)
+    write_cache(df, cache_path, source)
+    return cache_path
+
+def read_veri(path: str, columns=None) -> pd.DataFrame:
+    """
+    pd.read_excel(path) yerine: önbellek tazeyse oradan (istenirse yalnız `columns`) okur,
+    değilse Excel'i bir kez ayrıştırıp önbelleği yazar. Önbellek yazılamazsa (salt-okunur disk) Excel sonucu döner.
+    """
+    cache_path = cache_path_for(path)
+    try:
+        if _cache_is_fresh(path, cache_path):
+            return _read_cache(cache_path, columns)
+    except Exception:
+        pass  # bozuk/eski önbellek → yeniden üret
+
+    source = _source_info(path)
+    df = pd.read_excel(path)
+    try:
+        write_cache(df, cache_path, source)
+    except OSError:
+        pass
+    if columns is not None:
+        df = df[[c for c in df.columns if c in columns]]
+    return df
+
+
+if __name__ == "__main__":
+    for p in (sys.argv[1:] or ["Veri2024.xlsx"]):
+        t0 = time.perf_counter()
+        cp = ingest(p)
+        t1 = time.perf_counter()
+        read_veri(p)
+        t2 = time.perf_counter()
+        print(f"OK -> {cp}  (Excel: {t1 - t0:.1f}s, önbellekten okuma: {t2 - t1:.2f}s)")
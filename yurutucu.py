@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Servis katmanı: CPU-yoğun tahmini (kural motoru + XGB) asyncio olay döngüsünün dışında, sınırlı bir iş parçacığı
+# havuzunda çalıştırır. Havuz + kuyruk doluysa yeni iş hemen reddedilir (Overloaded → HTTP 503), böylece /health
+# ve önbellekten dönen istekler yavaş tahminlerin arkasında beklemez.
+# İş parçacığı (süreç değil): model paylaşılır (kopya yok); XGBoost predict GIL'i bırakır.
+# Kural motoru saf Python (GIL'e bağlı): çekirdekten fazla iş parçacığı olay döngüsünü GIL için bekletir.
+#   PRED_WORKERS (varsayılan min(4, CPU sayısı)), PRED_QUEUE_MAX (bekleyen iş sınırı, varsayılan 64)
+import os, time, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(RuntimeError):
+    """Havuz ve kuyruk dolu — istemci daha sonra yeniden denemeli."""
+
+
+class PredictionExecutor:
+    def __init__(self, workers: int = 1, queue_max: int = 64):
+        self.workers = max(1, int(workers))
+        self.queue_max = max(0, int(queue_max))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tahmin")
+        self._lock = threading.Lock()
+        self._pending = 0  # kabul edilmiş, bitmemiş (kuyrukta + çalışan)
+        self._running = 0
+        self.submitted = self.completed = self.failed = self.rejected = 0
+        self.max_queue_depth = 0
+        self.wait_s = self.run_s = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._pending - self._running)
+
+    async def run(self, fn, *args):
+        """fn(*args)'ı havuzda çalıştırır ve sonucu bekler; kapasite doluysa Overloaded."""
+        with self._lock:
+            if self._pending >= self.workers + self.queue_max:
+                self.rejected += 1
+                raise Overloaded(f"tahmin kuyruğu dolu ({self.queue_max})")
+            self._pending += 1
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        t_submit = time.perf_counter()
+
+        def job():
+            t0 = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self.wait_s += t0 - t_submit
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self.run_s += time.perf_counter() - t0
+
+        try:
+            out = await asyncio.get_running_loop().run_in_executor(self._pool, job)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self.completed += 1
+        return out
+
+    def stats(self) -> dict:
+        done = self.completed + self.failed
+        return {
+            "workers": self.workers, "queue_max": self.queue_max,
+            "running": self._running, "queue_depth": self.queue_depth, "max_queue_depth": self.max_queue_depth,
+            "submitted": self.submitted, "completed": self.completed, "failed": self.failed, "rejected": self.rejected,
+            "avg_wait_ms": (self.wait_s / done * 1e3) if done else 0.0,
+            "avg_run_ms": (self.run_s / done * 1e3) if done else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def from_env() -> PredictionExecutor:
+    return PredictionExecutor(
+        workers=int(os.environ.get("PRED_WORKERS", min(4, os.cpu_count() or 1))),
+        queue_max=int(os.environ.get("PRED_QUEUE_MAX", "64")),
+    )
+
+
+# ---- Tek uçuş: aynı anahtar için süren hesap varsa yenisi başlatılmaz, sonucu paylaşılır
+class SingleFlight:
+    """do(key, coro_fn): anahtar için uçuşta görev yoksa coro_fn()'u görev olarak başlatır; varsa ona katılır."""
+
+    def __init__(self):
+        self._calls = {}  # key → asyncio.Task
+        self.leaders = self.saved = 0
+
+    async def do(self, key, coro_fn):
+        task = self._calls.get(key)
+        if task is not None:
+            self.saved += 1
+        else:
+            # Görev isteği başlatandan bağımsız: ilk istemci koparsa (iptal) bekleyenler yine sonucu alır
+            task = asyncio.ensure_future(coro_fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _t, k=key: self._calls.pop(k, None))
+            self.leaders += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._calls), "computations": self.leaders, "saved": self.saved}
+
+
+# ---- Mikro-toplama: kısa pencerede gelen canlı tahminleri tek işte toplar (tek CSR, her booster bir kez)
+_HIST_EDGES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+def _hist_label(n: int) -> str:
+    lo = 1
+    for hi in _HIST_EDGES:
+        if n <= hi:
+            return str(hi) if lo == hi else f"{lo}-{hi}"
+        lo = hi + 1
+    return f"{lo}+"
+
+
+class MicroBatcher:
+    """
+    submit(item) → sonucu bekler. Toplama penceresi (window_ms) dolunca ya da max_batch öğe birikince
+    run_batch(items) → results (aynı sıra) havuzda çalışır. Havuzda boş işçi yoksa pencere dolsa da beklenir;
+    biten toplama sıradakini tetikler (yük arttıkça toplamalar kendiliğinden büyür).
+    """
+
+    def __init__(self, executor: PredictionExecutor, run_batch, window_ms: float = 2.0, max_batch: int = 64):
+        self.executor = executor
+        self.run_batch = run_batch
+        self.window_s = max(0.0, float(window_ms)) / 1e3
+        self.max_batch = max(1, int(max_batch))
+        self._items = []  # [(item, future)]
+        self._timer = None
+        self._window_done = False
+        self._inflight = 0
+        self.batches = self.items = 0
+        self.flush_reasons = {"size": 0, "window": 0}
+        self.size_hist = {}
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._items.append((item, fut))
+        if len(self._items) >= self.max_batch:
+            self._flush("size")
+        elif self._timer is None and not self._window_done:
+            self._timer = loop.call_later(self.window_s, self._on_window)
+        return await fut
+
+    def _on_window(self):
+        self._timer = None
+        self._window_done = True
+        if self._inflight < self.executor.workers:
+            self._flush("window")
+
+    def _flush(self, reason: str):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._window_done = False
+        if not self._items:
+            return
+        batch, self._items = self._items[:self.max_batch], self._items[self.max_batch:]
+        n = len(batch)
+        self.batches += 1
+        self.items += n
+        self.flush_reasons[reason] += 1
+        label = _hist_label(n)
+        self.size_hist[label] = self.size_hist.get(label, 0) + 1
+        self._inflight += 1
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            results = await self.executor.run(self.run_batch, [item for item, _f in batch])
+            for (_item, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+        except BaseException as e:
+            for _item, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            self._inflight -= 1
+            if self._items:
+                if len(self._items) >= self.max_batch or self._window_done:
+                    self._flush("size" if len(self._items) >= self.max_batch else "window")
+                elif self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.window_s, self._on_window)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window_s * 1e3, "max_batch": self.max_batch,
+            "batches": self.batches, "items": self.items,
+            "mean_batch": (self.items / self.batches) if self.batches else 0.0,
+            "pending": len(self._items), "inflight": self._inflight,
+            "flush_reasons": dict(self.flush_reasons),
+            "batch_size_hist": {k: self.size_hist[k] for k in sorted(self.size_hist, key=lambda s: int(s.split("-")[0].rstrip("+")))},
+        }